@@ -37,6 +37,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
      'rest_framework.authtoken',# Add Django REST Framework
     'sede', # Mover sede al principio de las apps personalizadas
@@ -55,7 +56,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     # 'django.middleware.csrf.CsrfViewMiddleware', # Comentado temporalmente para depuración de "Unsupported Media Type"
     'django.contrib.auth.middleware.AuthenticationMiddleware',
-    # 'inventory.middleware.CurrentUserMiddleware',
+    # Contexto de la solicitud (usuario para el historial, X-Request-ID, Server-Timing).
+    'inventory.middleware.CurrentUserMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -148,7 +150,9 @@ REST_FRAMEWORK = {
         'rest_framework.parsers.JSONParser',
         'rest_framework.parsers.FormParser',
         'rest_framework.parsers.MultiPartParser'
-    ]
+    ],
+    # Paginación opcional: solo se activa si el cliente envía ?cursor= o ?page_size=
+    'DEFAULT_PAGINATION_CLASS': 'inventory.pagination.KeysetPagination',
 }
 
 # Lista de orígenes permitidos para CORS
@@ -161,3 +165,30 @@ CORS_ALLOWED_ORIGINS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+
+# Historial diferido: si es True, los cambios de equipos, periféricos y mantenimientos
+# se encolan en inventory.EventoHistorial dentro de la misma transacción y el comando
+# `procesar_historial` los escribe por lotes (ver inventory/outbox.py).
+HISTORIAL_DIFERIDO = False
+
+# Formato del historial de equipos: False escribe una fila por campo modificado; True,
+# una fila por guardado con el diff en JSONB (HistorialEquipo.cambios). La API y el
+# admin muestran ambos por campo. `compactar_historial_equipos` convierte las filas viejas.
+HISTORIAL_EQUIPO_COMPACTO = False
+
+# Historial particionado por mes (inventory/partitions.py): `archivar_historial` exporta
+# a este directorio y borra las particiones con más de estos meses de antigüedad.
+HISTORIAL_MESES_RETENCION = 24
+HISTORIAL_DIRECTORIO_ARCHIVO = BASE_DIR / 'archivo_historial'
+
+# Caché de las estadísticas del dashboard por sede (inventory/dashboard.py), invalidada
+# por señales. Las versiones que invalidan viven en el caché, así que debe ser compartido
+# entre procesos (base de datos, Redis, Memcached): con LocMemCache una invalidación no
+# llega a los demás workers (check inventory.W001). La tabla se crea en cada migrate.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'cache_compartido',
+    }
+}
+DASHBOARD_CACHE_TIMEOUT = 300
@@ -1,16 +1,39 @@
 from django.contrib import admin
+from django.utils.html import format_html_join
+from django.utils.safestring import mark_safe
 
 from mantenimientos.models import Mantenimiento
 from .models import Equipo, Periferico, Licencia, Pasisalvo, HistorialEquipo
+from .search import buscar_equipos
 
 
 class HistorialEquipoInline(admin.TabularInline):
     model = HistorialEquipo
     extra = 0
-    readonly_fields = ('fecha_cambio', 'usuario', 'campo_modificado', 'valor_anterior', 'valor_nuevo', 'tipo_accion')
+    fields = readonly_fields = ('fecha_cambio', 'usuario', 'campos', 'valores_anteriores', 'valores_nuevos', 'tipo_accion')
     can_delete = False
     verbose_name_plural = 'Historial de Cambios'
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('usuario')
+
+    # Un registro compacto ocupa una fila del inline, con un renglón por campo.
+    @staticmethod
+    def _por_campo(obj, atributo):
+        return format_html_join(mark_safe('<br>'), '{}', ((getattr(e, atributo),) for e in obj.entradas()))
+
+    @admin.display(description='Campo Modificado')
+    def campos(self, obj):
+        return self._por_campo(obj, 'campo_modificado')
+
+    @admin.display(description='Valor Anterior')
+    def valores_anteriores(self, obj):
+        return self._por_campo(obj, 'valor_anterior')
+
+    @admin.display(description='Valor Nuevo')
+    def valores_nuevos(self, obj):
+        return self._por_campo(obj, 'valor_nuevo')
+
     def has_add_permission(self, request, obj=None):
         return False
 
@@ -23,6 +46,12 @@ class EquipoAdmin(admin.ModelAdmin):
     list_filter = ('sede', 'estado_tecnico', 'estado_disponibilidad', 'marca')
     search_fields = ('nombre', 'serial', 'empleado_asignado__nombre')
 
+    def get_search_results(self, request, queryset, search_term):
+        # Usa el índice de texto completo en lugar de ILIKE '%...%' sobre cada campo.
+        if not search_term:
+            return queryset, False
+        return buscar_equipos(queryset, search_term), False
+
 # Register your models here.
 
 
@@ -1,4 +1,17 @@
 from django.apps import AppConfig
+from django.core import checks
+from django.core.management import call_command
+from django.db.models.signals import post_migrate
+
+
+def crear_particiones_pendientes(sender, **kwargs):
+    from .partitions import asegurar_particiones
+    asegurar_particiones()
+
+
+def crear_tabla_cache(sender, using, **kwargs):
+    # Solo actúa si CACHES usa DatabaseCache y la tabla no existe.
+    call_command('createcachetable', database=using, verbosity=0)
 
 
 class InventoryConfig(AppConfig):
@@ -7,3 +20,8 @@ class InventoryConfig(AppConfig):
     
     def ready(self):
         import inventory.signals
+        # Cada migrate deja creadas las particiones del historial de los próximos meses.
+        post_migrate.connect(crear_particiones_pendientes, sender=self)
+        post_migrate.connect(crear_tabla_cache, sender=self)
+        from .checks import revisar_cache_compartido
+        checks.register(revisar_cache_compartido, checks.Tags.caches)
@@ -0,0 +1,125 @@
+from django.db import router, transaction
+from django.db.models.signals import post_save, pre_save
+
+
+class SnapshotMixin:
+    """
+    Guarda los valores leídos de la base (por attname) para que la captura de cambios
+    compare contra ellos sin volver a leer la fila en pre_save.
+
+    save() corre dentro de una transacción (sin savepoint: si ya hay una abierta, se une
+    a ella), de modo que el UPDATE/INSERT y lo que escriben los consumidores se
+    confirman o se revierten juntos.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._valores_originales = dict(zip(field_names, values))
+        return instance
+
+    def valores_cargados(self):
+        return {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields if field.attname in self.__dict__
+        }
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+        # Lo guardado pasa a ser el punto de comparación del siguiente save().
+        valores = self.valores_cargados()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            self._valores_originales = valores
+        else:
+            guardados = {self._meta.get_field(nombre).attname for nombre in update_fields}
+            self._valores_originales = {
+                **getattr(self, '_valores_originales', {}),
+                **{attname: valor for attname, valor in valores.items() if attname in guardados},
+            }
+
+
+class Cambio:
+    """
+    Diferencia de un save(): valores anteriores y nuevos por campo, con las relaciones
+    comparadas por id (no se cargan los objetos relacionados).
+    """
+
+    def __init__(self, instance, creado, anteriores, update_fields=None):
+        self.instance = instance
+        self.creado = creado
+        self.anteriores = anteriores or {}
+        # nombre del campo -> (valor anterior, valor nuevo), solo los que cambiaron.
+        self.campos = {}
+        if creado:
+            return
+        for field in instance._meta.concrete_fields:
+            if update_fields is not None and field.name not in update_fields:
+                continue
+            if field.attname not in self.anteriores:
+                continue
+            anterior, nuevo = self.anteriores[field.attname], getattr(instance, field.attname)
+            if anterior != nuevo:
+                self.campos[field.name] = (anterior, nuevo)
+
+    def cambio(self, *nombres):
+        return any(nombre in self.campos for nombre in nombres)
+
+    def anterior(self, nombre):
+        """
+        Valor anterior del campo (el id para relaciones); None si la instancia es nueva.
+        """
+        if self.creado:
+            return None
+        attname = self.instance._meta.get_field(nombre).attname
+        return self.anteriores.get(attname, getattr(self.instance, attname))
+
+
+class CapturaCambios:
+    """
+    Captura de cambios de un modelo: calcula el Cambio una sola vez por save() y se lo
+    entrega a cada consumidor registrado, en orden de registro.
+
+        cambios_equipo = CapturaCambios(Equipo)
+
+        @cambios_equipo.consumidor
+        def registrar_algo(cambio):
+            ...
+
+    El modelo debe usar SnapshotMixin; solo las instancias que no se leyeron de la base
+    (o con campos diferidos) cuestan una consulta para obtener sus valores anteriores.
+    """
+
+    def __init__(self, modelo):
+        self.modelo = modelo
+        self.consumidores = []
+        uid = f'captura_cambios_{modelo._meta.label_lower}'
+        pre_save.connect(self._antes_de_guardar, sender=modelo, weak=False, dispatch_uid=uid)
+        post_save.connect(self._despues_de_guardar, sender=modelo, weak=False, dispatch_uid=uid)
+
+    def consumidor(self, funcion):
+        self.consumidores.append(funcion)
+        return funcion
+
+    def _antes_de_guardar(self, sender, instance, **kwargs):
+        instance._valores_anteriores = None
+        if instance.pk is None:
+            return
+        anteriores = {} if instance._state.adding else dict(getattr(instance, '_valores_originales', {}))
+        faltantes = [attname for attname in instance.valores_cargados() if attname not in anteriores]
+        if faltantes:
+            fila = sender._default_manager.filter(pk=instance.pk).values(*faltantes).first()
+            if fila is None:
+                return
+            anteriores.update(fila)
+        instance._valores_anteriores = anteriores
+
+    def _despues_de_guardar(self, sender, instance, created, update_fields=None, **kwargs):
+        anteriores = getattr(instance, '_valores_anteriores', None)
+        if not created and anteriores is None:
+            return
+        cambio = Cambio(instance, created, anteriores, update_fields)
+        for consumidor in self.consumidores:
+            consumidor(cambio)
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core import checks
+
+# Backends cuyo contenido vive en la memoria de cada proceso.
+CACHES_POR_PROCESO = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def revisar_cache_compartido(app_configs, **kwargs):
+    """
+    El dashboard guarda en el caché 'default' las versiones que lo invalidan: si cada
+    proceso tiene su propio caché, una escritura en un worker no invalida las
+    estadísticas que sirven los demás hasta que vencen.
+    """
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend not in CACHES_POR_PROCESO:
+        return []
+    return [checks.Warning(
+        f"CACHES['default'] usa {backend.rsplit('.', 1)[-1]}, que no se comparte entre procesos.",
+        hint=(
+            'Con varios workers el dashboard puede servir estadísticas anteriores a un cambio durante '
+            'DASHBOARD_CACHE_TIMEOUT segundos. Use DatabaseCache, RedisCache o Memcached.'
+        ),
+        id='inventory.W001',
+    )]
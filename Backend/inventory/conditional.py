@@ -0,0 +1,139 @@
+import hashlib
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+PREFIJO_CAMBIO = 'condicional:cambio'
+
+
+def _clave_cambio(modelo):
+    return f'{PREFIJO_CAMBIO}:{modelo._meta.label_lower}'
+
+
+def registrar_cambio(modelo):
+    """
+    Marca, al confirmar la transacción, que `modelo` cambió sin mover ningún
+    actualizado_en de las filas servidas: un borrado, o un cambio en una tabla sin
+    marca de tiempo cuyos datos van anidados en la respuesta (sede, empleado...).
+    """
+    transaction.on_commit(lambda: cache.set(_clave_cambio(modelo), timezone.now(), timeout=None))
+
+
+def ultimos_cambios(modelos):
+    claves = [_clave_cambio(modelo) for modelo in modelos]
+    marcas = cache.get_many(claves)
+    for clave in claves:
+        if clave not in marcas:
+            # Sin marca (caché vacío o expulsado) no se sabe cuándo cambió: se toma ahora,
+            # y todos los procesos comparten la misma.
+            ahora = timezone.now()
+            marcas[clave] = ahora if cache.add(clave, ahora, timeout=None) else cache.get(clave, ahora)
+    return [(marcas[clave], None) for clave in claves]
+
+
+class ConditionalGetMixin:
+    """
+    GET condicional (ETag / Last-Modified) para vistas de listado y detalle.
+
+    El validador se calcula con una consulta barata, sin serializar nada:
+    - listado: MAX(actualizado_en) y COUNT(*) del queryset ya filtrado por sede;
+    - detalle: actualizado_en del objeto.
+    Si el cliente envía If-None-Match / If-Modified-Since y coincide, se responde 304.
+
+    `conditional_related` lista relaciones inversas cuyos cambios también alteran la
+    respuesta (por ejemplo, los mantenimientos de un equipo); se agregan con una
+    consulta adicional por relación.
+
+    Lo que no mueve ningún actualizado_en también entra en ambos validadores:
+    - `conditional_related_timestamps`: actualizado_en de objetos anidados (por ejemplo
+      'equipo_asociado__actualizado_en'), agregado en la misma consulta;
+    - `conditional_related_models`: modelos anidados sin marca de tiempo (sede,
+      empleado...), vía la marca que registran sus señales (`registrar_cambio`);
+    - en el listado, además, los borrados del propio modelo y de `conditional_related`,
+      que no cambian MAX(actualizado_en) y que un cliente con solo If-Modified-Since
+      no vería con el conteo.
+    """
+    conditional_timestamp_field = 'actualizado_en'
+    conditional_related = ()
+    conditional_related_timestamps = ()
+    conditional_related_models = ()
+
+    def get_conditional_queryset(self):
+        return self.filter_queryset(self.get_queryset())
+
+    def _aggregate_validators(self, queryset):
+        anidados = {
+            f'anidado_{i}': Max(campo) for i, campo in enumerate(self.conditional_related_timestamps)
+        }
+        resumen = queryset.order_by().aggregate(
+            ultimo=Max(self.conditional_timestamp_field), total=Count('pk'), **anidados
+        )
+        return [(resumen['ultimo'], resumen['total'])] + [(resumen[nombre], None) for nombre in anidados]
+
+    def _deleted_models(self):
+        model = self.get_queryset().model
+        return [model] + [model._meta.get_field(nombre).related_model for nombre in self.conditional_related]
+
+    def _related_validators(self, filtro):
+        partes = []
+        model = self.get_queryset().model
+        for nombre in self.conditional_related:
+            relacion = model._meta.get_field(nombre)
+            resumen = relacion.related_model._default_manager.filter(
+                **{f'{relacion.field.name}__{lookup}': valor for lookup, valor in filtro.items()}
+            ).order_by().aggregate(ultimo=Max('actualizado_en'), total=Count('pk'))
+            partes.append((resumen['ultimo'], resumen['total']))
+        return partes
+
+    def _conditional_response(self, request, partes):
+        fechas = [ultimo for ultimo, _ in partes if ultimo is not None]
+        last_modified = max(fechas) if fechas else None
+        # La respuesta también depende de los parámetros (campos, cursor, filtros) y del usuario.
+        firma = '|'.join([request.get_full_path(), str(request.user.pk)] + [
+            f'{ultimo.isoformat() if ultimo else "-"}:{total}' for ultimo, total in partes
+        ])
+        etag = quote_etag(hashlib.md5(firma.encode('utf-8')).hexdigest())
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        not_modified = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        return not_modified, etag, last_modified
+
+    @staticmethod
+    def _set_validators(response, etag, last_modified):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.get_conditional_queryset()
+        partes = self._aggregate_validators(queryset)
+        if self.conditional_related:
+            partes += self._related_validators({'in': queryset.values('pk')})
+        partes += ultimos_cambios(self._deleted_models() + list(self.conditional_related_models))
+        not_modified, etag, last_modified = self._conditional_response(request, partes)
+        if not_modified is not None:
+            return self._set_validators(not_modified, etag, last_modified)
+        return self._set_validators(super().list(request, *args, **kwargs), etag, last_modified)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        if self.conditional_related_timestamps:
+            partes = self._aggregate_validators(type(instance)._default_manager.filter(pk=instance.pk))
+        else:
+            partes = [(getattr(instance, self.conditional_timestamp_field), 1)]
+        if self.conditional_related:
+            partes += self._related_validators({'exact': instance.pk})
+        if self.conditional_related_models:
+            partes += ultimos_cambios(self.conditional_related_models)
+        not_modified, etag, last_modified = self._conditional_response(request, partes)
+        if not_modified is not None:
+            return self._set_validators(not_modified, etag, last_modified)
+        serializer = self.get_serializer(instance)
+        return self._set_validators(Response(serializer.data), etag, last_modified)
+
@@ -0,0 +1,508 @@
+import time
+import uuid
+from datetime import datetime, time as dt_time, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, DateField, F, Q
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from mantenimientos.models import Mantenimiento
+from sede.models import Sede
+from .models import (
+    EstadisticaDiaria, Equipo, HistorialMovimientoEquipo, Licencia, Periferico, RANGOS_SALUD, q_rango_salud,
+)
+
+# Días hacia adelante de "próximos mantenimientos" y "licencias por vencer".
+DIAS_PROXIMOS = 30
+
+# Caché por alcance: 'all' (admin sin filtro) o el id de la sede. Cada entrada guarda las
+# versiones con que se calculó: la versión global (cambios en bloque, usernames) y la de su alcance,
+# que las señales renuevan al confirmar la transacción. Viven en el caché 'default', que
+# debe ser compartido entre procesos (check inventory.W001).
+CLAVE_VERSION = 'dashboard:version'
+CLAVE_ESTADISTICAS = 'dashboard:stats'
+CLAVE_CALCULO = 'dashboard:calculo'
+CLAVE_SLA = 'dashboard:sla'
+CLAVE_CALCULO_SLA = 'dashboard:sla:calculo'
+# Tope del cálculo en curso (single-flight) y espera de las demás solicitudes.
+TIEMPO_CALCULO = 30
+ESPERA_CALCULO = 5
+
+
+ESTADOS_MANTENIMIENTO_ACTIVOS = ('Pendiente', 'En proceso')
+
+
+def q_mantenimientos_vencidos(today):
+    # Pendiente con la fecha de finalización (estimada) como límite, o la de inicio si no la tiene.
+    return Q(estado_mantenimiento='Pendiente') & (
+        Q(fecha_finalizacion__isnull=False, fecha_finalizacion__lt=today)
+        | Q(fecha_finalizacion__isnull=True, fecha_inicio__lt=today)
+    )
+
+
+def q_mantenimientos_finalizados_tarde():
+    return Q(estado_mantenimiento='Finalizado', fecha_real_finalizacion__gt=F('fecha_finalizacion'))
+
+
+def q_licencias_vencidas(today):
+    return Q(estado='Vencida') | Q(fecha_vencimiento__lt=today)
+
+
+def q_licencias_por_vencer(today):
+    return Q(fecha_vencimiento__gte=today, fecha_vencimiento__lte=today + timedelta(days=DIAS_PROXIMOS))
+
+
+def _agrupar(filas, campo):
+    # [{campo: valor, 'count': n}] como values(campo).annotate(count=Count(campo)).
+    conteos = {}
+    for fila in filas:
+        conteos[fila[campo]] = conteos.get(fila[campo], 0) + fila['count']
+    return [{campo: valor, 'count': total} for valor, total in conteos.items()]
+
+
+def _sumar(filas, clave):
+    return sum(fila[clave] for fila in filas)
+
+
+def estadisticas_dashboard(sede=None):
+    """
+    Estadísticas del dashboard, de toda la organización o de `sede`.
+
+    Una consulta por tabla: cada una agrupa por las columnas que el dashboard reparte
+    (estado, tipo...) y calcula en la misma pasada los conteos con condición
+    (Count(..., filter=Q(...))); los totales y cada reparto se suman en Python a
+    partir de esas pocas filas.
+    """
+    equipos_qs = Equipo.objects.all()  # Se incluyen todos para contar los de baja
+    mantenimientos_qs = Mantenimiento.objects.all()
+    perifericos_qs = Periferico.objects.all()
+    licencias_qs = Licencia.objects.all()
+    usuarios_qs = User.objects.all()
+    if sede is not None:
+        equipos_qs = equipos_qs.filter(sede=sede)
+        mantenimientos_qs = mantenimientos_qs.filter(sede=sede)
+        perifericos_qs = perifericos_qs.filter(equipo_asociado__sede=sede)
+        licencias_qs = licencias_qs.filter(equipo_asociado__sede=sede)
+        usuarios_qs = usuarios_qs.filter(profile__sede=sede)
+
+    today = timezone.now().date()
+    limite = today + timedelta(days=DIAS_PROXIMOS)
+
+    # Los rangos de salud usan el contador mantenido (índice equipo_activo_salud).
+    columnas_equipo = ['activo', 'estado_tecnico', 'estado_disponibilidad', 'tipo_equipo']
+    equipos = list(
+        equipos_qs.order_by(*columnas_equipo).values(*columnas_equipo).annotate(
+            count=Count('pk'),
+            **{clave: Count('pk', filter=q_rango_salud(clave)) for clave, _, _ in RANGOS_SALUD},
+        )
+    )
+    activos = [fila for fila in equipos if fila['activo']]
+
+    columnas_mantenimiento = ['estado_mantenimiento', 'tipo_mantenimiento']
+    mantenimientos = list(
+        mantenimientos_qs.order_by(*columnas_mantenimiento).values(*columnas_mantenimiento).annotate(
+            count=Count('pk'),
+            vencidos=Count('pk', filter=q_mantenimientos_vencidos(today)),
+            proximos=Count('pk', filter=Q(
+                estado_mantenimiento='Pendiente', fecha_inicio__gte=today, fecha_inicio__lte=limite
+            )),
+            finalizados_tarde=Count('pk', filter=q_mantenimientos_finalizados_tarde()),
+        )
+    )
+
+    perifericos = list(perifericos_qs.order_by('tipo').values('tipo').annotate(count=Count('pk')))
+
+    licencias = list(
+        licencias_qs.order_by('estado').values('estado').annotate(
+            count=Count('pk'),
+            vencidas=Count('pk', filter=q_licencias_vencidas(today)),
+            por_vencer=Count('pk', filter=q_licencias_por_vencer(today)),
+        )
+    )
+
+    return {
+        'total_equipos': _sumar(activos, 'count'),
+        'equipos_dados_de_baja': _sumar(equipos, 'count') - _sumar(activos, 'count'),
+        'total_mantenimientos': _sumar(mantenimientos, 'count'),
+        'total_perifericos': _sumar(perifericos, 'count'),
+        'total_licencias': _sumar(licencias, 'count'),
+        'total_usuarios': usuarios_qs.count(),
+        'proximos_mantenimientos': _sumar(mantenimientos, 'proximos'),
+        'mantenimientos_activos': _sumar(
+            [fila for fila in mantenimientos if fila['estado_mantenimiento'] in ESTADOS_MANTENIMIENTO_ACTIVOS], 'count'
+        ),
+        'mantenimientos_vencidos': _sumar(mantenimientos, 'vencidos'),
+        'mantenimientos_finalizados_tarde': _sumar(mantenimientos, 'finalizados_tarde'),
+        'licencias_vencidas': _sumar(licencias, 'vencidas'),
+        'licencias_por_vencer': _sumar(licencias, 'por_vencer'),
+        'equipos_por_estado': _agrupar(activos, 'estado_tecnico'),
+        'equipos_por_disponibilidad': _agrupar(activos, 'estado_disponibilidad'),
+        'equipos_por_tipo': _agrupar(activos, 'tipo_equipo'),
+        'equipos_por_salud': [
+            {'salud': clave, 'rango': etiqueta, 'count': _sumar(activos, clave)} for clave, etiqueta, _ in RANGOS_SALUD
+        ],
+        'mantenimientos_por_estado': _agrupar(mantenimientos, 'estado_mantenimiento'),
+        'mantenimientos_por_tipo': _agrupar(mantenimientos, 'tipo_mantenimiento'),
+        'perifericos_por_tipo': perifericos,
+        'licencias_por_estado': [{'estado': fila['estado'], 'count': fila['count']} for fila in licencias],
+    }
+
+
+def _alcance(sede):
+    return 'all' if sede is None else str(getattr(sede, 'pk', sede))
+
+
+def _versiones(alcance):
+    claves = [CLAVE_VERSION, f'{CLAVE_VERSION}:{alcance}']
+    versiones = cache.get_many(claves)
+    for clave in claves:
+        if clave not in versiones:
+            # Una versión perdida (expulsada del caché) reaparece con otro valor: las
+            # entradas guardadas con la anterior dejan de coincidir.
+            cache.add(clave, uuid.uuid4().hex, timeout=None)
+            versiones[clave] = cache.get(clave)
+    return [versiones[clave] for clave in claves]
+
+
+def _renovar(clave):
+    # Un valor nuevo y no un incr(): en DatabaseCache (y otros backends) incr() es leer y
+    # escribir, y dos invalidaciones simultáneas podrían dejar el mismo número. Con
+    # valores únicos, la última escritura siempre difiere de lo que alguien calculó antes.
+    cache.set(clave, uuid.uuid4().hex, timeout=None)
+
+
+def invalidar_dashboard(sede_ids=None):
+    """
+    Invalida las estadísticas en caché de las sedes `sede_ids` (y las de 'all'), o de
+    todos los alcances si es None. Se aplica al confirmar la transacción, para que
+    ninguna solicitud vuelva a guardar datos anteriores al cambio con la versión nueva.
+    """
+    if sede_ids is None:
+        claves = [CLAVE_VERSION]
+    else:
+        claves = [f'{CLAVE_VERSION}:all'] + [f'{CLAVE_VERSION}:{pk}' for pk in set(sede_ids) if pk is not None]
+
+    def renovar():
+        for clave in claves:
+            _renovar(clave)
+
+    transaction.on_commit(renovar)
+
+
+def _vigente(entrada, versiones):
+    return entrada is not None and entrada['versiones'] == versiones
+
+
+def estadisticas_dashboard_cacheadas(sede=None):
+    """
+    estadisticas_dashboard() a través del caché (DASHBOARD_CACHE_TIMEOUT segundos).
+    """
+    return _cacheado(CLAVE_ESTADISTICAS, CLAVE_CALCULO, sede, estadisticas_dashboard)
+
+
+def _cacheado(prefijo, prefijo_candado, sede, calcular):
+    """
+    calcular(sede) a través del caché, en la entrada `prefijo`:alcance.
+
+    Si la entrada falta, venció o fue invalidada, una sola solicitud la recalcula: la
+    que obtiene el candado con cache.add(). Las demás devuelven la entrada vencida si
+    sus versiones siguen vigentes, o esperan el nuevo valor (y lo calculan ellas mismas
+    si no llega en ESPERA_CALCULO segundos). Solo usa get/set/add/delete, así que sirve
+    cualquier backend; para que las invalidaciones lleguen a todos los workers debe ser
+    compartido (DatabaseCache, Redis, Memcached).
+    """
+    alcance = _alcance(sede)
+    clave, candado = f'{prefijo}:{alcance}', f'{prefijo_candado}:{alcance}'
+    versiones = _versiones(alcance)
+    entrada = cache.get(clave)
+    if _vigente(entrada, versiones) and entrada['vence'] > time.time():
+        return entrada['datos']
+
+    token = uuid.uuid4().hex
+    if cache.add(candado, token, timeout=TIEMPO_CALCULO):
+        try:
+            datos = calcular(sede)
+            duracion = settings.DASHBOARD_CACHE_TIMEOUT
+            # Se conserva el doble del tiempo para servirla vencida mientras se recalcula.
+            cache.set(clave, {'versiones': versiones, 'vence': time.time() + duracion, 'datos': datos}, duracion * 2)
+            return datos
+        finally:
+            if cache.get(candado) == token:
+                cache.delete(candado)
+
+    if _vigente(entrada, versiones):
+        return entrada['datos']
+    limite = time.monotonic() + ESPERA_CALCULO
+    while time.monotonic() < limite:
+        time.sleep(0.05)
+        entrada = cache.get(clave)
+        if _vigente(entrada, versiones):
+            return entrada['datos']
+    return calcular(sede)
+
+
+# Contadores de EstadisticaDiaria que se suman entre sedes (los repartos se suman por llave).
+CAMPOS_ESTADISTICA_DIARIA = [
+    'total_equipos', 'equipos_dados_de_baja', 'mantenimientos_activos', 'mantenimientos_vencidos',
+    'mantenimientos_finalizados_tarde', 'licencias_vencidas', 'licencias_por_vencer',
+]
+REPARTOS_ESTADISTICA_DIARIA = ['equipos_por_estado', 'equipos_por_tipo']
+
+
+def registrar_estadisticas_diarias():
+    """
+    Escribe (o reemplaza, si ya corrió hoy) la EstadisticaDiaria de hoy de cada sede con
+    el estado actual. Tres consultas agrupadas por sede, para todas las sedes a la vez,
+    y un solo INSERT ... ON CONFLICT. Devuelve cuántas filas escribió. Los equipos sin
+    sede no entran en ninguna fila.
+    """
+    today = timezone.now().date()
+    filas = {
+        sede_id: EstadisticaDiaria(sede_id=sede_id, fecha=today, equipos_por_estado={}, equipos_por_tipo={})
+        for sede_id in Sede.objects.values_list('pk', flat=True)
+    }
+
+    equipos = (
+        Equipo.objects.filter(sede__isnull=False).order_by()
+        .values('sede_id', 'activo', 'estado_tecnico', 'tipo_equipo').annotate(count=Count('pk'))
+    )
+    for grupo in equipos:
+        fila = filas[grupo['sede_id']]
+        if not grupo['activo']:
+            fila.equipos_dados_de_baja += grupo['count']
+            continue
+        fila.total_equipos += grupo['count']
+        for reparto, campo in (('equipos_por_estado', 'estado_tecnico'), ('equipos_por_tipo', 'tipo_equipo')):
+            conteos = getattr(fila, reparto)
+            conteos[grupo[campo]] = conteos.get(grupo[campo], 0) + grupo['count']
+
+    mantenimientos = (
+        Mantenimiento.objects.filter(sede__isnull=False).order_by().values('sede_id').annotate(
+            activos=Count('pk', filter=Q(estado_mantenimiento__in=ESTADOS_MANTENIMIENTO_ACTIVOS)),
+            vencidos=Count('pk', filter=q_mantenimientos_vencidos(today)),
+            finalizados_tarde=Count('pk', filter=q_mantenimientos_finalizados_tarde()),
+        )
+    )
+    for grupo in mantenimientos:
+        fila = filas[grupo['sede_id']]
+        fila.mantenimientos_activos = grupo['activos']
+        fila.mantenimientos_vencidos = grupo['vencidos']
+        fila.mantenimientos_finalizados_tarde = grupo['finalizados_tarde']
+
+    licencias = (
+        Licencia.objects.filter(equipo_asociado__sede__isnull=False).order_by()
+        .values(sede_id=F('equipo_asociado__sede')).annotate(
+            vencidas=Count('pk', filter=q_licencias_vencidas(today)),
+            por_vencer=Count('pk', filter=q_licencias_por_vencer(today)),
+        )
+    )
+    for grupo in licencias:
+        fila = filas[grupo['sede_id']]
+        fila.licencias_vencidas = grupo['vencidas']
+        fila.licencias_por_vencer = grupo['por_vencer']
+
+    EstadisticaDiaria.objects.bulk_create(
+        filas.values(), update_conflicts=True, unique_fields=['sede', 'fecha'],
+        update_fields=CAMPOS_ESTADISTICA_DIARIA + REPARTOS_ESTADISTICA_DIARIA + ['creado_en'],
+    )
+    return len(filas)
+
+
+def tendencias_diarias(desde, hasta, sede=None):
+    """
+    Serie diaria de EstadisticaDiaria entre `desde` y `hasta` (inclusive), de una sede o
+    sumada entre todas. Una sola consulta por el índice (sede, fecha) o (fecha).
+    """
+    registros = EstadisticaDiaria.objects.filter(fecha__range=(desde, hasta)).order_by('fecha')
+    if sede is not None:
+        registros = registros.filter(sede=sede)
+    serie = {}
+    for registro in registros.values('fecha', *CAMPOS_ESTADISTICA_DIARIA, *REPARTOS_ESTADISTICA_DIARIA):
+        dia = serie.setdefault(registro['fecha'], {
+            'fecha': registro['fecha'], **{campo: 0 for campo in CAMPOS_ESTADISTICA_DIARIA},
+            **{reparto: {} for reparto in REPARTOS_ESTADISTICA_DIARIA},
+        })
+        for campo in CAMPOS_ESTADISTICA_DIARIA:
+            dia[campo] += registro[campo]
+        for reparto in REPARTOS_ESTADISTICA_DIARIA:
+            for valor, cantidad in registro[reparto].items():
+                dia[reparto][valor] = dia[reparto].get(valor, 0) + cantidad
+    return list(serie.values())
+
+
+INTERVALOS_SERIE = {'dia': TruncDay, 'semana': TruncWeek, 'mes': TruncMonth}
+# Tope de periodos por respuesta (p. ej. algo más de un año por día).
+MAX_PERIODOS_SERIE = 400
+
+
+def _inicio_periodo(fecha, intervalo):
+    if intervalo == 'semana':
+        return fecha - timedelta(days=fecha.weekday())  # Lunes, como TruncWeek
+    if intervalo == 'mes':
+        return fecha.replace(day=1)
+    return fecha
+
+
+def _periodo_siguiente(fecha, intervalo):
+    if intervalo == 'semana':
+        return fecha + timedelta(days=7)
+    if intervalo == 'mes':
+        return (fecha.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return fecha + timedelta(days=1)
+
+
+def series_temporales(desde, hasta, intervalo='dia', sede=None, tipo_mantenimiento=None, tipo_equipo=None):
+    """
+    Conteos por periodo (día, semana o mes) entre `desde` y `hasta`, ampliados a periodos
+    completos, sin huecos:
+    - mantenimientos_creados (creado_en) y mantenimientos_finalizados
+      (fecha_real_finalizacion), filtrables por tipo_mantenimiento;
+    - asignaciones (entregas de equipos) y bajas de HistorialMovimientoEquipo, filtrables
+      por tipo_equipo.
+    Cada serie es una consulta agrupada por TruncDay/TruncWeek/TruncMonth en la base.
+    Lanza ValueError si el intervalo no existe o el rango excede MAX_PERIODOS_SERIE.
+    """
+    if intervalo not in INTERVALOS_SERIE:
+        raise ValueError(f"Intervalo desconocido: {intervalo}. Use {', '.join(INTERVALOS_SERIE)}.")
+    inicio = _inicio_periodo(desde, intervalo)
+    fin = _periodo_siguiente(_inicio_periodo(hasta, intervalo), intervalo)
+    periodos = {}
+    periodo = inicio
+    while periodo < fin:
+        if len(periodos) == MAX_PERIODOS_SERIE:
+            raise ValueError(f'El rango supera {MAX_PERIODOS_SERIE} periodos; use un intervalo mayor.')
+        periodos[periodo] = {'periodo': periodo}
+        periodo = _periodo_siguiente(periodo, intervalo)
+    # Límites como instantes, para que los índices sobre columnas con hora sirvan.
+    inicio_dt = timezone.make_aware(datetime.combine(inicio, dt_time.min))
+    fin_dt = timezone.make_aware(datetime.combine(fin, dt_time.min))
+
+    mantenimientos = Mantenimiento.objects.order_by()
+    movimientos = HistorialMovimientoEquipo.objects.order_by()
+    if sede is not None:
+        mantenimientos = mantenimientos.filter(sede=sede)
+        movimientos = movimientos.filter(sede=sede)
+    if tipo_mantenimiento:
+        mantenimientos = mantenimientos.filter(tipo_mantenimiento=tipo_mantenimiento)
+    if tipo_equipo:
+        movimientos = movimientos.filter(equipo__tipo_equipo=tipo_equipo)
+
+    series = {
+        'mantenimientos_creados': (
+            mantenimientos.filter(creado_en__gte=inicio_dt, creado_en__lt=fin_dt), 'creado_en',
+        ),
+        'mantenimientos_finalizados': (
+            mantenimientos.filter(
+                estado_mantenimiento='Finalizado', fecha_real_finalizacion__gte=inicio, fecha_real_finalizacion__lt=fin,
+            ),
+            'fecha_real_finalizacion',
+        ),
+        'asignaciones': (
+            movimientos.filter(es_baja=False, fecha_asignacion__gte=inicio_dt, fecha_asignacion__lt=fin_dt), 'fecha_asignacion',
+        ),
+        'bajas': (
+            movimientos.filter(es_baja=True, fecha_baja__gte=inicio_dt, fecha_baja__lt=fin_dt), 'fecha_baja',
+        ),
+    }
+    truncar = INTERVALOS_SERIE[intervalo]
+    for nombre, (queryset, campo) in series.items():
+        for fila in periodos.values():
+            fila[nombre] = 0
+        conteos = queryset.annotate(
+            periodo=truncar(campo, output_field=DateField())
+        ).values('periodo').annotate(total=Count('id'))
+        for conteo in conteos:
+            periodos[conteo['periodo']][nombre] = conteo['total']
+    return list(periodos.values())
+
+
+# Métricas de mantenimientos por grupo; los días son fechas restadas (enteros).
+COLUMNAS_SLA = [
+    'finalizados', 'mttr_dias', 'p50_dias', 'p90_dias', 'finalizados_tarde', 'abiertos',
+    'antiguedad_media_dias', 'antiguedad_maxima_dias', 'posicion_mttr',
+]
+
+
+def analitica_sla(sede=None):
+    """
+    Tiempo de resolución (media, mediana y p90, de fecha_inicio a fecha_real_finalizacion),
+    tasa de finalización tarde (la misma regla que Mantenimiento.fuera_de_fecha) y
+    antigüedad del backlog abierto (Pendiente / En proceso), en general, por responsable
+    y por sede.
+
+    Una sola consulta recorre la tabla: GROUPING SETS calcula los tres niveles a la vez,
+    percentile_cont da los percentiles y RANK() sobre el resultado agrupado ordena a
+    responsables y sedes por MTTR.
+    """
+    qn = connection.ops.quote_name
+    today = timezone.now().date()
+    filtro, params = '', [today]
+    if sede is not None:
+        filtro = 'WHERE m.sede_id = %s'
+        params.append(getattr(sede, 'pk', sede))
+    sql = f"""
+        SELECT GROUPING(x.responsable_id) AS sin_responsable, GROUPING(x.sede_id) AS sin_sede,
+               x.responsable_id, x.username, x.sede_id, x.sede_nombre,
+               COUNT(*) FILTER (WHERE x.finalizado) AS finalizados,
+               AVG(x.dias) AS mttr_dias,
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY x.dias) AS p50_dias,
+               percentile_cont(0.9) WITHIN GROUP (ORDER BY x.dias) AS p90_dias,
+               COUNT(*) FILTER (WHERE x.tarde) AS finalizados_tarde,
+               COUNT(x.edad) AS abiertos,
+               AVG(x.edad) AS antiguedad_media_dias,
+               MAX(x.edad) AS antiguedad_maxima_dias,
+               RANK() OVER (
+                   PARTITION BY GROUPING(x.responsable_id), GROUPING(x.sede_id) ORDER BY AVG(x.dias) NULLS LAST
+               ) AS posicion_mttr
+        FROM (
+            SELECT m.responsable_id, u.username, m.sede_id, s.nombre AS sede_nombre,
+                   m.estado_mantenimiento = 'Finalizado' AS finalizado,
+                   CASE WHEN m.estado_mantenimiento = 'Finalizado'
+                        THEN m.fecha_real_finalizacion - m.fecha_inicio END AS dias,
+                   m.estado_mantenimiento = 'Finalizado' AND m.fecha_real_finalizacion > m.fecha_finalizacion AS tarde,
+                   CASE WHEN m.estado_mantenimiento IN ('Pendiente', 'En proceso')
+                        THEN %s::date - m.fecha_inicio END AS edad
+            FROM {qn(Mantenimiento._meta.db_table)} m
+            LEFT JOIN {qn(User._meta.db_table)} u ON u.id = m.responsable_id
+            LEFT JOIN {qn(Sede._meta.db_table)} s ON s.id = m.sede_id
+            {filtro}
+        ) x
+        GROUP BY GROUPING SETS ((x.responsable_id, x.username), (x.sede_id, x.sede_nombre), ())
+        ORDER BY sin_responsable, sin_sede, posicion_mttr, x.responsable_id, x.sede_id
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        nombres = [columna[0] for columna in cursor.description]
+        filas = [dict(zip(nombres, fila)) for fila in cursor.fetchall()]
+
+    resultado = {'general': None, 'por_responsable': [], 'por_sede': []}
+    for fila in filas:
+        metricas = {columna: fila[columna] for columna in COLUMNAS_SLA}
+        for columna in ('mttr_dias', 'p50_dias', 'p90_dias', 'antiguedad_media_dias'):
+            if metricas[columna] is not None:
+                metricas[columna] = round(float(metricas[columna]), 2)
+        metricas['tasa_finalizacion_tarde'] = (
+            round(metricas['finalizados_tarde'] / metricas['finalizados'], 4) if metricas['finalizados'] else None
+        )
+        if fila['sin_responsable'] and fila['sin_sede']:
+            del metricas['posicion_mttr']
+            resultado['general'] = metricas
+        elif not fila['sin_responsable']:
+            resultado['por_responsable'].append(
+                {'responsable': fila['responsable_id'], 'responsable_nombre': fila['username'], **metricas}
+            )
+        else:
+            resultado['por_sede'].append({'sede': fila['sede_id'], 'sede_nombre': fila['sede_nombre'], **metricas})
+    return resultado
+
+
+def analitica_sla_cacheada(sede=None):
+    """
+    analitica_sla() a través del caché, con las mismas versiones que el dashboard: los
+    cambios de mantenimientos (finalizar, cancelar, crear...) invalidan su sede.
+    """
+    return _cacheado(CLAVE_SLA, CLAVE_CALCULO_SLA, sede, analitica_sla)
@@ -0,0 +1,87 @@
+import csv
+import tempfile
+
+from django.http import FileResponse, StreamingHttpResponse
+
+# Columnas exportadas: (encabezado, ruta del ORM). Se omiten las firmas en base64.
+COLUMNAS_EXPORTACION_EQUIPOS = [
+    ('ID', 'id'),
+    ('Nombre', 'nombre'),
+    ('Marca', 'marca'),
+    ('Modelo', 'modelo'),
+    ('Serial', 'serial'),
+    ('Tipo de Equipo', 'tipo_equipo'),
+    ('RAM', 'ram'),
+    ('ROM', 'rom'),
+    ('Procesador', 'procesador'),
+    ('Sistema Operativo', 'sistema_operativo'),
+    ('Antivirus', 'antivirus'),
+    ('Estado Técnico', 'estado_tecnico'),
+    ('Estado de Disponibilidad', 'estado_disponibilidad'),
+    ('Sede', 'sede__nombre'),
+    ('Nombre Empleado', 'empleado_asignado__nombre'),
+    ('Apellido Empleado', 'empleado_asignado__apellido'),
+    ('Cédula Empleado', 'empleado_asignado__cedula'),
+    ('Fecha de Entrega', 'fecha_entrega_a_colaborador'),
+    ('Último Mantenimiento', 'fecha_ultimo_mantenimiento'),
+    ('Próximo Mantenimiento', 'fecha_proximo_mantenimiento'),
+]
+
+TAMANO_LOTE_EXPORTACION = 2000
+
+
+class _Echo:
+    """
+    Objeto tipo archivo que devuelve lo escrito en lugar de guardarlo,
+    para que csv.writer produzca cada fila como un fragmento de la respuesta.
+    """
+    def write(self, value):
+        return value
+
+
+def filas_equipos(queryset):
+    """
+    Recorre el queryset con un cursor del lado del servidor, en lotes, sin
+    instanciar modelos. La memoria usada no depende del número de equipos.
+    """
+    rutas = [ruta for _, ruta in COLUMNAS_EXPORTACION_EQUIPOS]
+    return queryset.values_list(*rutas).iterator(chunk_size=TAMANO_LOTE_EXPORTACION)
+
+
+def exportar_equipos_csv(queryset, nombre_archivo):
+    writer = csv.writer(_Echo())
+
+    def generar():
+        # BOM para que Excel detecte UTF-8 (tildes y eñes).
+        yield '\ufeff'
+        yield writer.writerow([encabezado for encabezado, _ in COLUMNAS_EXPORTACION_EQUIPOS])
+        for fila in filas_equipos(queryset):
+            yield writer.writerow(fila)
+
+    response = StreamingHttpResponse(generar(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{nombre_archivo}.csv"'
+    return response
+
+
+def exportar_equipos_xlsx(queryset, nombre_archivo):
+    """
+    Genera el XLSX con openpyxl en modo write_only, que vuelca cada fila a disco
+    a medida que se agrega; el archivo resultante se envía por partes.
+    """
+    from openpyxl import Workbook
+
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet(title='Equipos')
+    hoja.append([encabezado for encabezado, _ in COLUMNAS_EXPORTACION_EQUIPOS])
+    for fila in filas_equipos(queryset):
+        hoja.append(list(fila))
+
+    archivo = tempfile.TemporaryFile()
+    libro.save(archivo)
+    archivo.seek(0)
+    return FileResponse(
+        archivo,
+        as_attachment=True,
+        filename=f'{nombre_archivo}.xlsx',
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
@@ -0,0 +1,475 @@
+import json
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from empleados.models import Empleado
+from sede.models import Sede
+from .dashboard import invalidar_dashboard
+from .middleware import get_current_user
+from .models import (
+    AsignacionAbierta, CodificadorHistorial, Equipo, HistorialEquipo, HistorialMovimientoEquipo, HistorialPeriferico, Periferico,
+)
+from .search import CAMPOS_BUSQUEDA, actualizar_busqueda
+
+# Campos que no se registran en el historial: la llave, la marca de modificación,
+# que cambia en cada guardado, y las columnas derivadas (vector de búsqueda y contador).
+CAMPOS_EXCLUIDOS_HISTORIAL = {'id', 'actualizado_en', 'busqueda', 'mantenimientos_finalizados'}
+
+# Expresión SQL equivalente a str() de cada modelo relacionado, para reproducir en
+# la base de datos el mismo texto que escriben las señales en Python.
+EXPRESIONES_STR_RELACION = {
+    Sede: "{t}.nombre",
+    Empleado: "{t}.nombre || ' ' || {t}.apellido",
+    get_user_model(): "{t}.username",
+}
+
+
+def _expresion_texto(field, alias):
+    """
+    Texto SQL que corresponde a str(valor) del campo en Python.
+    """
+    qn = connection.ops.quote_name
+    columna = f'{alias}.{qn(field.column)}'
+    tipo = field.get_internal_type()
+    if tipo == 'BooleanField':
+        return f"CASE WHEN {columna} THEN 'True' ELSE 'False' END"
+    if tipo == 'DateTimeField':
+        # str() solo muestra los microsegundos si no son cero.
+        utc = f"{columna} AT TIME ZONE 'UTC'"
+        return (
+            f"to_char({utc}, 'YYYY-MM-DD HH24:MI:SS') "
+            f"|| CASE WHEN to_char({utc}, 'US') = '000000' THEN '' ELSE to_char({utc}, '.US') END || '+00:00'"
+        )
+    return f'{columna}::text'
+
+
+def campo_historial_equipo(valor):
+    """
+    Campo de Equipo con historial a partir de su nombre ('sede') o de la etiqueta con
+    que aparece en campo_modificado ('Sede'). None si no corresponde a ninguno.
+    """
+    for field in Equipo._meta.fields:
+        if field.name not in CAMPOS_EXCLUIDOS_HISTORIAL and valor in (field.name, str(field.verbose_name)):
+            return field
+    return None
+
+
+def historial_compacto():
+    return getattr(settings, 'HISTORIAL_EQUIPO_COMPACTO', False)
+
+
+def filas_historial_equipo(equipo_id, usuario_id, tipo_accion, cambios):
+    """
+    Filas de HistorialEquipo (dicts por attname) de un guardado. `cambios` son tuplas
+    (field, anterior, nuevo, texto_anterior, texto_nuevo) con los valores como están
+    en la instancia (ids para relaciones). Por defecto se escribe una fila por campo;
+    con HISTORIAL_EQUIPO_COMPACTO, una sola fila con el diff tipado en `cambios`.
+    """
+    if not cambios:
+        return []
+    base = {'equipo_id': equipo_id, 'usuario_id': usuario_id, 'tipo_accion': tipo_accion}
+    if not historial_compacto():
+        return [
+            {**base, 'campo_modificado': str(field.verbose_name), 'valor_anterior': texto_anterior, 'valor_nuevo': texto_nuevo}
+            for field, _, _, texto_anterior, texto_nuevo in cambios
+        ]
+    diff = {}
+    for field, anterior, nuevo, texto_anterior, texto_nuevo in cambios:
+        entrada = {'nuevo': nuevo} if tipo_accion == 'CREADO' else {'anterior': anterior, 'nuevo': nuevo}
+        if field.is_relation:
+            entrada['texto_nuevo'] = texto_nuevo
+            if tipo_accion != 'CREADO':
+                entrada['texto_anterior'] = texto_anterior
+        diff[field.name] = entrada
+    return [{**base, 'campo_modificado': '', 'cambios': diff}]
+
+
+def registrar_creacion_equipos(equipo_ids, usuario=None):
+    """
+    Escribe el historial 'CREADO' de muchos equipos con un solo INSERT ... SELECT.
+
+    Produce las mismas filas que inventory.signals.log_equipo_changes para un equipo
+    nuevo (una por campo no vacío, con el verbose_name y el texto del valor, o una por
+    equipo en formato compacto), pero calculadas en la base de datos en lugar de
+    instanciar un objeto por campo.
+    """
+    if not equipo_ids:
+        return
+    qn = connection.ops.quote_name
+    compacto = historial_compacto()
+    joins = []
+    valores = []
+    for field in Equipo._meta.fields:
+        if field.name in CAMPOS_EXCLUIDOS_HISTORIAL:
+            continue
+        if field.is_relation:
+            alias = f'r_{field.name}'
+            related = field.related_model
+            joins.append(
+                f'LEFT JOIN {qn(related._meta.db_table)} {alias} '
+                f'ON {alias}.{qn(related._meta.pk.column)} = e.{qn(field.column)}'
+            )
+            plantilla = EXPRESIONES_STR_RELACION.get(related, '{t}.' + qn(related._meta.pk.column) + '::text')
+            expresion = plantilla.format(t=alias)
+            diff = f"jsonb_build_object('nuevo', to_jsonb(e.{qn(field.column)}), 'texto_nuevo', {expresion})"
+        else:
+            expresion = _expresion_texto(field, 'e')
+            diff = f"jsonb_build_object('nuevo', to_jsonb(e.{qn(field.column)}))"
+        if compacto:
+            valores.append((field.name, f'{expresion}, {diff}'))
+        else:
+            valores.append((str(field.verbose_name), f'{expresion}, NULL::jsonb'))
+
+    valores_sql = ', '.join(f'(%s, {expresion})' for _, expresion in valores)
+    if compacto:
+        columnas = "'', NULL, NULL, 'CREADO', jsonb_object_agg(v.campo, v.cambio)"
+        agrupar = f"GROUP BY e.{qn('id')}"
+    else:
+        columnas = "v.campo, '', v.valor, 'CREADO', NULL"
+        agrupar = ''
+    historial = HistorialEquipo._meta
+    sql = f"""
+        INSERT INTO {qn(historial.db_table)}
+            ({qn('equipo_id')}, {qn('usuario_id')}, {qn('fecha_cambio')}, {qn('campo_modificado')},
+             {qn('valor_anterior')}, {qn('valor_nuevo')}, {qn('tipo_accion')}, {qn('cambios')})
+        SELECT e.{qn('id')}, %s, NOW(), {columnas}
+        FROM {qn(Equipo._meta.db_table)} e
+        {' '.join(joins)}
+        CROSS JOIN LATERAL (VALUES {valores_sql}) AS v(campo, valor, cambio)
+        WHERE e.{qn('id')} = ANY(%s) AND v.valor IS NOT NULL AND v.valor <> ''
+        {agrupar}
+        ORDER BY e.{qn('id')}
+    """
+    params = [getattr(usuario, 'pk', None)] + [campo for campo, _ in valores] + [list(equipo_ids)]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _texto_historial(field, valor):
+    # Mismo texto que log_equipo_changes: relaciones vacías como "", el resto con str().
+    if field.is_relation:
+        return str(valor) if valor else ""
+    return str(valor)
+
+
+def actualizar_equipos_en_bloque(queryset, cambios, usuario=None):
+    """
+    Actualización masiva de la API: como actualizar_con_historial, y además, igual que
+    EquipoViewSet.perform_update, quien asigna un empleado queda como responsable de
+    la entrega. Devuelve los ids de los equipos modificados.
+    """
+    if cambios.get('empleado_asignado') is not None and usuario is not None:
+        cambios = {**cambios, 'responsable_entrega': usuario}
+    return actualizar_con_historial(queryset, cambios, usuario=usuario)
+
+
+def actualizar_con_historial(queryset, cambios, usuario=None):
+    """
+    UPDATE en bloque de Equipo o Periferico que deja el mismo historial que guardar
+    cada objeto con save(): QuerySet.update() y bulk_update() no pasan por las señales.
+
+    Todo se resuelve en una sola sentencia con CTE que modifican datos: se bloquean
+    las filas del queryset, se comparan sus valores previos con `cambios` ({campo:
+    valor}; las relaciones aceptan instancia o id), se actualizan solo las que cambian
+    y con esos mismos valores previos se insertan las filas de historial (por campo o
+    compactas, más las asignaciones de HistorialMovimientoEquipo / HistorialPeriferico).
+    El historial se escribe directamente, también con HISTORIAL_DIFERIDO. `usuario`
+    es por defecto el de la solicitud actual. Devuelve los ids modificados.
+    """
+    modelo = queryset.model
+    if modelo is Equipo:
+        excluidos, construir = CAMPOS_EXCLUIDOS_HISTORIAL, _ctes_historial_equipo
+    elif modelo is Periferico:
+        excluidos, construir = {'id', 'actualizado_en'}, _ctes_historial_periferico
+    else:
+        raise ValueError(f'{modelo._meta.label} no tiene historial para actualizar en bloque.')
+    nuevos = _normalizar_cambios(modelo, cambios, excluidos)
+    if not nuevos:
+        return []
+    if usuario is None:
+        usuario = get_current_user()
+    ahora = timezone.now()
+
+    ctes, params = _ctes_actualizacion(queryset, nuevos, ahora)
+    for cte, params_cte in construir(nuevos, getattr(usuario, 'pk', None), ahora):
+        ctes.append(cte)
+        params.extend(params_cte)
+    sql = f"WITH {', '.join(ctes)} SELECT c.{connection.ops.quote_name(modelo._meta.pk.column)} FROM cambiados c ORDER BY 1"
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            ids = [fila[0] for fila in cursor.fetchall()]
+        if ids and modelo is Equipo and CAMPOS_BUSQUEDA.intersection(field.name for field in nuevos):
+            actualizar_busqueda(Equipo.objects.filter(pk__in=ids))
+        if ids:
+            invalidar_dashboard()
+    return ids
+
+
+def _normalizar_cambios(modelo, cambios, excluidos):
+    """
+    {field: (valor, texto)}: el valor como attname (id para relaciones) y su texto de
+    historial. Los valores se validan como en full_clean() (choices, nulos, longitud):
+    el UPDATE en SQL no pasa por ningún formulario ni serializer. Lanza ValidationError.
+    """
+    nuevos = {}
+    for nombre, valor in cambios.items():
+        field = modelo._meta.get_field(nombre)
+        if not field.concrete or field.primary_key or field.name in excluidos:
+            raise ValueError(f'{modelo.__name__}.{nombre} no se puede actualizar en bloque.')
+        if field.is_relation:
+            if valor is not None and not isinstance(valor, models.Model):
+                valor = field.related_model._default_manager.get(pk=valor)
+            nuevos[field] = (getattr(valor, 'pk', None), _texto_historial(field, valor))
+        else:
+            valor = field.clean(valor, None)
+            nuevos[field] = (valor, _texto_historial(field, valor))
+    return nuevos
+
+
+def _valor_sql(field, valor):
+    return f'%s::{field.db_type(connection)}', [field.get_db_prep_save(valor, connection)]
+
+
+def _valor_final(nuevos, modelo, nombre):
+    """
+    Expresión SQL del valor de `nombre` después del UPDATE: el nuevo si cambia, si no
+    la columna de la fila.
+    """
+    field = modelo._meta.get_field(nombre)
+    if field in nuevos:
+        return _valor_sql(field, nuevos[field][0])
+    return f'c.{connection.ops.quote_name(field.column)}', []
+
+
+def _bandera(nuevos, nombre):
+    # Columna de `cambiados` que indica si el campo cambia en la fila.
+    for i, field in enumerate(nuevos):
+        if field.name == nombre:
+            return f'c.cambio_{i}'
+    return None
+
+
+def _ctes_actualizacion(queryset, nuevos, ahora):
+    """
+    CTE comunes: `antes` bloquea las filas del queryset, `cambiados` conserva sus
+    valores previos (con una columna cambio_N por campo) y `actualizados` hace el UPDATE.
+    """
+    qn = connection.ops.quote_name
+    modelo = queryset.model
+    tabla = qn(modelo._meta.db_table)
+    pk = qn(modelo._meta.pk.column)
+    subconsulta, params = queryset.order_by().values('pk').query.sql_with_params()
+    params = list(params)
+
+    banderas, asignaciones, params_asignaciones = [], [], []
+    for i, (field, (valor, _)) in enumerate(nuevos.items()):
+        expresion, params_valor = _valor_sql(field, valor)
+        banderas.append(f'a.{qn(field.column)} IS DISTINCT FROM {expresion} AS cambio_{i}')
+        params.extend(params_valor)
+        asignaciones.append(f'{qn(field.column)} = {expresion}')
+        params_asignaciones.extend(params_valor)
+    alguno = ' OR '.join(f'x.cambio_{i}' for i in range(len(nuevos)))
+    ctes = [
+        f'antes AS (SELECT t.* FROM {tabla} t WHERE t.{pk} IN ({subconsulta}) FOR UPDATE OF t)',
+        f"cambiados AS (SELECT x.* FROM (SELECT a.*, {', '.join(banderas)} FROM antes a) x WHERE {alguno})",
+        f"actualizados AS (UPDATE {tabla} t SET {', '.join(asignaciones)}, {qn('actualizado_en')} = %s "
+        f'FROM cambiados c WHERE t.{pk} = c.{pk})',
+    ]
+    return ctes, params + params_asignaciones + [ahora]
+
+
+def _ctes_historial_equipo(nuevos, usuario_id, ahora):
+    qn = connection.ops.quote_name
+    joins, valores, params_valores = [], [], []
+    compacto = historial_compacto()
+    for i, (field, (valor, texto)) in enumerate(nuevos.items()):
+        columna = f'c.{qn(field.column)}'
+        if field.is_relation:
+            alias = f'r_{i}'
+            related = field.related_model
+            joins.append(
+                f'LEFT JOIN {qn(related._meta.db_table)} {alias} '
+                f'ON {alias}.{qn(related._meta.pk.column)} = {columna}'
+            )
+            plantilla = EXPRESIONES_STR_RELACION.get(related, '{t}.' + qn(related._meta.pk.column) + '::text')
+            anterior = f"COALESCE({plantilla.format(t=alias)}, '')"
+        else:
+            # str(None) en Python.
+            anterior = f"COALESCE({_expresion_texto(field, 'c')}, 'None')"
+        if compacto:
+            textos = f", 'texto_anterior', {anterior}, 'texto_nuevo', %s::text" if field.is_relation else ''
+            valores.append(
+                f"(%s, jsonb_build_object('anterior', to_jsonb({columna}), 'nuevo', %s::jsonb{textos}), c.cambio_{i})"
+            )
+            params_valores += [field.name, json.dumps(valor, cls=CodificadorHistorial)]
+            if field.is_relation:
+                params_valores.append(texto)
+        else:
+            valores.append(f'(%s, {anterior}, %s::text, c.cambio_{i})')
+            params_valores += [str(field.verbose_name), texto]
+
+    historial = qn(HistorialEquipo._meta.db_table)
+    columnas = ', '.join(qn(nombre) for nombre in (
+        'equipo_id', 'usuario_id', 'fecha_cambio', 'campo_modificado', 'valor_anterior', 'valor_nuevo', 'tipo_accion', 'cambios'
+    ))
+    if compacto:
+        seleccion = "'', NULL, NULL, 'ACTUALIZADO', jsonb_object_agg(v.campo, v.valor)"
+        agrupar = f"GROUP BY c.{qn('id')}"
+        alias_valores = 'v(campo, valor, cambio)'
+    else:
+        seleccion = "v.campo, v.anterior, v.nuevo, 'ACTUALIZADO', NULL"
+        agrupar = ''
+        alias_valores = 'v(campo, anterior, nuevo, cambio)'
+    yield (
+        f"historial AS (INSERT INTO {historial} ({columnas}) "
+        f"SELECT c.{qn('id')}, %s, %s, {seleccion} FROM cambiados c {' '.join(joins)} "
+        f"CROSS JOIN LATERAL (VALUES {', '.join(valores)}) AS {alias_valores} WHERE v.cambio {agrupar})",
+        [usuario_id, ahora] + params_valores,
+    )
+
+    # Asignaciones, como inventory.signals.log_equipo_movement.
+    movimientos = qn(HistorialMovimientoEquipo._meta.db_table)
+    abierto = f"h.{qn('fecha_devolucion')} IS NULL AND NOT h.{qn('es_baja')}"
+    nombre, params_nombre = _valor_final(nuevos, Equipo, 'nombre')
+    serial, params_serial = _valor_final(nuevos, Equipo, 'serial')
+    sede, params_sede = _valor_final(nuevos, Equipo, 'sede')
+    empleado, params_empleado = _valor_final(nuevos, Equipo, 'empleado_asignado')
+    cambio_empleado = _bandera(nuevos, 'empleado_asignado')
+    cambio_activo = _bandera(nuevos, 'activo')
+    nuevo_empleado = nuevos.get(Equipo._meta.get_field('empleado_asignado'), (None,))[0]
+    baja = nuevos.get(Equipo._meta.get_field('activo'), (True,))[0] is False
+
+    if cambio_empleado:
+        yield (
+            f"cierre_movimiento AS (UPDATE {movimientos} h SET {qn('fecha_devolucion')} = %s, {qn('observacion_devolucion')} = %s "
+            f"FROM cambiados c WHERE {cambio_empleado} AND h.{qn('equipo_id')} = c.{qn('id')} "
+            f"AND h.{qn('empleado_asignado_id')} = c.{qn('empleado_asignado_id')} AND {abierto})",
+            [ahora, 'Cambio de asignación o devolución'],
+        )
+        if nuevo_empleado is not None:
+            # Asignado y dado de baja a la vez: como en las señales, la nueva asignación
+            # nace cerrada por la baja (cierre_baja no ve las filas que inserta este CTE).
+            devolucion, params_devolucion = 'NULL, NULL', []
+            if cambio_activo and baja:
+                devolucion = f'CASE WHEN {cambio_activo} THEN %s::timestamptz END, CASE WHEN {cambio_activo} THEN %s END'
+                params_devolucion = [ahora, 'Devolución por baja del equipo']
+            yield (
+                f"apertura_movimiento AS (INSERT INTO {movimientos} ({qn('equipo_id')}, {qn('equipo_nombre')}, "
+                f"{qn('equipo_serial')}, {qn('empleado_asignado_id')}, {qn('sede_id')}, {qn('fecha_asignacion')}, {qn('es_baja')}, "
+                f"{qn('fecha_devolucion')}, {qn('observacion_devolucion')}) "
+                f"SELECT c.{qn('id')}, {nombre}, {serial}, {empleado}, {sede}, %s, false, {devolucion} "
+                f"FROM cambiados c WHERE {cambio_empleado})",
+                params_nombre + params_serial + params_empleado + params_sede + [ahora] + params_devolucion,
+            )
+    if cambio_activo and baja:
+        yield (
+            f"cierre_baja AS (UPDATE {movimientos} h SET {qn('fecha_devolucion')} = %s, {qn('observacion_devolucion')} = %s "
+            f"FROM cambiados c WHERE {cambio_activo} AND h.{qn('equipo_id')} = c.{qn('id')} "
+            f"AND h.{qn('empleado_asignado_id')} = {empleado} AND {abierto})",
+            [ahora, 'Devolución por baja del equipo'] + params_empleado,
+        )
+        yield (
+            f"baja_movimiento AS (INSERT INTO {movimientos} ({qn('equipo_id')}, {qn('equipo_nombre')}, {qn('equipo_serial')}, "
+            f"{qn('sede_id')}, {qn('fecha_asignacion')}, {qn('es_baja')}, {qn('fecha_baja')}, {qn('observacion_devolucion')}) "
+            f"SELECT c.{qn('id')}, {nombre}, {serial}, {sede}, %s, true, %s, %s FROM cambiados c WHERE {cambio_activo})",
+            params_nombre + params_serial + params_sede + [ahora, ahora, 'SISTEMA: EQUIPO DADO DE BAJA'],
+        )
+
+    # Reactivación de un equipo que conserva su empleado: se reabre la asignación que
+    # cerró la baja, salvo que ya esté abierta (asignado mientras estaba de baja).
+    reactivacion = None
+    if cambio_activo and not baja and not (cambio_empleado and nuevo_empleado is None):
+        reactivacion = (
+            f"{cambio_activo} AND NOT EXISTS (SELECT 1 FROM {qn(AsignacionAbierta._meta.db_table)} a "
+            f"WHERE a.{qn('equipo_id')} = c.{qn('id')})"
+        )
+        if cambio_empleado:
+            # Si el empleado cambia, apertura_movimiento ya abre la asignación.
+            reactivacion += f' AND NOT {cambio_empleado}'
+        else:
+            reactivacion += f" AND c.{qn('empleado_asignado_id')} IS NOT NULL"
+        yield (
+            f"reapertura_movimiento AS (INSERT INTO {movimientos} ({qn('equipo_id')}, {qn('equipo_nombre')}, "
+            f"{qn('equipo_serial')}, {qn('empleado_asignado_id')}, {qn('sede_id')}, {qn('fecha_asignacion')}, {qn('es_baja')}) "
+            f"SELECT c.{qn('id')}, {nombre}, {serial}, {empleado}, {sede}, %s, false FROM cambiados c WHERE {reactivacion})",
+            params_nombre + params_serial + params_empleado + params_sede + [ahora],
+        )
+
+    aperturas = []
+    if cambio_empleado and nuevo_empleado is not None:
+        # Las que además se dan de baja no quedan asignadas (cierre_abierta).
+        aperturas.append(f'({cambio_empleado} AND NOT {cambio_activo})' if cambio_activo and baja else cambio_empleado)
+    if reactivacion:
+        aperturas.append(f'({reactivacion})')
+    cierres = []
+    if cambio_empleado and nuevo_empleado is None:
+        cierres.append(cambio_empleado)
+    if cambio_activo and baja:
+        cierres.append(cambio_activo)
+    yield from _ctes_asignacion_abierta(
+        'equipo_id', ' OR '.join(aperturas), cierres, empleado, params_empleado, ahora,
+    )
+
+
+def _ctes_historial_periferico(nuevos, usuario_id, ahora):
+    # Asignaciones, como inventory.signals.log_periferico_assignment.
+    cambio_empleado = _bandera(nuevos, 'empleado_asignado')
+    if not cambio_empleado:
+        return
+    qn = connection.ops.quote_name
+    historial = qn(HistorialPeriferico._meta.db_table)
+    nuevo_empleado = nuevos[Periferico._meta.get_field('empleado_asignado')][0]
+    if nuevo_empleado is None:
+        devolucion, params_devolucion = '%s', [ahora, 'Devolución automática']
+    else:
+        fecha_entrega, params_fecha = _valor_final(nuevos, Periferico, 'fecha_entrega')
+        devolucion, params_devolucion = f'COALESCE({fecha_entrega}, %s)', params_fecha + [ahora, 'Reasignación automática']
+    yield (
+        f"cierre_asignacion AS (UPDATE {historial} h SET {qn('fecha_devolucion')} = {devolucion}, "
+        f"{qn('observacion_devolucion')} = %s FROM cambiados c WHERE {cambio_empleado} "
+        f"AND h.{qn('periferico_id')} = c.{qn('id')} AND h.{qn('empleado_asignado_id')} = c.{qn('empleado_asignado_id')} "
+        f"AND h.{qn('fecha_devolucion')} IS NULL)",
+        params_devolucion,
+    )
+    if nuevo_empleado is not None:
+        nombre, params_nombre = _valor_final(nuevos, Periferico, 'nombre')
+        tipo, params_tipo = _valor_final(nuevos, Periferico, 'tipo')
+        empleado, params_empleado = _valor_final(nuevos, Periferico, 'empleado_asignado')
+        equipo, params_equipo = _valor_final(nuevos, Periferico, 'equipo_asociado')
+        yield (
+            f"apertura_asignacion AS (INSERT INTO {historial} ({qn('periferico_id')}, {qn('periferico_nombre')}, "
+            f"{qn('periferico_tipo')}, {qn('empleado_asignado_id')}, {qn('equipo_asociado_id')}, {qn('fecha_asignacion')}, {qn('es_baja')}) "
+            f"SELECT c.{qn('id')}, {nombre}, {tipo}, {empleado}, {equipo}, %s, false FROM cambiados c WHERE {cambio_empleado})",
+            params_nombre + params_tipo + params_empleado + params_equipo + [ahora],
+        )
+        yield from _ctes_asignacion_abierta('periferico_id', cambio_empleado, [], empleado, params_empleado, ahora)
+    else:
+        yield from _ctes_asignacion_abierta('periferico_id', None, [cambio_empleado], None, [], ahora)
+
+
+def _ctes_asignacion_abierta(columna, apertura, cierres, empleado, params_empleado, ahora):
+    """
+    Mantiene AsignacionAbierta como las señales: `apertura` es la bandera de las filas
+    que quedan asignadas (upsert: el orden entre CTE no está definido, así que no se
+    borra y se vuelve a insertar) y `cierres` las de las filas que dejan de estarlo.
+    """
+    qn = connection.ops.quote_name
+    tabla = qn(AsignacionAbierta._meta.db_table)
+    if apertura:
+        yield (
+            f"apertura_abierta AS (INSERT INTO {tabla} ({qn(columna)}, {qn('empleado_id')}, {qn('fecha_asignacion')}) "
+            f"SELECT c.{qn('id')}, {empleado}, %s FROM cambiados c WHERE {apertura} "
+            f"ON CONFLICT ({qn(columna)}) DO UPDATE SET "
+            f"{qn('empleado_id')} = EXCLUDED.{qn('empleado_id')}, {qn('fecha_asignacion')} = EXCLUDED.{qn('fecha_asignacion')})",
+            params_empleado + [ahora],
+        )
+    if cierres:
+        yield (
+            f"cierre_abierta AS (DELETE FROM {tabla} a USING cambiados c WHERE a.{qn(columna)} = c.{qn('id')} "
+            f"AND ({' OR '.join(cierres)}))",
+            [],
+        )
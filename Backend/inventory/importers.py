@@ -0,0 +1,323 @@
+import codecs
+import csv
+import io
+import unicodedata
+from datetime import datetime
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from empleados.models import Empleado
+from sede.models import Sede
+from .dashboard import invalidar_dashboard
+from .history import registrar_creacion_equipos
+from .models import AsignacionAbierta, Equipo, HistorialMovimientoEquipo
+from .search import actualizar_busqueda
+
+TAMANO_LOTE_IMPORTACION = 1000
+
+# Campos del modelo que no se aceptan desde el archivo.
+CAMPOS_NO_IMPORTABLES = {'id', 'activo', 'responsable_entrega', 'empleado_asignado', 'sede', 'actualizado_en',
+                         'busqueda', 'mantenimientos_finalizados'}
+
+# Encabezados adicionales (normalizados) para resolver relaciones.
+ENCABEZADOS_SEDE = {'sede', 'sede_nombre', 'sede_id'}
+ENCABEZADOS_EMPLEADO = {'cedula_empleado', 'empleado_cedula', 'cedula'}
+
+
+def normalizar(texto):
+    """
+    'Cédula Empleado' -> 'cedula_empleado'. Sin tildes, minúsculas y con guiones bajos.
+    """
+    texto = unicodedata.normalize('NFKD', str(texto)).encode('ascii', 'ignore').decode('ascii')
+    return '_'.join(texto.lower().replace('(', ' ').replace(')', ' ').split())
+
+
+class ErrorArchivo(Exception):
+    """El archivo no se puede leer (formato, codificación o encabezados)."""
+
+
+def leer_filas(archivo, nombre):
+    """
+    Devuelve un iterador de filas (listas) a partir de un archivo CSV, XLSX o XLS.
+    La primera fila es el encabezado. CSV y XLSX se leen de forma incremental.
+    """
+    extension = nombre.rsplit('.', 1)[-1].lower() if '.' in nombre else 'csv'
+    if extension == 'xlsx':
+        return _filas_xlsx(archivo)
+    if extension == 'xls':
+        return _filas_xls(archivo)
+    if extension in ('csv', 'txt'):
+        return _filas_csv(archivo)
+    raise ErrorArchivo(f'Extensión no soportada: .{extension}. Use CSV, XLSX o XLS.')
+
+
+def _filas_csv(archivo):
+    muestra = archivo.read(64 * 1024)
+    archivo.seek(0)
+    # Los archivos exportados desde Excel en Windows suelen venir en Latin-1.
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(muestra, final=False)
+        codificacion = 'utf-8-sig'
+    except UnicodeDecodeError:
+        codificacion = 'latin-1'
+    texto_muestra = muestra.decode(codificacion, errors='ignore')
+    try:
+        dialecto = csv.Sniffer().sniff(texto_muestra.split('\n', 1)[0], delimiters=',;\t|')
+    except csv.Error:
+        dialecto = csv.excel
+    return csv.reader(io.TextIOWrapper(archivo, encoding=codificacion, newline=''), dialecto)
+
+
+def _filas_xlsx(archivo):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ErrorArchivo('La lectura de XLSX requiere openpyxl.')
+    try:
+        libro = load_workbook(archivo, read_only=True, data_only=True)
+    except Exception as e:
+        raise ErrorArchivo(f'No se pudo leer el archivo XLSX: {e}')
+    return libro.worksheets[0].iter_rows(values_only=True)
+
+
+def _filas_xls(archivo):
+    try:
+        import xlrd
+    except ImportError:
+        raise ErrorArchivo('La lectura de XLS requiere xlrd.')
+    try:
+        libro = xlrd.open_workbook(file_contents=archivo.read())
+    except Exception as e:
+        raise ErrorArchivo(f'No se pudo leer el archivo XLS: {e}')
+    hoja = libro.sheet_by_index(0)
+
+    def filas():
+        for i in range(hoja.nrows):
+            fila = []
+            for celda in hoja.row(i):
+                if celda.ctype == xlrd.XL_CELL_DATE:
+                    fila.append(xlrd.xldate_as_datetime(celda.value, libro.datemode))
+                else:
+                    fila.append(celda.value)
+            yield fila
+    return filas()
+
+
+class ImportadorEquipos:
+    """
+    Carga masiva de equipos desde una hoja de cálculo.
+
+    Valida las filas por lotes contra las reglas del modelo (campos obligatorios,
+    opciones, longitudes y serial único, tanto en el archivo como en la base de datos),
+    inserta con bulk_create dentro de una sola transacción y genera el historial de
+    creación (HistorialEquipo y HistorialMovimientoEquipo) también en bloque, sin
+    pasar por las señales post_save por instancia.
+
+    Si hay errores no se inserta nada, salvo que se use `omitir_errores=True`, en cuyo
+    caso se cargan solo las filas válidas.
+    """
+
+    def __init__(self, usuario=None, sede_forzada=None, sede_por_defecto=None,
+                 omitir_errores=False, simulacion=False, tamano_lote=TAMANO_LOTE_IMPORTACION):
+        self.usuario = usuario
+        self.sede_forzada = sede_forzada
+        self.sede_por_defecto = sede_por_defecto
+        self.omitir_errores = omitir_errores
+        self.simulacion = simulacion
+        self.tamano_lote = tamano_lote
+
+        self.campos = {
+            field.name: field for field in Equipo._meta.concrete_fields
+            if field.name not in CAMPOS_NO_IMPORTABLES
+        }
+        self.alias = {}
+        for field in self.campos.values():
+            self.alias[normalizar(field.name)] = field.name
+            self.alias[normalizar(field.verbose_name)] = field.name
+        self.opciones = {
+            field.name: {normalizar(valor): valor for valor, etiqueta in field.choices}
+            | {normalizar(etiqueta): valor for valor, etiqueta in field.choices}
+            for field in self.campos.values() if field.choices
+        }
+        self.sedes = {}
+        for sede in Sede.objects.all():
+            self.sedes[str(sede.pk)] = sede
+            self.sedes[normalizar(sede.nombre)] = sede
+
+    def importar(self, archivo, nombre):
+        filas = leer_filas(archivo, nombre)
+        encabezado = next(iter(filas), None)
+        if not encabezado:
+            raise ErrorArchivo('El archivo está vacío.')
+        columnas = self._mapear_columnas(encabezado)
+
+        resultado = {'total_filas': 0, 'creados': 0, 'errores': [], 'simulacion': self.simulacion}
+        seriales_vistos = set()
+        filas = enumerate(filas, start=2)
+
+        with transaction.atomic():
+            while True:
+                lote = list(islice(filas, self.tamano_lote))
+                if not lote:
+                    break
+                lote = [(numero, fila) for numero, fila in lote if any(v not in (None, '') for v in fila)]
+                resultado['total_filas'] += len(lote)
+                validos = self._validar_lote(lote, columnas, seriales_vistos, resultado['errores'])
+                # Con errores y sin omitir_errores todo se revierte: basta con seguir validando.
+                insertar = not self.simulacion and (self.omitir_errores or not resultado['errores'])
+                if validos and insertar:
+                    self._insertar(validos)
+                resultado['creados'] += len(validos)
+
+            if self.simulacion or (resultado['errores'] and not self.omitir_errores):
+                transaction.set_rollback(True)
+                if not self.simulacion:
+                    resultado['creados'] = 0
+        return resultado
+
+    def _mapear_columnas(self, encabezado):
+        columnas = {}
+        for indice, titulo in enumerate(encabezado):
+            clave = normalizar(titulo or '')
+            if clave in self.alias:
+                columnas[self.alias[clave]] = indice
+            elif clave in ENCABEZADOS_SEDE:
+                columnas['sede'] = indice
+            elif clave in ENCABEZADOS_EMPLEADO:
+                columnas['empleado_cedula'] = indice
+        faltantes = [
+            self.campos[nombre].verbose_name for nombre in ('nombre', 'marca', 'modelo', 'serial')
+            if nombre not in columnas
+        ]
+        if faltantes:
+            raise ErrorArchivo(f"Faltan columnas obligatorias: {', '.join(faltantes)}.")
+        return columnas
+
+    def _valor(self, fila, columnas, nombre):
+        indice = columnas.get(nombre)
+        if indice is None or indice >= len(fila):
+            return None
+        valor = fila[indice]
+        if isinstance(valor, str):
+            valor = valor.strip()
+        elif isinstance(valor, float) and valor.is_integer():
+            # Excel guarda los seriales numéricos como float.
+            valor = str(int(valor))
+        return None if valor == '' else valor
+
+    def _convertir(self, field, valor):
+        if valor is None:
+            return None if field.null else ''
+        if field.choices:
+            return self.opciones[field.name].get(normalizar(valor), valor)
+        if field.get_internal_type() == 'DateField':
+            if isinstance(valor, datetime):
+                return valor.date()
+            if isinstance(valor, str) and '/' in valor:
+                try:
+                    return datetime.strptime(valor, '%d/%m/%Y').date()
+                except ValueError:
+                    pass
+        if field.get_internal_type() in ('CharField', 'TextField') and not isinstance(valor, str):
+            return str(valor)
+        return valor
+
+    def _validar_lote(self, lote, columnas, seriales_vistos, errores):
+        cedulas = {
+            str(self._valor(fila, columnas, 'empleado_cedula'))
+            for _, fila in lote if self._valor(fila, columnas, 'empleado_cedula') is not None
+        }
+        empleados = {e.cedula: e for e in Empleado.objects.filter(cedula__in=cedulas)} if cedulas else {}
+        seriales_lote = {
+            str(self._valor(fila, columnas, 'serial')) for _, fila in lote
+            if self._valor(fila, columnas, 'serial') is not None
+        }
+        seriales_existentes = set(
+            Equipo.objects.filter(serial__in=seriales_lote).values_list('serial', flat=True)
+        )
+
+        validos = []
+        for numero, fila in lote:
+            errores_fila = {}
+            datos = {}
+            for nombre, field in self.campos.items():
+                if nombre in columnas:
+                    datos[nombre] = self._convertir(field, self._valor(fila, columnas, nombre))
+
+            equipo = Equipo(**datos)
+            equipo.responsable_entrega = self.usuario
+
+            sede = self._resolver_sede(self._valor(fila, columnas, 'sede'), errores_fila)
+            equipo.sede = sede
+
+            cedula = self._valor(fila, columnas, 'empleado_cedula')
+            if cedula is not None:
+                empleado = empleados.get(str(cedula))
+                if empleado is None:
+                    errores_fila['empleado_asignado'] = [f'No existe un empleado con cédula {cedula}.']
+                else:
+                    equipo.empleado_asignado = empleado
+                    if 'estado_disponibilidad' not in columnas:
+                        equipo.estado_disponibilidad = 'Asignado'
+
+            # Sin validate_unique: la unicidad del serial se revisa por lote, no por fila.
+            try:
+                equipo.full_clean(validate_unique=False, validate_constraints=False)
+            except ValidationError as e:
+                errores_fila.update(e.message_dict)
+
+            serial = equipo.serial
+            if serial and 'serial' not in errores_fila:
+                if serial in seriales_existentes:
+                    errores_fila['serial'] = [f'Ya existe un equipo con el serial {serial}.']
+                elif serial in seriales_vistos:
+                    errores_fila['serial'] = [f'El serial {serial} está repetido en el archivo.']
+                seriales_vistos.add(serial)
+
+            if errores_fila:
+                errores.append({'fila': numero, 'serial': serial or None, 'errores': errores_fila})
+            else:
+                validos.append(equipo)
+        return validos
+
+    def _resolver_sede(self, valor, errores_fila):
+        if self.sede_forzada is not None:
+            return self.sede_forzada
+        if valor is None:
+            return self.sede_por_defecto
+        sede = self.sedes.get(normalizar(valor))
+        if sede is None:
+            errores_fila['sede'] = [f'No existe la sede "{valor}".']
+        return sede
+
+    def _insertar(self, equipos):
+        Equipo.objects.bulk_create(equipos, batch_size=self.tamano_lote)
+
+        # Historial de creación calculado en la base de datos, en una sola sentencia.
+        ids = [equipo.pk for equipo in equipos]
+        registrar_creacion_equipos(ids, self.usuario)
+        actualizar_busqueda(Equipo.objects.filter(pk__in=ids))
+        invalidar_dashboard([equipo.sede_id for equipo in equipos])
+
+        ahora = timezone.now()
+        asignados = [equipo for equipo in equipos if equipo.empleado_asignado_id]
+        movimientos = [
+            HistorialMovimientoEquipo(
+                equipo=equipo,
+                equipo_nombre=equipo.nombre,
+                equipo_serial=equipo.serial,
+                empleado_asignado=equipo.empleado_asignado,
+                sede=equipo.sede,
+                fecha_asignacion=ahora,
+            )
+            for equipo in asignados
+        ]
+        if movimientos:
+            HistorialMovimientoEquipo.objects.bulk_create(movimientos, batch_size=self.tamano_lote)
+            AsignacionAbierta.objects.bulk_create([
+                AsignacionAbierta(equipo=equipo, empleado_id=equipo.empleado_asignado_id, fecha_asignacion=ahora)
+                for equipo in asignados
+            ], batch_size=self.tamano_lote)
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from inventory.partitions import archivar_particiones
+
+
+class Command(BaseCommand):
+    help = (
+        'Exports monthly history partitions older than the retention period to .csv.gz files and drops them, '
+        'and does the same with equally old rows of the default partitions. Open assignments are kept.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retention-months', type=int, default=settings.HISTORIAL_MESES_RETENCION,
+            help='Months of history kept in the database, besides the current one.'
+        )
+        parser.add_argument(
+            '--output-dir', default=str(settings.HISTORIAL_DIRECTORIO_ARCHIVO),
+            help='Directory where the exported partitions are written.'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Only list what would be archived.')
+
+    def handle(self, *args, **options):
+        archivadas = archivar_particiones(
+            options['output_dir'], options['retention_months'], simular=options['dry_run']
+        )
+        for nombre, filas in archivadas:
+            self.stdout.write(f'{nombre}: {filas} rows')
+        verbo = 'would be archived' if options['dry_run'] else 'archived'
+        self.stdout.write(self.style.SUCCESS(f'{len(archivadas)} partitions or default-partition batches {verbo}.'))
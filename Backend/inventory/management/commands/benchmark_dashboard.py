@@ -0,0 +1,162 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from inventory.dashboard import invalidar_dashboard
+from inventory.models import Equipo, Licencia, Periferico
+from inventory.views import DashboardStatsView
+from mantenimientos.models import Mantenimiento
+from sede.models import Sede
+
+TAMANO_LOTE = 5000
+
+
+class Command(BaseCommand):
+    help = (
+        'Times GET /api/dashboard/stats/ for all sedes and for one sede (median of warm runs '
+        'and query count), with the dashboard cache invalidated before each request unless '
+        '--cached. With --seed, first fills an empty database with synthetic data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=7, help='Timed runs per scope (after one warm-up run).')
+        parser.add_argument('--sede', type=int, help='Sede id for the single-sede run (default: the one with most equipos).')
+        parser.add_argument(
+            '--seed', type=int, metavar='EQUIPOS',
+            help='Create this many equipos, spread over --sedes sedes, with 5 mantenimientos, '
+                 '1 periférico and 1 licencia each. Only allowed when there are no equipos.',
+        )
+        parser.add_argument('--sedes', type=int, default=10, help='Sedes to spread the seeded equipos over.')
+        parser.add_argument('--cached', action='store_true', help='Time cache hits instead of the computation.')
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            if Equipo.objects.exists():
+                raise CommandError('--seed needs a database without equipos.')
+            self._sembrar(options['seed'], options['sedes'])
+
+        if options['sede']:
+            sede = Sede.objects.filter(pk=options['sede']).first()
+            if sede is None:
+                raise CommandError(f'Sede {options["sede"]} does not exist.')
+        else:
+            sede = Sede.objects.annotate(equipos=Count('equipo')).order_by('-equipos', 'pk').first()
+
+        self.stdout.write(
+            f'{Equipo.objects.count()} equipos, {Mantenimiento.objects.count()} mantenimientos, '
+            f'{Periferico.objects.count()} periféricos, {Licencia.objects.count()} licencias, '
+            f'{Sede.objects.count()} sedes.'
+        )
+        mediana, consultas = self._medir(None, options['runs'], options['cached'])
+        self.stdout.write(f'all sedes: {mediana:.0f} ms / {consultas} queries')
+        if sede is None:
+            self.stdout.write('one sede: skipped, there are no sedes.')
+        else:
+            mediana, consultas = self._medir(sede, options['runs'], options['cached'])
+            self.stdout.write(f'sede {sede.pk} ({sede}): {mediana:.0f} ms / {consultas} queries')
+
+    @staticmethod
+    def _medir(sede, runs, cached):
+        # Administrador en memoria: sin perfil, así que la vista no consulta usuarios.
+        usuario = User(username='benchmark', is_staff=True)
+        url = '/api/dashboard/stats/' + (f'?sede={sede.pk}' if sede else '')
+        vista = DashboardStatsView.as_view()
+        factory = APIRequestFactory()
+
+        def pedir():
+            if not cached:
+                # Fuera de una transacción on_commit invalida en el acto.
+                invalidar_dashboard()
+            request = factory.get(url)
+            force_authenticate(request, user=usuario)
+            response = vista(request)
+            if response.status_code != 200:
+                raise CommandError(f'{url} returned {response.status_code}.')
+
+        pedir()
+        tiempos = []
+        for _ in range(runs):
+            inicio = time.perf_counter()
+            pedir()
+            tiempos.append(time.perf_counter() - inicio)
+        with CaptureQueriesContext(connection) as contexto:
+            pedir()
+        return statistics.median(tiempos) * 1000, len(contexto.captured_queries)
+
+    def _sembrar(self, total, num_sedes):
+        # Datos reproducibles: misma semilla, mismos datos.
+        aleatorio = random.Random(0)
+        hoy = timezone.now().date()
+        with transaction.atomic():
+            sedes = [
+                Sede.objects.get_or_create(nombre=f'Benchmark {i + 1}')[0] for i in range(num_sedes)
+            ]
+            equipos = Equipo.objects.bulk_create(
+                [
+                    Equipo(
+                        nombre=f'Equipo {i}', marca=aleatorio.choice(['HP', 'Dell', 'Lenovo']), modelo=f'M{i % 50}',
+                        serial=f'BENCH-{i:08d}', sede=sedes[i % num_sedes],
+                        tipo_equipo=aleatorio.choice(['Desktop', 'Laptop']),
+                        estado_tecnico=aleatorio.choice(['Nuevo', 'Reacondicionado']),
+                        estado_disponibilidad=aleatorio.choice(['Disponible', 'Asignado', 'Reservado']),
+                        activo=aleatorio.random() > 0.05,
+                    )
+                    for i in range(total)
+                ],
+                batch_size=TAMANO_LOTE,
+            )
+            mantenimientos = []
+            for equipo in equipos:
+                # Solo el último puede quedar abierto: un mantenimiento abierto por equipo.
+                for j in range(5):
+                    inicio = hoy - timedelta(days=aleatorio.randint(0, 720))
+                    estado = aleatorio.choice(['Pendiente', 'En proceso']) if j == 4 and aleatorio.random() < 0.2 else (
+                        aleatorio.choice(['Finalizado', 'Finalizado', 'Finalizado', 'Cancelado'])
+                    )
+                    mantenimientos.append(Mantenimiento(
+                        equipo=equipo, sede_id=equipo.sede_id,
+                        tipo_mantenimiento=aleatorio.choice(['Preventivo', 'Correctivo']),
+                        estado_mantenimiento=estado, fecha_inicio=inicio,
+                        fecha_finalizacion=inicio + timedelta(days=aleatorio.randint(1, 30)),
+                        fecha_real_finalizacion=(
+                            inicio + timedelta(days=aleatorio.randint(0, 40)) if estado == 'Finalizado' else None
+                        ),
+                    ))
+                if len(mantenimientos) >= TAMANO_LOTE:
+                    Mantenimiento.objects.bulk_create(mantenimientos)
+                    mantenimientos = []
+            Mantenimiento.objects.bulk_create(mantenimientos)
+            Periferico.objects.bulk_create(
+                [
+                    Periferico(
+                        nombre=f'Periférico {equipo.pk}', tipo=aleatorio.choice(['Mouse', 'Teclado']),
+                        equipo_asociado=equipo, sede_id=equipo.sede_id,
+                    )
+                    for equipo in equipos
+                ],
+                batch_size=TAMANO_LOTE,
+            )
+            Licencia.objects.bulk_create(
+                [
+                    Licencia(
+                        equipo_asociado=equipo, tipo_licencia='Sistema Operativo', tipo_activacion='OEM',
+                        fecha_instalacion=hoy - timedelta(days=400),
+                        fecha_vencimiento=hoy + timedelta(days=aleatorio.randint(-60, 365)),
+                    )
+                    for equipo in equipos
+                ],
+                batch_size=TAMANO_LOTE,
+            )
+        with connection.cursor() as cursor:
+            for modelo in (Equipo, Mantenimiento, Periferico, Licencia):
+                cursor.execute(f'ANALYZE {connection.ops.quote_name(modelo._meta.db_table)}')
+        self.stdout.write(self.style.SUCCESS(f'Seeded {total} equipos over {num_sedes} sedes.'))
@@ -0,0 +1,80 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from inventory.models import Equipo, HistorialEquipo
+
+# Filas por campo de un mismo guardado: mismo equipo, usuario y acción, escritas con
+# ids consecutivos y fechas casi iguales (auto_now_add tomaba la hora fila por fila).
+VENTANA_GUARDADO = timedelta(seconds=1)
+
+
+class Command(BaseCommand):
+    help = 'Converts per-field HistorialEquipo rows into one compact row per save (JSONB diff).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Equipos processed per transaction.')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many rows would be compacted.')
+
+    def handle(self, *args, **options):
+        nombres = {str(field.verbose_name): field.name for field in Equipo._meta.fields}
+        leidas = creadas = 0
+        ultimo = 0
+        while True:
+            ids = list(
+                HistorialEquipo.objects.filter(equipo_id__gt=ultimo, cambios__isnull=True)
+                .order_by('equipo_id').values_list('equipo_id', flat=True).distinct()[:options['batch_size']]
+            )
+            if not ids:
+                break
+            ultimo = ids[-1]
+            with transaction.atomic():
+                filas = list(
+                    HistorialEquipo.objects.select_for_update()
+                    .filter(equipo_id__in=ids, cambios__isnull=True).order_by('equipo_id', 'id')
+                )
+                compactas = [self._compactar(grupo, nombres) for grupo in self._agrupar(filas)]
+                leidas += len(filas)
+                creadas += len(compactas)
+                if not options['dry_run']:
+                    HistorialEquipo.objects.bulk_create(compactas, batch_size=1000)
+                    HistorialEquipo.objects.filter(id__in=[fila.id for fila in filas]).delete()
+
+        verbo = 'would be compacted' if options['dry_run'] else 'compacted'
+        self.stdout.write(self.style.SUCCESS(f'{leidas} rows {verbo} into {creadas}.'))
+
+    @staticmethod
+    def _agrupar(filas):
+        grupo = []
+        for fila in filas:
+            if grupo and (
+                (fila.equipo_id, fila.usuario_id, fila.tipo_accion) != (grupo[0].equipo_id, grupo[0].usuario_id, grupo[0].tipo_accion)
+                or fila.fecha_cambio - grupo[0].fecha_cambio > VENTANA_GUARDADO
+                # Un campo repetido ya es otro guardado.
+                or fila.campo_modificado in {anterior.campo_modificado for anterior in grupo}
+            ):
+                yield grupo
+                grupo = []
+            grupo.append(fila)
+        if grupo:
+            yield grupo
+
+    @staticmethod
+    def _compactar(grupo, nombres):
+        # El tipo original de las filas viejas no se conoce: se guarda solo su texto.
+        cambios = {}
+        for fila in grupo:
+            cambio = {'texto_nuevo': fila.valor_nuevo}
+            if fila.tipo_accion != 'CREADO':
+                cambio['texto_anterior'] = fila.valor_anterior
+            cambios[nombres.get(fila.campo_modificado, fila.campo_modificado)] = cambio
+        primera = grupo[0]
+        return HistorialEquipo(
+            equipo_id=primera.equipo_id,
+            usuario_id=primera.usuario_id,
+            fecha_cambio=primera.fecha_cambio,
+            tipo_accion=primera.tipo_accion,
+            campo_modificado='',
+            cambios=cambios,
+        )
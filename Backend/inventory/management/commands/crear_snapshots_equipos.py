@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from inventory.snapshots import crear_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Stores a snapshot of every equipo changed since its last snapshot (run daily; bounds ?as_of= lookups).'
+
+    def handle(self, *args, **options):
+        creados = crear_snapshots()
+        self.stdout.write(self.style.SUCCESS(f'{creados} snapshots created.'))
@@ -0,0 +1,63 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.importers import ImportadorEquipos, ErrorArchivo
+from sede.models import Sede
+
+
+class Command(BaseCommand):
+    help = 'Bulk-imports equipos from a CSV, XLSX or XLS file, validating rows in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help='Path to the CSV, XLSX or XLS file.')
+        parser.add_argument('--sede', help='Sede id or name used for rows without a sede column.')
+        parser.add_argument('--usuario', help='Username recorded as author of the creation history.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows validated and inserted per batch.')
+        parser.add_argument('--skip-errors', action='store_true', help='Import the valid rows even if some rows fail.')
+        parser.add_argument('--dry-run', action='store_true', help='Validate only; nothing is written.')
+
+    def handle(self, *args, **options):
+        sede = None
+        if options['sede']:
+            sede = Sede.objects.filter(pk=options['sede']).first() if options['sede'].isdigit() else None
+            sede = sede or Sede.objects.filter(nombre__iexact=options['sede']).first()
+            if sede is None:
+                raise CommandError(f"Sede '{options['sede']}' not found.")
+
+        usuario = None
+        if options['usuario']:
+            try:
+                usuario = User.objects.get(username=options['usuario'])
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['usuario']}' not found.")
+
+        importador = ImportadorEquipos(
+            usuario=usuario,
+            sede_por_defecto=sede,
+            omitir_errores=options['skip_errors'],
+            simulacion=options['dry_run'],
+            tamano_lote=options['batch_size'],
+        )
+        try:
+            with open(options['archivo'], 'rb') as archivo:
+                resultado = importador.importar(archivo, options['archivo'])
+        except (OSError, ErrorArchivo) as e:
+            raise CommandError(str(e))
+
+        for error in resultado['errores']:
+            detalle = '; '.join(f"{campo}: {' '.join(mensajes)}" for campo, mensajes in error['errores'].items())
+            self.stdout.write(self.style.WARNING(f"  - Row {error['fila']}: {detalle}"))
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f"Dry run: {resultado['creados']} of {resultado['total_filas']} rows are valid."
+            ))
+        elif resultado['errores'] and not options['skip_errors']:
+            raise CommandError(
+                f"{len(resultado['errores'])} rows have errors; nothing was imported. "
+                "Fix them or use --skip-errors."
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Imported {resultado['creados']} of {resultado['total_filas']} rows."
+            ))
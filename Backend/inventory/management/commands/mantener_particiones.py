@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from inventory.partitions import MESES_ADELANTE, asegurar_particiones
+
+
+class Command(BaseCommand):
+    help = 'Creates the monthly history partitions for the current month and the upcoming ones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=MESES_ADELANTE, help='Upcoming months to create.')
+
+    def handle(self, *args, **options):
+        creadas = asegurar_particiones(options['months_ahead'])
+        for nombre in creadas:
+            self.stdout.write(f'Created {nombre}')
+        self.stdout.write(self.style.SUCCESS(f'{len(creadas)} partitions created.'))
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from inventory.outbox import estado_outbox, procesar_eventos
+
+
+class Command(BaseCommand):
+    help = 'Expands pending history events (HISTORIAL_DIFERIDO) into history rows in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Events processed per transaction.')
+        parser.add_argument('--loop', action='store_true', help='Keep running, polling for new events.')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to wait when the outbox is empty (with --loop).')
+        parser.add_argument('--status', action='store_true', help='Only report pending events and lag.')
+
+    def handle(self, *args, **options):
+        if options['status']:
+            self._reportar_estado()
+            return
+
+        total = 0
+        while True:
+            procesados = procesar_eventos(options['batch_size'])
+            total += procesados
+            if procesados and options['verbosity'] >= 2:
+                self.stdout.write(f'{procesados} events processed.')
+            if procesados:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f'{total} events processed.'))
+        self._reportar_estado()
+
+    def _reportar_estado(self):
+        estado = estado_outbox()
+        self.stdout.write(f"pending={estado['pendientes']} lag_seconds={estado['retraso_segundos']:.1f}")
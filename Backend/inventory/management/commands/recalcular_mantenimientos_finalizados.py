@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from inventory.dashboard import invalidar_dashboard
+from inventory.models import Equipo
+from mantenimientos.models import Mantenimiento
+
+
+class Command(BaseCommand):
+    help = 'Recomputes Equipo.mantenimientos_finalizados from the mantenimientos table, fixing any drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Equipos updated per transaction.')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many counters are wrong.')
+
+    def handle(self, *args, **options):
+        finalizados = Mantenimiento.objects.filter(
+            equipo=OuterRef('pk'), estado_mantenimiento='Finalizado'
+        ).order_by().values('equipo').annotate(total=Count('pk')).values('total')
+        real = Coalesce(Subquery(finalizados), Value(0))
+
+        tamano_lote = options['batch_size']
+        corregidos = 0
+        ultimo = 0
+        while True:
+            ids = list(
+                Equipo.objects.filter(pk__gt=ultimo).order_by('pk').values_list('pk', flat=True)[:tamano_lote]
+            )
+            if not ids:
+                break
+            ultimo = ids[-1]
+            # Lotes cortos por rango de id: cada transacción bloquea pocas filas.
+            with transaction.atomic():
+                desfasados = Equipo.objects.filter(pk__in=ids).annotate(real=real).exclude(
+                    mantenimientos_finalizados=F('real')
+                )
+                if options['dry_run']:
+                    corregidos += desfasados.count()
+                else:
+                    corregidos += Equipo.objects.filter(
+                        pk__in=desfasados.values('pk')
+                    ).update(mantenimientos_finalizados=real)
+
+        if corregidos and not options['dry_run']:
+            invalidar_dashboard()
+
+        verbo = 'would be fixed' if options['dry_run'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'{corregidos} counters {verbo}.'))
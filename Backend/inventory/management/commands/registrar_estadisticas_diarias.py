@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from inventory.dashboard import registrar_estadisticas_diarias
+
+
+class Command(BaseCommand):
+    help = "Stores today's dashboard statistics for every sede (run nightly, near the end of the day; feeds the trend endpoint)."
+
+    def handle(self, *args, **options):
+        escritas = registrar_estadisticas_diarias()
+        self.stdout.write(self.style.SUCCESS(f'{escritas} daily statistics rows written.'))
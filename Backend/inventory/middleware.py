@@ -1,28 +1,182 @@
-import threading
+import contextvars
+import logging
+import re
+import time
+import uuid
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+_request_context = contextvars.ContextVar('request_context', default=None)
+
+# Incoming X-Request-ID values are reused only if they look like an id.
+REQUEST_ID_PATTERN = re.compile(r'[A-Za-z0-9._-]{1,64}')
+
+
+class RequestContext:
+    """
+    Per-request data shared with signals and instrumentation: the user, a request id
+    and timings. It lives in a ContextVar, so it follows the request across sync and
+    async code and into executors started with run_in_thread / run_in_process.
+    """
+
+    def __init__(self, request=None, user=None, request_id=None):
+        self.request = request
+        self._user = user
+        self.request_id = request_id or uuid.uuid4().hex
+        self.started = time.perf_counter()
+        self.timings = {}
+
+    @property
+    def user(self):
+        # Resolved on access: DRF authenticates inside the view (token, session), after
+        # this middleware has run, and stores the result on the Django request.
+        if self._user is None and self.request is not None:
+            user = getattr(self.request, 'user', None)
+            if user is not None and user.is_authenticated:
+                return user
+            return None
+        return self._user
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def add_timing(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def export(self):
+        """
+        Picklable snapshot for process pools (see run_in_process).
+        """
+        user = self.user
+        return {'user_id': getattr(user, 'pk', None), 'request_id': self.request_id}
+
+
+def get_request_context():
+    return _request_context.get()
 
-_thread_locals = threading.local()
 
 def get_current_user():
     """
-    Returns the current user from thread-local storage.
+    Returns the user of the current request (or of the active request_context block).
+    """
+    context = _request_context.get()
+    return context.user if context is not None else None
+
+
+def get_request_id():
+    context = _request_context.get()
+    return context.request_id if context is not None else None
+
+
+@contextmanager
+def request_context(user=None, request_id=None, request=None):
+    """
+    Activates a request context outside the middleware (management commands, workers).
+    """
+    context = RequestContext(request=request, user=user, request_id=request_id)
+    token = _request_context.set(context)
+    try:
+        yield context
+    finally:
+        _request_context.reset(token)
+
+
+@contextmanager
+def timed(name):
+    """
+    Adds the duration of the block to the current request's timings (Server-Timing).
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        context = _request_context.get()
+        if context is not None:
+            context.add_timing(name, time.perf_counter() - started)
+
+
+def run_in_thread(executor, fn, *args, **kwargs):
+    """
+    executor.submit() that keeps the current request context in the worker thread.
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def _run_with_exported_context(exported, fn, args, kwargs):
+    from django.contrib.auth import get_user_model
+
+    user = None
+    if exported and exported['user_id'] is not None:
+        user = get_user_model()._default_manager.filter(pk=exported['user_id']).first()
+    with request_context(user=user, request_id=exported and exported['request_id']):
+        return fn(*args, **kwargs)
+
+
+def run_in_process(executor, fn, *args, **kwargs):
+    """
+    executor.submit() for process pools: the context cannot cross the process boundary
+    as is, so the user id and request id are sent and restored in the worker.
+    `fn` and its arguments must be picklable.
+    """
+    context = _request_context.get()
+    exported = context.export() if context is not None else None
+    return executor.submit(_run_with_exported_context, exported, fn, args, kwargs)
+
+
+class RequestIdLogFilter(logging.Filter):
+    """
+    Adds `request_id` to log records, for formats such as '%(request_id)s %(message)s'.
     """
-    return getattr(_thread_locals, 'user', None)
+    def filter(self, record):
+        record.request_id = get_request_id() or '-'
+        return True
+
 
 class CurrentUserMiddleware:
     """
-    Middleware to store the current user in thread-local storage.
+    Middleware that opens a RequestContext for each request, in sync or async stacks.
+    Reuses a valid incoming X-Request-ID and returns it, together with Server-Timing.
     """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        # Store the user in thread-local storage
-        _thread_locals.user = request.user if request.user.is_authenticated else None
-        
-        response = self.get_response(request)
-        
-        # Clean up after the request is done
-        if hasattr(_thread_locals, 'user'):
-            del _thread_locals.user
-            
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = self._start(request)
+        try:
+            response = self.get_response(request)
+            return self._finish(request, response)
+        finally:
+            _request_context.reset(token)
+
+    async def __acall__(self, request):
+        token = self._start(request)
+        try:
+            response = await self.get_response(request)
+            return self._finish(request, response)
+        finally:
+            _request_context.reset(token)
+
+    @staticmethod
+    def _start(request):
+        incoming = request.headers.get('X-Request-ID', '')
+        request_id = incoming if REQUEST_ID_PATTERN.fullmatch(incoming) else None
+        context = RequestContext(request=request, request_id=request_id)
+        request.request_id = context.request_id
+        return _request_context.set(context)
+
+    @staticmethod
+    def _finish(request, response):
+        context = _request_context.get()
+        response['X-Request-ID'] = context.request_id
+        metrics = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in context.timings.items()]
+        metrics.append(f'total;dur={context.elapsed() * 1000:.1f}')
+        response['Server-Timing'] = ', '.join(metrics)
         return response
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.8 on 2026-10-17 19:40
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Concat
+
+
+def poblar_busqueda(apps, schema_editor):
+    Equipo = apps.get_model('inventory', 'Equipo')
+    Empleado = apps.get_model('empleados', 'Empleado')
+    empleado = Empleado.objects.filter(pk=OuterRef('empleado_asignado_id')).annotate(
+        nombre_completo=Concat('nombre', Value(' '), 'apellido')
+    ).values('nombre_completo')
+    Equipo.objects.update(busqueda=(
+        SearchVector('serial', 'nombre', weight='A', config='simple')
+        + SearchVector('marca', 'modelo', Subquery(empleado), weight='B', config='simple')
+        + SearchVector('procesador', 'sistema_operativo', weight='C', config='simple')
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('empleados', '0005_empleado_sede'),
+        ('inventory', '0013_actualizado_en'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='equipo',
+            name='busqueda',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(poblar_busqueda, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='equipo',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['busqueda'], name='equipo_busqueda_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='equipo',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['serial'], name='equipo_serial_trgm', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.8 on 2026-10-17 19:44
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # Índices creados sin bloquear escrituras en tablas con datos.
+    atomic = False
+
+    dependencies = [
+        ('inventory', '0014_busqueda_equipos'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='equipo',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['sede', 'nombre', 'id'], name='equipo_activo_sede_nombre'),
+        ),
+        AddIndexConcurrently(
+            model_name='equipo',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['nombre', 'id'], name='equipo_activo_nombre'),
+        ),
+        AddIndexConcurrently(
+            model_name='equipo',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['fecha_proximo_mantenimiento'], name='equipo_activo_prox_mant'),
+        ),
+        AddIndexConcurrently(
+            model_name='historialequipo',
+            index=models.Index(fields=['equipo', '-fecha_cambio'], name='hist_equipo_equipo_fecha'),
+        ),
+        AddIndexConcurrently(
+            model_name='historialmovimientoequipo',
+            index=models.Index(fields=['-fecha_asignacion'], name='hist_movimiento_fecha'),
+        ),
+        AddIndexConcurrently(
+            model_name='historialperiferico',
+            index=models.Index(fields=['-fecha_asignacion'], name='hist_periferico_fecha'),
+        ),
+        AddIndexConcurrently(
+            model_name='licencia',
+            index=models.Index(fields=['fecha_vencimiento'], name='licencia_fecha_vencimiento'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.8 on 2026-10-17 20:05
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def poblar_contador(apps, schema_editor):
+    Equipo = apps.get_model('inventory', 'Equipo')
+    Mantenimiento = apps.get_model('mantenimientos', 'Mantenimiento')
+    finalizados = Mantenimiento.objects.filter(
+        equipo=OuterRef('pk'), estado_mantenimiento='Finalizado'
+    ).order_by().values('equipo').annotate(total=Count('pk')).values('total')
+    Equipo.objects.update(mantenimientos_finalizados=Coalesce(Subquery(finalizados), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    # El índice se crea sin bloquear escrituras.
+    atomic = False
+
+    dependencies = [
+        ('inventory', '0015_indices_consultas'),
+        ('mantenimientos', '0008_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='equipo',
+            name='mantenimientos_finalizados',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Mantenimientos Finalizados'),
+        ),
+        migrations.RunPython(poblar_contador, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='equipo',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['mantenimientos_finalizados', 'sede'], name='equipo_activo_salud'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.8 on 2026-10-17 19:57
+
+import django.core.serializers.json
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0016_contador_mantenimientos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventoHistorial',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=30, verbose_name='Tipo de Historial')),
+                ('datos', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='Datos')),
+                ('creado_en', models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='Fecha del Evento')),
+            ],
+            options={
+                'verbose_name': 'Evento de Historial Pendiente',
+                'verbose_name_plural': 'Eventos de Historial Pendientes',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='historialequipo',
+            name='fecha_cambio',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='Fecha del Cambio'),
+        ),
+        migrations.AlterField(
+            model_name='historialmovimientoequipo',
+            name='fecha_asignacion',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='Fecha de Asignación'),
+        ),
+        migrations.AlterField(
+            model_name='historialperiferico',
+            name='fecha_asignacion',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='Fecha de Asignación'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-17 20:01
+
+import inventory.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0017_historial_diferido'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historialequipo',
+            name='cambios',
+            field=models.JSONField(blank=True, editable=False, encoder=inventory.models.CodificadorHistorial, null=True, verbose_name='Cambios'),
+        ),
+        migrations.AlterField(
+            model_name='eventohistorial',
+            name='datos',
+            field=models.JSONField(encoder=inventory.models.CodificadorHistorial, verbose_name='Datos'),
+        ),
+    ]
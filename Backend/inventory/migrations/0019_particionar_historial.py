@@ -0,0 +1,30 @@
+from django.db import migrations
+
+from inventory.partitions import desparticionar_tabla, particionar_tabla
+
+TABLAS = (
+    'inventory_historialequipo',
+    'inventory_historialmovimientoequipo',
+    'inventory_historialperiferico',
+)
+
+
+def particionar(apps, schema_editor):
+    for tabla in TABLAS:
+        particionar_tabla(schema_editor, tabla)
+
+
+def desparticionar(apps, schema_editor):
+    for tabla in TABLAS:
+        desparticionar_tabla(schema_editor, tabla)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0018_historial_equipo_compacto'),
+    ]
+
+    operations = [
+        migrations.RunPython(particionar, desparticionar),
+    ]
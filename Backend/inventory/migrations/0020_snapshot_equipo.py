@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-17 20:12
+
+import django.db.models.deletion
+import inventory.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0019_particionar_historial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnapshotEquipo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateTimeField(verbose_name='Vigente Desde')),
+                ('datos', models.JSONField(encoder=inventory.models.CodificadorHistorial, verbose_name='Datos')),
+                ('equipo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='inventory.equipo')),
+            ],
+            options={
+                'verbose_name': 'Snapshot de Equipo',
+                'verbose_name_plural': 'Snapshots de Equipos',
+                'ordering': ['equipo', '-fecha'],
+                'constraints': [models.UniqueConstraint(fields=('equipo', 'fecha'), name='snapshot_equipo_fecha')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-17 20:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0020_snapshot_equipo'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='historialequipo',
+            name='hist_equipo_equipo_fecha',
+        ),
+        migrations.AddIndex(
+            model_name='historialequipo',
+            index=models.Index(fields=['equipo', '-fecha_cambio', '-id'], name='hist_equipo_equipo_fecha_id'),
+        ),
+        migrations.AddIndex(
+            model_name='historialequipo',
+            index=models.Index(fields=['-fecha_cambio', '-id'], name='hist_equipo_fecha_id'),
+        ),
+    ]
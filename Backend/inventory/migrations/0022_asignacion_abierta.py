@@ -0,0 +1,96 @@
+# Generated by Django 5.2.8 on 2026-10-17 20:23
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+# Historial con asignación abierta: (tabla, columna del objeto, tabla del objeto,
+# condición de fila abierta, condición de objeto asignado). Un equipo dado de baja
+# solo tiene asignación si su fila sigue abierta (se le asignó después de la baja),
+# igual que con las señales.
+ASIGNACIONES = [
+    ('inventory_historialmovimientoequipo', 'equipo_id', 'inventory_equipo',
+     'h.fecha_devolucion IS NULL AND NOT h.es_baja', 'o.empleado_asignado_id IS NOT NULL AND (o.activo OR h.id IS NOT NULL)'),
+    ('inventory_historialperiferico', 'periferico_id', 'inventory_periferico',
+     'h.fecha_devolucion IS NULL AND NOT h.es_baja', 'o.empleado_asignado_id IS NOT NULL'),
+]
+
+
+def poblar_asignaciones(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for historial, columna, tabla, abierta, asignado in ASIGNACIONES:
+            # Solo la asignación más reciente de cada objeto queda abierta.
+            cursor.execute(f"""
+                UPDATE {historial} h SET fecha_devolucion = NOW(), observacion_devolucion = 'Cierre de asignación duplicada'
+                FROM (
+                    SELECT id, fecha_asignacion, ROW_NUMBER() OVER (
+                        PARTITION BY {columna} ORDER BY fecha_asignacion DESC, id DESC
+                    ) AS orden
+                    FROM {historial} h WHERE {abierta} AND {columna} IS NOT NULL
+                ) d
+                WHERE h.id = d.id AND h.fecha_asignacion = d.fecha_asignacion AND d.orden > 1
+            """)
+            # El responsable actual, con la fecha de su fila abierta si la tiene.
+            cursor.execute(f"""
+                INSERT INTO inventory_asignacionabierta ({columna}, empleado_id, fecha_asignacion)
+                SELECT o.id, o.empleado_asignado_id, COALESCE(h.fecha_asignacion, NOW())
+                FROM {tabla} o
+                LEFT JOIN {historial} h ON h.{columna} = o.id AND h.empleado_asignado_id = o.empleado_asignado_id AND {abierta}
+                WHERE {asignado}
+            """)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('empleados', '0005_empleado_sede'),
+        ('inventory', '0021_indices_auditoria_historial'),
+        ('sede', '0003_delete_historialsede'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AsignacionAbierta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha_asignacion', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Fecha de Asignación')),
+            ],
+            options={
+                'verbose_name': 'Asignación Abierta',
+                'verbose_name_plural': 'Asignaciones Abiertas',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='historialmovimientoequipo',
+            index=models.Index(condition=models.Q(('es_baja', False), ('fecha_devolucion__isnull', True)), fields=['equipo', 'empleado_asignado'], name='hist_movimiento_abierto'),
+        ),
+        migrations.AddIndex(
+            model_name='historialperiferico',
+            index=models.Index(condition=models.Q(('fecha_devolucion__isnull', True)), fields=['periferico', 'empleado_asignado'], name='hist_periferico_abierta'),
+        ),
+        migrations.AddField(
+            model_name='asignacionabierta',
+            name='empleado',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='asignaciones_abiertas', to='empleados.empleado', verbose_name='Empleado Asignado'),
+        ),
+        migrations.AddField(
+            model_name='asignacionabierta',
+            name='equipo',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='asignacion_abierta', to='inventory.equipo'),
+        ),
+        migrations.AddField(
+            model_name='asignacionabierta',
+            name='periferico',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='asignacion_abierta', to='inventory.periferico'),
+        ),
+        migrations.AddIndex(
+            model_name='asignacionabierta',
+            index=models.Index(fields=['empleado'], include=('equipo', 'periferico', 'fecha_asignacion'), name='asignacion_abierta_empleado'),
+        ),
+        migrations.AddConstraint(
+            model_name='asignacionabierta',
+            constraint=models.CheckConstraint(condition=models.Q(models.Q(('equipo__isnull', False), ('periferico__isnull', True)), models.Q(('equipo__isnull', True), ('periferico__isnull', False)), _connector='OR'), name='asignacion_abierta_un_objeto'),
+        ),
+        migrations.RunPython(poblar_asignaciones, migrations.RunPython.noop),
+    ]
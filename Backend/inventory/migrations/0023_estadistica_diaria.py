@@ -0,0 +1,40 @@
+# Generated by Django 5.2.8 on 2026-10-17 20:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0022_asignacion_abierta'),
+        ('sede', '0003_delete_historialsede'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadisticaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(verbose_name='Fecha')),
+                ('total_equipos', models.PositiveIntegerField(default=0, verbose_name='Equipos Activos')),
+                ('equipos_dados_de_baja', models.PositiveIntegerField(default=0, verbose_name='Equipos Dados de Baja')),
+                ('equipos_por_estado', models.JSONField(default=dict, verbose_name='Equipos por Estado')),
+                ('equipos_por_tipo', models.JSONField(default=dict, verbose_name='Equipos por Tipo')),
+                ('mantenimientos_activos', models.PositiveIntegerField(default=0, verbose_name='Mantenimientos Activos')),
+                ('mantenimientos_vencidos', models.PositiveIntegerField(default=0, verbose_name='Mantenimientos Vencidos')),
+                ('mantenimientos_finalizados_tarde', models.PositiveIntegerField(default=0, verbose_name='Mantenimientos Finalizados Tarde')),
+                ('licencias_vencidas', models.PositiveIntegerField(default=0, verbose_name='Licencias Vencidas')),
+                ('licencias_por_vencer', models.PositiveIntegerField(default=0, verbose_name='Licencias por Vencer')),
+                ('creado_en', models.DateTimeField(auto_now=True)),
+                ('sede', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='estadisticas_diarias', to='sede.sede')),
+            ],
+            options={
+                'verbose_name': 'Estadística Diaria',
+                'verbose_name_plural': 'Estadísticas Diarias',
+                'ordering': ['fecha', 'sede'],
+                'indexes': [models.Index(fields=['fecha'], name='estadistica_diaria_fecha')],
+                'constraints': [models.UniqueConstraint(fields=('sede', 'fecha'), name='estadistica_diaria_sede_fecha')],
+            },
+        ),
+    ]
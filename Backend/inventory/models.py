@@ -1,14 +1,71 @@
+import datetime
+
 from django.db import models
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from empleados.models import Empleado
 from sede.models import Sede
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
+from .changes import SnapshotMixin
+
+
+class CodificadorHistorial(DjangoJSONEncoder):
+    """
+    DjangoJSONEncoder recorta las fechas a milisegundos; el historial las conserva
+    completas para que el texto reconstruido sea el mismo que el del valor original.
+    """
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
 
 
 
 
+# Rangos de diagnostico_salud según la cantidad de mantenimientos finalizados:
+# (clave para ?salud=, etiqueta, máximo incluido en el rango).
+RANGOS_SALUD = [
+    ('optimo', 'Óptimo', 3),
+    ('advertencia', 'Advertencia', 6),
+    ('critico', 'Crítico', None),
+]
 
-class Equipo(models.Model):
+
+def q_rango_salud(clave):
+    """
+    Condición sobre Equipo.mantenimientos_finalizados para el rango de salud `clave`.
+    """
+    minimo = 0
+    for rango, _, maximo in RANGOS_SALUD:
+        if rango == clave:
+            condicion = models.Q(mantenimientos_finalizados__gte=minimo)
+            if maximo is not None:
+                condicion &= models.Q(mantenimientos_finalizados__lte=maximo)
+            return condicion
+        minimo = maximo + 1 if maximo is not None else minimo
+    raise ValueError(f'Rango de salud desconocido: {clave}')
+
+
+class HistorialQuerySet(models.QuerySet):
+    """
+    QuerySet de Equipo y Periferico. update() y bulk_update() no pasan por las señales
+    que escriben el historial; actualizar_con_historial() sí lo deja, en bloque.
+    """
+
+    def actualizar_con_historial(self, usuario=None, **cambios):
+        """
+        Equipo.objects.filter(...).actualizar_con_historial(sede=sede, estado_tecnico='Nuevo').
+        Ver inventory.history.actualizar_con_historial; devuelve los ids modificados.
+        """
+        from .history import actualizar_con_historial
+        return actualizar_con_historial(self, cambios, usuario=usuario)
+
+
+class Equipo(SnapshotMixin, models.Model):
     # --- SECCIÓN: Descripción del Equipo ---
     nombre = models.CharField(max_length=100, verbose_name="Nombre del Equipo")
     marca = models.CharField(max_length=50, verbose_name="Marca")
@@ -62,15 +119,55 @@ class Equipo(models.Model):
     # --- Notas Internas (TI) ---
     notas = models.TextField(blank=True, null=True, verbose_name="Notas Internas (TI)")
 
+    # --- Control (validadores de caché HTTP) ---
+    actualizado_en = models.DateTimeField(auto_now=True, verbose_name="Última Modificación")
+    # Texto indexado para ?q= (ver inventory.search); se recalcula tras cada guardado.
+    busqueda = SearchVectorField(null=True, editable=False)
+    # Mantenimientos finalizados; lo mantienen las señales de Mantenimiento con F().
+    mantenimientos_finalizados = models.PositiveIntegerField(default=0, editable=False, verbose_name="Mantenimientos Finalizados")
+
+    objects = HistorialQuerySet.as_manager()
+
+    # Columnas que se actualizan con UPDATE directos: un save() de una instancia leída
+    # antes no debe sobrescribirlas con un valor viejo.
+    CAMPOS_DERIVADOS = ('busqueda', 'mantenimientos_finalizados')
+
     def __str__(self):
         return f"{self.nombre} - {self.serial}"
 
+    @property
+    def asignacion_actual(self):
+        """
+        AsignacionAbierta del equipo (empleado y fecha), o None si no está asignado.
+        """
+        return getattr(self, 'asignacion_abierta', None)
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.CAMPOS_DERIVADOS and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = "Equipo"
         verbose_name_plural = "Equipos"
-
-
-class Periferico(models.Model):
+        indexes = [
+            GinIndex(fields=['busqueda'], name='equipo_busqueda_gin'),
+            GinIndex(fields=['serial'], opclasses=['gin_trgm_ops'], name='equipo_serial_trgm'),
+            # Listados: solo equipos activos, por sede u ordenados por nombre (id desempata el cursor).
+            models.Index(fields=['sede', 'nombre', 'id'], condition=models.Q(activo=True), name='equipo_activo_sede_nombre'),
+            models.Index(fields=['nombre', 'id'], condition=models.Q(activo=True), name='equipo_activo_nombre'),
+            # Filtro ?status= (mantenimiento vencido / próximo).
+            models.Index(fields=['fecha_proximo_mantenimiento'], condition=models.Q(activo=True), name='equipo_activo_prox_mant'),
+            # Filtro ?salud= y conteo por rango de salud del dashboard.
+            models.Index(fields=['mantenimientos_finalizados', 'sede'], condition=models.Q(activo=True), name='equipo_activo_salud'),
+        ]
+
+
+class Periferico(SnapshotMixin, models.Model):
     TIPO_PERIFERICO_CHOICES = [
         ('Mouse', 'Mouse'),
         ('Teclado', 'Teclado'),
@@ -99,11 +196,21 @@ class Periferico(models.Model):
     sede = models.ForeignKey(Sede, on_delete=models.SET_NULL, null=True, blank=True, related_name='perifericos', verbose_name="Sede")
     fecha_entrega = models.DateTimeField(null=True, blank=True)
     notas = models.TextField(blank=True, null=True)
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    objects = HistorialQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.nombre} ({self.tipo})"
 
-class Licencia(models.Model):
+    @property
+    def asignacion_actual(self):
+        """
+        AsignacionAbierta del periférico (empleado y fecha), o None si no está asignado.
+        """
+        return getattr(self, 'asignacion_abierta', None)
+
+class Licencia(SnapshotMixin, models.Model):
     TIPO_LICENCIA_CHOICES = [
         ('Sistema Operativo', 'Sistema Operativo'),
         ('Office', 'Office'),
@@ -129,10 +236,16 @@ class Licencia(models.Model):
     fecha_vencimiento = models.DateField(null=True, blank=True)
     estado = models.CharField(max_length=50, choices=ESTADO_LICENCIA_CHOICES, default='Activa')
     notas = models.TextField(blank=True, null=True)
+    actualizado_en = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Licencia de {self.tipo_licencia} para {self.equipo_asociado.nombre}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['fecha_vencimiento'], name='licencia_fecha_vencimiento'),
+        ]
+
 class Pasisalvo(models.Model):
     ESTADO_PASISALVO_CHOICES = [
         ('Aprobado', 'Aprobado'),
@@ -165,7 +278,7 @@ class HistorialPeriferico(models.Model):
     periferico_tipo = models.CharField(max_length=50, null=True, blank=True, verbose_name="Tipo de Periférico (Histórico)")
     empleado_asignado = models.ForeignKey(Empleado, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Empleado Asignado")
     equipo_asociado = models.ForeignKey(Equipo, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Equipo Asociado en la Entrega")
-    fecha_asignacion = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de Asignación")
+    fecha_asignacion = models.DateTimeField(default=timezone.now, editable=False, verbose_name="Fecha de Asignación")
     fecha_devolucion = models.DateTimeField(null=True, blank=True, verbose_name="Fecha de Devolución")
     observacion_devolucion = models.TextField(blank=True, null=True, verbose_name="Observación de Devolución")
     es_baja = models.BooleanField(default=False, verbose_name="Fue dado de baja")
@@ -183,6 +296,11 @@ class HistorialPeriferico(models.Model):
         verbose_name = "Historial de Periférico"
         verbose_name_plural = "Historial de Periféricos"
         ordering = ['-fecha_asignacion']
+        indexes = [
+            models.Index(fields=['-fecha_asignacion'], name='hist_periferico_fecha'),
+            # Cierre de la asignación abierta (ver inventory.signals).
+            models.Index(fields=['periferico', 'empleado_asignado'], condition=models.Q(fecha_devolucion__isnull=True), name='hist_periferico_abierta'),
+        ]
 
     def __str__(self):
         return f"Historial de {self.periferico.nombre}"
@@ -198,20 +316,71 @@ class HistorialEquipo(models.Model):
 
     equipo = models.ForeignKey(Equipo, on_delete=models.CASCADE, related_name='historial_cambios')
     usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Usuario que realizó el cambio")
-    fecha_cambio = models.DateTimeField(auto_now_add=True, verbose_name="Fecha del Cambio")
+    fecha_cambio = models.DateTimeField(default=timezone.now, editable=False, verbose_name="Fecha del Cambio")
     campo_modificado = models.CharField(max_length=100, verbose_name="Campo Modificado")
     valor_anterior = models.TextField(null=True, blank=True, verbose_name="Valor Anterior")
     valor_nuevo = models.TextField(null=True, blank=True, verbose_name="Valor Nuevo")
     tipo_accion = models.CharField(max_length=20, choices=TIPO_ACCION_CHOICES, verbose_name="Tipo de Acción")
+    # Formato compacto (settings.HISTORIAL_EQUIPO_COMPACTO): una fila por guardado con
+    # {campo: {"anterior", "nuevo"[, "texto_anterior", "texto_nuevo"]}}; los valores van
+    # tipados (ids para relaciones, con su texto aparte). Vacío en las filas por campo.
+    cambios = models.JSONField(null=True, blank=True, editable=False, encoder=CodificadorHistorial, verbose_name="Cambios")
 
     class Meta:
         verbose_name = "Historial de Equipo"
         verbose_name_plural = "Historial de Equipos"
         ordering = ['-fecha_cambio']
+        indexes = [
+            # Historial de un equipo y auditoría de todos, paginados por cursor (fecha, id).
+            models.Index(fields=['equipo', '-fecha_cambio', '-id'], name='hist_equipo_equipo_fecha_id'),
+            models.Index(fields=['-fecha_cambio', '-id'], name='hist_equipo_fecha_id'),
+        ]
 
     def __str__(self):
         return f"Cambio en {self.equipo.nombre} por {self.usuario.username if self.usuario else 'Sistema'} el {self.fecha_cambio.strftime('%Y-%m-%d %H:%M')}"
 
+    def entradas(self):
+        """
+        Vista por campo del registro: él mismo si es una fila por campo, o una entrada
+        (HistorialEquipo sin guardar, con el mismo id) por cada campo del diff compacto,
+        en el orden de los campos del modelo.
+        """
+        if self.cambios is None:
+            return [self]
+        campos = {field.name: field for field in Equipo._meta.fields}
+        nombres = [nombre for nombre in campos if nombre in self.cambios]
+        nombres += [nombre for nombre in self.cambios if nombre not in campos]
+        entradas = []
+        for nombre in nombres:
+            field = campos.get(nombre)
+            cambio = self.cambios[nombre]
+            entrada = HistorialEquipo(
+                id=self.id,
+                equipo_id=self.equipo_id,
+                usuario_id=self.usuario_id,
+                fecha_cambio=self.fecha_cambio,
+                tipo_accion=self.tipo_accion,
+                campo_modificado=str(field.verbose_name) if field else nombre,
+                valor_anterior=self._texto_cambio(field, cambio, 'anterior'),
+                valor_nuevo=self._texto_cambio(field, cambio, 'nuevo'),
+            )
+            if HistorialEquipo.usuario.is_cached(self):
+                entrada.usuario = self.usuario
+            if HistorialEquipo.equipo.is_cached(self):
+                entrada.equipo = self.equipo
+            entradas.append(entrada)
+        return entradas
+
+    @staticmethod
+    def _texto_cambio(field, cambio, clave):
+        # Mismo texto que las filas por campo: str() del valor, "" si no hay valor anterior.
+        if f'texto_{clave}' in cambio:
+            return cambio[f'texto_{clave}']
+        if clave not in cambio:
+            return ""
+        valor = cambio[clave]
+        return str(field.to_python(valor) if field else valor)
+
 class HistorialMovimientoEquipo(models.Model):
     """
     Modelo para registrar el historial de asignación de equipos, similar al de periféricos.
@@ -221,7 +390,7 @@ class HistorialMovimientoEquipo(models.Model):
     equipo_serial = models.CharField(max_length=100, null=True, blank=True, verbose_name="Serial del Equipo (Histórico)")
     empleado_asignado = models.ForeignKey(Empleado, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Empleado Asignado")
     sede = models.ForeignKey(Sede, on_delete=models.SET_NULL, null=True, blank=True, related_name='historial_movimientos_equipos', verbose_name="Sede")
-    fecha_asignacion = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de Asignación")
+    fecha_asignacion = models.DateTimeField(default=timezone.now, editable=False, verbose_name="Fecha de Asignación")
     fecha_devolucion = models.DateTimeField(null=True, blank=True, verbose_name="Fecha de Devolución")
     observacion_devolucion = models.TextField(blank=True, null=True, verbose_name="Observación")
     es_baja = models.BooleanField(default=False, verbose_name="Fue dado de baja")
@@ -242,6 +411,140 @@ class HistorialMovimientoEquipo(models.Model):
         verbose_name = "Historial de Movimiento de Equipo"
         verbose_name_plural = "Historial de Movimientos de Equipos"
         ordering = ['-fecha_asignacion']
+        indexes = [
+            models.Index(fields=['-fecha_asignacion'], name='hist_movimiento_fecha'),
+            # Cierre de la asignación abierta (ver inventory.signals).
+            models.Index(fields=['equipo', 'empleado_asignado'], condition=models.Q(fecha_devolucion__isnull=True, es_baja=False), name='hist_movimiento_abierto'),
+        ]
+
+    def __str__(self):
+        return f"Movimiento de {self.equipo_nombre} - {self.equipo_serial}"
+
+
+class EventoHistorial(models.Model):
+    """
+    Outbox del historial: cuando settings.HISTORIAL_DIFERIDO está activo, las señales
+    y vistas guardan aquí lo que deben escribir, en la misma transacción del cambio, y
+    el comando procesar_historial lo convierte en filas de historial por lotes.
+    """
+    tipo = models.CharField(max_length=30, verbose_name="Tipo de Historial")
+    datos = models.JSONField(encoder=CodificadorHistorial, verbose_name="Datos")
+    creado_en = models.DateTimeField(default=timezone.now, editable=False, verbose_name="Fecha del Evento")
+
+    class Meta:
+        verbose_name = "Evento de Historial Pendiente"
+        verbose_name_plural = "Eventos de Historial Pendientes"
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.tipo} #{self.pk}"
+
+
+class SnapshotEquipo(models.Model):
+    """
+    Estado completo de un equipo en un momento dado (valores por attname, con ids para
+    las relaciones). Es el punto de partida de la reconstrucción de ?as_of=: desde el
+    snapshot más cercano solo se aplican los cambios del historial entre ambos momentos.
+    Los crea el comando crear_snapshots_equipos.
+    """
+    equipo = models.ForeignKey(Equipo, on_delete=models.CASCADE, related_name='snapshots')
+    # Desde cuándo vale este estado: el último cambio del equipo que incluye.
+    fecha = models.DateTimeField(verbose_name="Vigente Desde")
+    datos = models.JSONField(encoder=CodificadorHistorial, verbose_name="Datos")
+
+    class Meta:
+        verbose_name = "Snapshot de Equipo"
+        verbose_name_plural = "Snapshots de Equipos"
+        ordering = ['equipo', '-fecha']
+        constraints = [
+            models.UniqueConstraint(fields=['equipo', 'fecha'], name='snapshot_equipo_fecha'),
+        ]
+
+    def __str__(self):
+        return f"Snapshot de {self.equipo_id} ({self.fecha:%Y-%m-%d %H:%M})"
+
+
+class AsignacionAbierta(models.Model):
+    """
+    Asignación vigente (sin devolución) de cada equipo y de cada periférico: quién lo
+    tiene y desde cuándo. Acompaña a la fila abierta de HistorialMovimientoEquipo /
+    HistorialPeriferico y se escribe junto con ella. Esas tablas están particionadas y
+    PostgreSQL no admite en ellas un índice único sin la fecha; aquí la unicidad de
+    `equipo` y de `periferico` garantiza una sola asignación abierta por objeto.
+
+    Refleja las filas abiertas del historial, también la de un equipo dado de baja al
+    que se le asigna un empleado; el paz y salvo solo cuenta los equipos activos.
+    """
+    equipo = models.OneToOneField(Equipo, on_delete=models.CASCADE, null=True, blank=True, related_name='asignacion_abierta')
+    periferico = models.OneToOneField(Periferico, on_delete=models.CASCADE, null=True, blank=True, related_name='asignacion_abierta')
+    empleado = models.ForeignKey(Empleado, on_delete=models.CASCADE, related_name='asignaciones_abiertas', verbose_name="Empleado Asignado")
+    fecha_asignacion = models.DateTimeField(default=timezone.now, verbose_name="Fecha de Asignación")
+
+    class Meta:
+        verbose_name = "Asignación Abierta"
+        verbose_name_plural = "Asignaciones Abiertas"
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(equipo__isnull=False, periferico__isnull=True) | models.Q(equipo__isnull=True, periferico__isnull=False),
+                name='asignacion_abierta_un_objeto',
+            ),
+        ]
+        indexes = [
+            # Lo que tiene un empleado (paz y salvo), con un index-only scan.
+            models.Index(fields=['empleado'], include=['equipo', 'periferico', 'fecha_asignacion'], name='asignacion_abierta_empleado'),
+        ]
+
+    def __str__(self):
+        return f"{self.equipo or self.periferico} -> {self.empleado}"
+
+    @classmethod
+    def abrir(cls, empleado_id, fecha_asignacion, **objeto):
+        """
+        Registra la asignación de `objeto` (equipo_id=... o periferico_id=...) y
+        reemplaza la que tuviera abierta.
+        """
+        campo = next(iter(objeto)).removesuffix('_id')
+        cls.objects.bulk_create(
+            [cls(empleado_id=empleado_id, fecha_asignacion=fecha_asignacion, **objeto)],
+            update_conflicts=True, unique_fields=[campo], update_fields=['empleado', 'fecha_asignacion'],
+        )
+
+    @classmethod
+    def cerrar(cls, **objeto):
+        cls.objects.filter(**objeto).delete()
+
+
+class EstadisticaDiaria(models.Model):
+    """
+    Estadísticas de una sede al cierre de un día, para las tendencias del dashboard sin
+    recorrer el historial. Una fila por sede y día; los repartos por estado y tipo van
+    como {valor: cantidad}. Las escribe el comando registrar_estadisticas_diarias.
+    """
+    sede = models.ForeignKey(Sede, on_delete=models.CASCADE, related_name='estadisticas_diarias')
+    fecha = models.DateField(verbose_name="Fecha")
+    total_equipos = models.PositiveIntegerField(default=0, verbose_name="Equipos Activos")
+    equipos_dados_de_baja = models.PositiveIntegerField(default=0, verbose_name="Equipos Dados de Baja")
+    equipos_por_estado = models.JSONField(default=dict, verbose_name="Equipos por Estado")
+    equipos_por_tipo = models.JSONField(default=dict, verbose_name="Equipos por Tipo")
+    mantenimientos_activos = models.PositiveIntegerField(default=0, verbose_name="Mantenimientos Activos")
+    mantenimientos_vencidos = models.PositiveIntegerField(default=0, verbose_name="Mantenimientos Vencidos")
+    mantenimientos_finalizados_tarde = models.PositiveIntegerField(default=0, verbose_name="Mantenimientos Finalizados Tarde")
+    licencias_vencidas = models.PositiveIntegerField(default=0, verbose_name="Licencias Vencidas")
+    licencias_por_vencer = models.PositiveIntegerField(default=0, verbose_name="Licencias por Vencer")
+    creado_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Estadística Diaria"
+        verbose_name_plural = "Estadísticas Diarias"
+        ordering = ['fecha', 'sede']
+        constraints = [
+            # También es el índice de las tendencias de una sede.
+            models.UniqueConstraint(fields=['sede', 'fecha'], name='estadistica_diaria_sede_fecha'),
+        ]
+        indexes = [
+            # Tendencias de todas las sedes.
+            models.Index(fields=['fecha'], name='estadistica_diaria_fecha'),
+        ]
 
     def __str__(self):
-        return f"Movimiento de {self.equipo_nombre} - {self.equipo_serial}"
\ No newline at end of file
+        return f"{self.sede} ({self.fecha})"
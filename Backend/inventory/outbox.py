@@ -0,0 +1,141 @@
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from .models import EventoHistorial
+
+# Tipo de evento -> modelo de historial y su columna de fecha (la del momento del
+# cambio, no la del procesamiento).
+TIPOS_HISTORIAL = {
+    'equipo': ('inventory.HistorialEquipo', 'fecha_cambio'),
+    'movimiento_equipo': ('inventory.HistorialMovimientoEquipo', 'fecha_asignacion'),
+    'periferico': ('inventory.HistorialPeriferico', 'fecha_asignacion'),
+    'mantenimiento': ('mantenimientos.HistorialAccionMantenimiento', 'fecha'),
+}
+
+# Llave del advisory lock de PostgreSQL que asegura un solo procesador a la vez: los
+# eventos de un mismo objeto (cerrar y luego crear) deben aplicarse en orden.
+LLAVE_BLOQUEO_OUTBOX = 0x48495354
+
+
+def historial_diferido():
+    return getattr(settings, 'HISTORIAL_DIFERIDO', False)
+
+
+def _tipo(modelo):
+    for tipo, (etiqueta, campo_fecha) in TIPOS_HISTORIAL.items():
+        if modelo._meta.label == etiqueta:
+            return tipo, campo_fecha
+    raise ValueError(f'{modelo._meta.label} no es un modelo de historial.')
+
+
+def registrar_historial(modelo, crear=(), cerrar=None):
+    """
+    Escribe historial: primero el UPDATE de `cerrar` (filtro, valores), luego las filas de
+    `crear` (dicts por attname). Con HISTORIAL_DIFERIDO se guarda un EventoHistorial en la
+    transacción actual y las filas las escribe después el comando procesar_historial.
+    """
+    tipo, campo_fecha = _tipo(modelo)
+    ahora = timezone.now()
+    datos = {'crear': [{campo_fecha: ahora, **fila} for fila in crear]}
+    if cerrar:
+        filtro, valores = cerrar
+        datos['cerrar'] = {'filtro': filtro, 'valores': valores}
+    if not datos['crear'] and not cerrar:
+        return
+    if historial_diferido():
+        EventoHistorial.objects.create(tipo=tipo, datos=datos, creado_en=ahora)
+    else:
+        aplicar_historial([(modelo, datos)])
+
+
+def _descartar_huerfanas(modelo, filas):
+    """
+    Un evento puede procesarse después de borrado el objeto al que apunta. Se aplica a
+    sus filas lo que habría hecho el on_delete de la llave: CASCADE las descarta y
+    SET_NULL deja la referencia vacía.
+    """
+    for field in modelo._meta.concrete_fields:
+        if not field.is_relation:
+            continue
+        ids = {fila.get(field.attname) for fila in filas} - {None}
+        if not ids:
+            continue
+        existentes = set(
+            field.related_model._base_manager.filter(pk__in=ids).values_list('pk', flat=True)
+        )
+        if ids <= existentes:
+            continue
+        en_cascada = field.remote_field.on_delete is models.CASCADE
+        vigentes = []
+        for fila in filas:
+            if fila.get(field.attname) not in existentes and fila.get(field.attname) is not None:
+                if en_cascada:
+                    continue
+                fila = {**fila, field.attname: None}
+            vigentes.append(fila)
+        filas = vigentes
+    return filas
+
+
+def aplicar_historial(eventos, diferidos=False):
+    """
+    Aplica en orden una secuencia de (modelo, datos). Las filas nuevas de cada modelo se
+    acumulan y se insertan con bulk_create; solo se vuelcan antes de tiempo cuando un
+    UPDATE de cierre del mismo modelo podría depender de ellas.
+    """
+    pendientes = defaultdict(list)
+
+    def volcar(modelo):
+        filas = pendientes.pop(modelo, [])
+        if diferidos:
+            filas = _descartar_huerfanas(modelo, filas)
+        if filas:
+            modelo.objects.bulk_create([modelo(**fila) for fila in filas], batch_size=1000)
+
+    for modelo, datos in eventos:
+        cerrar = datos.get('cerrar')
+        if cerrar:
+            volcar(modelo)
+            modelo.objects.filter(**cerrar['filtro']).update(**cerrar['valores'])
+        pendientes[modelo].extend(datos.get('crear', ()))
+    for modelo in list(pendientes):
+        volcar(modelo)
+
+
+def procesar_eventos(limite=1000):
+    """
+    Convierte en historial hasta `limite` eventos pendientes, en orden de llegada, y los
+    borra en la misma transacción. Si algo falla, los eventos siguen en la tabla y se
+    reintentan en la próxima pasada (entrega al menos una vez). Devuelve cuántos procesó;
+    0 también si otro proceso tiene el bloqueo.
+    """
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_try_advisory_xact_lock(%s)', [LLAVE_BLOQUEO_OUTBOX])
+            if not cursor.fetchone()[0]:
+                return 0
+        eventos = list(EventoHistorial.objects.order_by('id')[:limite])
+        if not eventos:
+            return 0
+        aplicar_historial(
+            [(apps.get_model(TIPOS_HISTORIAL[evento.tipo][0]), evento.datos) for evento in eventos],
+            diferidos=True,
+        )
+        EventoHistorial.objects.filter(id__in=[evento.id for evento in eventos]).delete()
+    return len(eventos)
+
+
+def estado_outbox():
+    """
+    Métrica de retraso: eventos pendientes y antigüedad en segundos del más viejo.
+    """
+    resumen = EventoHistorial.objects.aggregate(pendientes=Count('id'), mas_antiguo=Min('creado_en'))
+    retraso = 0.0
+    if resumen['mas_antiguo'] is not None:
+        retraso = max((timezone.now() - resumen['mas_antiguo']).total_seconds(), 0.0)
+    return {'pendientes': resumen['pendientes'], 'retraso_segundos': retraso}
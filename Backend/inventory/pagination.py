@@ -0,0 +1,185 @@
+import base64
+import json
+from collections import OrderedDict
+from functools import reduce
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginación por cursor (keyset) opcional.
+
+    Solo se activa cuando el cliente envía `cursor` o `page_size`; en caso contrario
+    la vista responde la lista completa como siempre. La posición se calcula sobre el
+    ordenamiento que ya tiene el queryset de la vista más `id` como desempate, así que
+    una página profunda cuesta lo mismo que la primera (WHERE (a, id) > (x, y) LIMIT n).
+    Las columnas del ordenamiento no deben admitir NULL.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 50
+    max_page_size = 500
+    invalid_cursor_message = 'Cursor inválido.'
+    # Con True la primera página se devuelve aunque el cliente no pida paginación.
+    paginate_by_default = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if (
+            not self.paginate_by_default
+            and self.cursor_query_param not in params and self.page_size_query_param not in params
+        ):
+            return None
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+
+        reverse, position = self.decode_cursor(request)
+        ordering = [self._invert(field) for field in self.ordering] if reverse else self.ordering
+
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after(queryset, ordering, position))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        # En sentido inverso, "has_more" indica si existe una página anterior.
+        self.has_previous = has_more if reverse else position is not None
+        self.has_next = bool(results) if reverse else has_more
+        self.first = results[0] if results else None
+        self.last = results[-1] if results else None
+        return results
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_ordering(self, queryset):
+        """
+        Toma el ordenamiento actual del queryset (o el del modelo) y agrega `id`
+        como desempate para que la clave sea única.
+        """
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        ordering = [field for field in ordering if isinstance(field, str)]
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            ordering.append('id')
+        return ordering
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return False, None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            reverse = bool(data['r'])
+            position = data['p']
+            if not isinstance(position, list) or len(position) != len(self.ordering):
+                raise ValueError
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        return reverse, position
+
+    def encode_cursor(self, instance, reverse):
+        position = [self._serialize(self._value(instance, field.lstrip('-'))) for field in self.ordering]
+        data = json.dumps({'r': int(reverse), 'p': position}, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or self.last is None:
+            return None
+        return self.encode_cursor(self.last, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.first is None:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.first, reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    @staticmethod
+    def _invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def _value(instance, path):
+        return reduce(getattr, path.split('__'), instance)
+
+    @staticmethod
+    def _serialize(value):
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return value
+
+    def _after(self, queryset, ordering, position):
+        """
+        Construye la condición lexicográfica "estrictamente después de la posición"
+        respetando la dirección de cada columna.
+        """
+        condition = Q()
+        equal = Q()
+        for field, raw in zip(ordering, position):
+            name = field.lstrip('-')
+            value = self._to_python(queryset, name, raw)
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def _to_python(self, queryset, path, raw):
+        # Anotaciones numéricas (p. ej. la relevancia de la búsqueda).
+        if path in queryset.query.annotations:
+            if isinstance(raw, bool) or not isinstance(raw, (int, float)):
+                raise NotFound(self.invalid_cursor_message)
+            return raw
+        parts = path.split('__')
+        try:
+            opts = queryset.model._meta
+            for part in parts[:-1]:
+                opts = opts.get_field(part).related_model._meta
+            field = opts.pk if parts[-1] == 'pk' else opts.get_field(parts[-1])
+            return field.to_python(raw)
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+
+class RequiredKeysetPagination(KeysetPagination):
+    """
+    KeysetPagination siempre activa, para listados sin un límite natural (por ejemplo,
+    el historial de todos los equipos).
+    """
+    paginate_by_default = True
@@ -0,0 +1,335 @@
+"""
+Particionamiento mensual (PostgreSQL, declarativo por rango) de las tablas de historial.
+
+Las tablas de historial solo crecen y se consultan casi siempre por fecha descendente:
+particionadas por mes, las consultas recientes solo tocan las particiones recientes y
+los meses viejos se archivan y se borran sin DELETE masivos.
+
+- Cada tabla tiene una partición por mes (`<tabla>_pAAAAMM`) y una por defecto
+  (`<tabla>_default`) que recibe lo que no tenga partición, para que un INSERT nunca
+  falle. `asegurar_particiones` crea las de los próximos meses (comando
+  `mantener_particiones` y post_migrate).
+- La llave primaria de la base es (id, fecha), como exige PostgreSQL; para Django la
+  llave sigue siendo `id`, que sale de una secuencia y no se repite.
+
+Este módulo no importa modelos: también lo usan las migraciones.
+"""
+import gzip
+import os
+from datetime import date, datetime, timezone as dt_timezone
+
+from django.db import connection, transaction
+
+# Tabla -> columna de partición.
+TABLAS_PARTICIONADAS = {
+    'inventory_historialequipo': 'fecha_cambio',
+    'inventory_historialmovimientoequipo': 'fecha_asignacion',
+    'inventory_historialperiferico': 'fecha_asignacion',
+    'mantenimientos_historialaccionmantenimiento': 'fecha',
+}
+
+MESES_ADELANTE = 3
+
+# Filas que siguen vigentes aunque sean viejas (asignaciones abiertas): no se archivan.
+FILAS_VIGENTES = {
+    'inventory_historialmovimientoequipo': 'fecha_devolucion IS NULL AND NOT es_baja',
+    'inventory_historialperiferico': 'fecha_devolucion IS NULL',
+}
+
+# Comentario de la tabla con el primer día que conserva tras archivar particiones.
+PREFIJO_CONSERVADO = 'historial conservado desde '
+
+
+def _mes(fecha):
+    return date(fecha.year, fecha.month, 1)
+
+
+def _mes_siguiente(mes):
+    return date(mes.year + (mes.month == 12), mes.month % 12 + 1, 1)
+
+
+def _meses(desde, hasta):
+    """
+    Primeros días de mes de `desde` a `hasta`, inclusive.
+    """
+    mes = _mes(desde)
+    while mes <= hasta:
+        yield mes
+        mes = _mes_siguiente(mes)
+
+
+def nombre_particion(tabla, mes):
+    return f'{tabla}_p{mes:%Y%m}'
+
+
+def esta_particionada(cursor, tabla):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [tabla])
+    fila = cursor.fetchone()
+    return fila is not None and fila[0] == 'p'
+
+
+def particiones(cursor, tabla):
+    """
+    Particiones mensuales de la tabla: lista ordenada de (mes, nombre).
+    """
+    cursor.execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+    """, [tabla])
+    prefijo = f'{tabla}_p'
+    resultado = []
+    for (nombre,) in cursor.fetchall():
+        sufijo = nombre[len(prefijo):]
+        if nombre.startswith(prefijo) and len(sufijo) == 6 and sufijo.isdigit():
+            resultado.append((date(int(sufijo[:4]), int(sufijo[4:]), 1), nombre))
+    return sorted(resultado)
+
+
+def crear_particion(cursor, tabla, mes):
+    """
+    Crea la partición del mes si no existe. Las filas de ese mes que hayan caído en la
+    partición por defecto se trasladan a la nueva antes de adjuntarla.
+    """
+    nombre = nombre_particion(tabla, mes)
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [nombre])
+    if cursor.fetchone()[0]:
+        return False
+    columna = TABLAS_PARTICIONADAS[tabla]
+    qn = connection.ops.quote_name
+    desde, hasta = f'{mes:%Y-%m-%d} 00:00:00+00', f'{_mes_siguiente(mes):%Y-%m-%d} 00:00:00+00'
+    defecto = f'{tabla}_default'
+    cursor.execute(
+        f'SELECT EXISTS (SELECT 1 FROM {qn(defecto)} WHERE {qn(columna)} >= %s AND {qn(columna)} < %s)',
+        [desde, hasta]
+    )
+    if not cursor.fetchone()[0]:
+        cursor.execute(
+            f'CREATE TABLE {qn(nombre)} PARTITION OF {qn(tabla)} FOR VALUES FROM (%s) TO (%s)',
+            [desde, hasta]
+        )
+        return True
+    cursor.execute(f'CREATE TABLE {qn(nombre)} (LIKE {qn(tabla)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    cursor.execute(
+        f'WITH movidas AS (DELETE FROM {qn(defecto)} WHERE {qn(columna)} >= %s AND {qn(columna)} < %s RETURNING *) '
+        f'INSERT INTO {qn(nombre)} SELECT * FROM movidas',
+        [desde, hasta]
+    )
+    cursor.execute(
+        f'ALTER TABLE {qn(tabla)} ATTACH PARTITION {qn(nombre)} FOR VALUES FROM (%s) TO (%s)',
+        [desde, hasta]
+    )
+    return True
+
+
+def asegurar_particiones(meses_adelante=MESES_ADELANTE, hoy=None):
+    """
+    Crea las particiones del mes actual y de los `meses_adelante` siguientes en las
+    tablas ya particionadas. Devuelve los nombres de las creadas.
+    """
+    hoy = hoy or date.today()
+    hasta = _mes(hoy)
+    for _ in range(meses_adelante):
+        hasta = _mes_siguiente(hasta)
+    creadas = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for tabla in TABLAS_PARTICIONADAS:
+            if not esta_particionada(cursor, tabla):
+                continue
+            for mes in _meses(hoy, hasta):
+                if crear_particion(cursor, tabla, mes):
+                    creadas.append(nombre_particion(tabla, mes))
+    return creadas
+
+
+def particionar_tabla(schema_editor, tabla, meses_adelante=MESES_ADELANTE):
+    """
+    Convierte una tabla de historial en una tabla particionada por mes conservando
+    columnas, índices, llaves foráneas y datos. Para uso desde migraciones.
+    """
+    columna = TABLAS_PARTICIONADAS[tabla]
+    qn = schema_editor.quote_name
+    vieja = f'{tabla}_sin_particionar'
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = to_regclass(%s) AND contype = 'f'", [tabla]
+        )
+        llaves = cursor.fetchall()
+        cursor.execute(
+            "SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid "
+            "WHERE x.indrelid = to_regclass(%s) AND NOT x.indisprimary", [tabla]
+        )
+        indices = cursor.fetchall()
+        cursor.execute(f'SELECT min({qn(columna)}), max(id) FROM {qn(tabla)}')
+        primera_fecha, ultimo_id = cursor.fetchone()
+
+        _renombrar(cursor, qn, tabla, vieja)
+        cursor.execute(
+            f'CREATE TABLE {qn(tabla)} (LIKE {qn(vieja)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            f'PARTITION BY RANGE ({qn(columna)})'
+        )
+        cursor.execute(f'ALTER TABLE {qn(tabla)} ALTER COLUMN id DROP DEFAULT')
+        cursor.execute(f'ALTER TABLE {qn(tabla)} ADD CONSTRAINT {qn(tabla + "_pkey")} PRIMARY KEY (id, {qn(columna)})')
+        cursor.execute(f'CREATE TABLE {qn(tabla + "_default")} PARTITION OF {qn(tabla)} DEFAULT')
+        hoy = date.today()
+        hasta = _mes(hoy)
+        for _ in range(meses_adelante):
+            hasta = _mes_siguiente(hasta)
+        for mes in _meses(min(primera_fecha.date(), hoy) if primera_fecha else hoy, hasta):
+            crear_particion(cursor, tabla, mes)
+        cursor.execute(f'INSERT INTO {qn(tabla)} SELECT * FROM {qn(vieja)}')
+        # La secuencia (o identidad) de la tabla vieja se va con ella: `id` usa una nueva.
+        cursor.execute(f'DROP TABLE {qn(vieja)}')
+        _crear_secuencia(cursor, qn, tabla, ultimo_id)
+        for nombre, definicion in llaves:
+            cursor.execute(f'ALTER TABLE {qn(tabla)} ADD CONSTRAINT {qn(nombre)} {definicion}')
+        # Las definiciones nombran la tabla por su nombre original, que ahora es la particionada.
+        for nombre, definicion in indices:
+            cursor.execute(definicion)
+
+
+def desparticionar_tabla(schema_editor, tabla):
+    """
+    Operación inversa de particionar_tabla: vuelve a una tabla simple con `id` como
+    llave primaria.
+    """
+    qn = schema_editor.quote_name
+    vieja = f'{tabla}_particionada'
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = to_regclass(%s) AND contype = 'f'", [tabla]
+        )
+        llaves = cursor.fetchall()
+        cursor.execute(
+            "SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid "
+            "WHERE x.indrelid = to_regclass(%s) AND NOT x.indisprimary", [tabla]
+        )
+        indices = cursor.fetchall()
+        cursor.execute(f'SELECT max(id) FROM {qn(tabla)}')
+        ultimo_id = cursor.fetchone()[0]
+        _renombrar(cursor, qn, tabla, vieja)
+        cursor.execute(f'CREATE TABLE {qn(tabla)} (LIKE {qn(vieja)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        cursor.execute(f'ALTER TABLE {qn(tabla)} ALTER COLUMN id DROP DEFAULT')
+        cursor.execute(f'ALTER TABLE {qn(tabla)} ADD CONSTRAINT {qn(tabla + "_pkey")} PRIMARY KEY (id)')
+        cursor.execute(f'INSERT INTO {qn(tabla)} SELECT * FROM {qn(vieja)}')
+        cursor.execute(f'DROP TABLE {qn(vieja)}')
+        _crear_secuencia(cursor, qn, tabla, ultimo_id)
+        for nombre, definicion in llaves:
+            cursor.execute(f'ALTER TABLE {qn(tabla)} ADD CONSTRAINT {qn(nombre)} {definicion}')
+        for nombre, definicion in indices:
+            cursor.execute(definicion.replace(' ON ONLY ', ' ON '))
+
+
+def _renombrar(cursor, qn, tabla, nuevo_nombre):
+    # La llave primaria también cambia de nombre para que la nueva tabla use el original.
+    cursor.execute("SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'p'", [tabla])
+    llave = cursor.fetchone()[0]
+    cursor.execute(f'ALTER TABLE {qn(tabla)} RENAME TO {qn(nuevo_nombre)}')
+    cursor.execute(f'ALTER TABLE {qn(nuevo_nombre)} RENAME CONSTRAINT {qn(llave)} TO {qn(nuevo_nombre + "_pkey")}')
+
+
+def _crear_secuencia(cursor, qn, tabla, ultimo_id):
+    secuencia = f'{tabla}_id_seq'
+    cursor.execute(f'CREATE SEQUENCE {qn(secuencia)} OWNED BY {qn(tabla)}.id')
+    if ultimo_id:
+        cursor.execute('SELECT setval(%s, %s)', [secuencia, ultimo_id])
+    cursor.execute(f"ALTER TABLE {qn(tabla)} ALTER COLUMN id SET DEFAULT nextval(%s::regclass)", [secuencia])
+
+
+def historial_conservado_desde(tabla):
+    """
+    Primer día cuyo historial sigue en la tabla después de archivar_particiones (lo
+    anterior se exportó y se borró), o None si nunca se archivó nada. Se guarda como
+    comentario de la tabla, así que lo ven todos los procesos sin una tabla aparte.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT obj_description(to_regclass(%s), 'pg_class')", [tabla])
+        fila = cursor.fetchone()
+    comentario = fila[0] if fila else None
+    if not comentario or not comentario.startswith(PREFIJO_CONSERVADO):
+        return None
+    return date.fromisoformat(comentario[len(PREFIJO_CONSERVADO):])
+
+
+def _avanzar_conservado(cursor, tabla, desde):
+    # El inicio del historial conservado solo avanza.
+    actual = historial_conservado_desde(tabla)
+    if actual is None or desde > actual:
+        cursor.execute(f"COMMENT ON TABLE {connection.ops.quote_name(tabla)} IS '{PREFIJO_CONSERVADO}{desde:%Y-%m-%d}'")
+
+
+def _archivar(tabla, origen, ruta, simular, vencidas='TRUE', conservado_desde=None, separar=False):
+    """
+    Exporta a `ruta` las filas de `origen` que cumplen `vencidas` y no son vigentes, y
+    las borra: separando y borrando la partición (`separar`, las vigentes se vuelven a
+    insertar en la tabla) o con DELETE. Devuelve las filas exportadas.
+    """
+    qn = connection.ops.quote_name
+    vigentes = FILAS_VIGENTES.get(tabla, 'FALSE')
+    archivables = f'({vencidas}) AND NOT ({vigentes})'
+    with transaction.atomic(), connection.cursor() as cursor:
+        if simular:
+            cursor.execute(f'SELECT count(*) FROM {qn(origen)} WHERE {archivables}')
+            return cursor.fetchone()[0]
+        # Bloquea escrituras mientras se exporta y se borra.
+        cursor.execute(f'LOCK TABLE {qn(origen)} IN SHARE MODE')
+        cursor.execute(f'SELECT count(*) FROM {qn(origen)} WHERE {archivables}')
+        filas = cursor.fetchone()[0]
+        if filas == 0 and not separar:
+            return 0
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with gzip.open(ruta, 'wt', encoding='utf-8', newline='') as archivo:
+            cursor.copy_expert(
+                f'COPY (SELECT * FROM {qn(origen)} WHERE {archivables}) TO STDOUT WITH (FORMAT csv, HEADER)', archivo
+            )
+        if separar:
+            cursor.execute(f'ALTER TABLE {qn(tabla)} DETACH PARTITION {qn(origen)}')
+            # Sin partición para su mes, las vigentes caen en la partición por defecto.
+            cursor.execute(f'INSERT INTO {qn(tabla)} SELECT * FROM {qn(origen)} WHERE {vigentes}')
+            cursor.execute(f'DROP TABLE {qn(origen)}')
+        else:
+            cursor.execute(f'DELETE FROM {qn(origen)} WHERE {archivables}')
+        _avanzar_conservado(cursor, tabla, conservado_desde)
+    return filas
+
+
+def archivar_particiones(destino, meses_retencion, hoy=None, simular=False):
+    """
+    Exporta a `destino/<partición>.csv.gz` y elimina las particiones mensuales que
+    terminaron antes del inicio del mes de hace `meses_retencion` meses; las filas igual
+    de viejas de la partición por defecto van a `destino/<tabla>_default_<fecha>.csv.gz`
+    y se borran. Cada exportación y su borrado van en una transacción, que también
+    avanza el inicio del historial conservado (historial_conservado_desde).
+
+    Las asignaciones abiertas (FILAS_VIGENTES) no se archivan aunque sean viejas: las
+    señales y actualizar_con_historial las cierran más adelante. Al separar su
+    partición se vuelven a insertar en la tabla, donde caen en la partición por
+    defecto, y se archivan desde ella en una ejecución posterior, ya cerradas.
+    Devuelve una lista de (partición, filas exportadas).
+    """
+    limite = _mes(hoy or date.today())
+    for _ in range(meses_retencion):
+        limite = date(limite.year - (limite.month == 1), (limite.month - 2) % 12 + 1, 1)
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        tablas = [tabla for tabla in TABLAS_PARTICIONADAS if esta_particionada(cursor, tabla)]
+        viejas = [
+            (tabla, mes, nombre)
+            for tabla in tablas
+            for mes, nombre in particiones(cursor, tabla) if _mes_siguiente(mes) <= limite
+        ]
+    archivadas = []
+    for tabla, mes, nombre in viejas:
+        ruta = os.path.join(destino, f'{nombre}.csv.gz')
+        filas = _archivar(tabla, nombre, ruta, simular, conservado_desde=_mes_siguiente(mes), separar=True)
+        archivadas.append((nombre, filas))
+    sufijo = datetime.now(dt_timezone.utc).strftime('%Y%m%d%H%M%S')
+    for tabla in tablas:
+        defecto = f'{tabla}_default'
+        vencidas = f"{qn(TABLAS_PARTICIONADAS[tabla])} < '{limite:%Y-%m-%d} 00:00:00+00'"
+        ruta = os.path.join(destino, f'{defecto}_{sufijo}.csv.gz')
+        filas = _archivar(tabla, defecto, ruta, simular, vencidas=vencidas, conservado_desde=limite)
+        if filas:
+            archivadas.append((defecto, filas))
+    return archivadas
@@ -0,0 +1,68 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.db.models import F, FloatField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Cast, Concat
+
+from empleados.models import Empleado
+
+# Configuración 'simple': sin stemming ni stopwords, porque la mayoría de los términos
+# son códigos (seriales, modelos, procesadores) y nombres propios.
+CONFIGURACION_BUSQUEDA = 'simple'
+
+# Campos de Equipo que forman el vector; si un guardado no toca ninguno, no se recalcula.
+CAMPOS_BUSQUEDA = {'serial', 'nombre', 'marca', 'modelo', 'empleado_asignado', 'procesador', 'sistema_operativo'}
+
+# Texto que se trata como serial: una sola palabra que incluye algún dígito.
+PATRON_SERIAL = re.compile(r'[\w-]*\d[\w-]*')
+
+
+def vector_busqueda_equipo():
+    """
+    Expresión del tsvector de Equipo.busqueda. El nombre del empleado asignado se lee
+    con una subconsulta para poder usarla dentro de un UPDATE.
+    """
+    empleado = Empleado.objects.filter(pk=OuterRef('empleado_asignado_id')).annotate(
+        nombre_completo=Concat('nombre', Value(' '), 'apellido')
+    ).values('nombre_completo')
+    return (
+        SearchVector('serial', 'nombre', weight='A', config=CONFIGURACION_BUSQUEDA)
+        + SearchVector('marca', 'modelo', Subquery(empleado), weight='B', config=CONFIGURACION_BUSQUEDA)
+        + SearchVector('procesador', 'sistema_operativo', weight='C', config=CONFIGURACION_BUSQUEDA)
+    )
+
+
+def actualizar_busqueda(queryset):
+    """
+    Recalcula el tsvector de los equipos del queryset con un solo UPDATE.
+    No pasa por save(): no genera historial ni cambia actualizado_en.
+    """
+    return queryset.update(busqueda=vector_busqueda_equipo())
+
+
+def buscar_equipos(queryset, texto):
+    """
+    Filtra y ordena por relevancia los equipos que coinciden con `texto`.
+
+    Cada palabra se busca como prefijo en el tsvector (índice GIN). Si el texto parece un
+    serial (una sola palabra con dígitos) se busca además por similitud de trigramas
+    (pg_trgm), para encontrar seriales mal escritos; para texto libre no se calcula,
+    porque obligaría a comparar el serial de cada fila que coincide.
+    """
+    terminos = re.findall(r'\w+', texto)
+    if not terminos:
+        return queryset.none()
+    consulta = SearchQuery(
+        ' & '.join(f'{termino}:*' for termino in terminos),
+        search_type='raw', config=CONFIGURACION_BUSQUEDA
+    )
+    texto = texto.strip()
+    condicion = Q(busqueda=consulta)
+    relevancia = SearchRank(F('busqueda'), consulta)
+    if PATRON_SERIAL.fullmatch(texto):
+        condicion |= Q(serial__trigram_similar=texto)
+        relevancia += TrigramSimilarity('serial', texto)
+    # float8: ts_rank devuelve real, que no sobrevive exacto el viaje por el cursor de paginación.
+    return queryset.filter(condicion).annotate(
+        relevancia=Cast(relevancia, FloatField())
+    ).order_by('-relevancia', 'id')
@@ -1,18 +1,77 @@
 from django.contrib.auth.models import User
+from django.db import models
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from sede.models import Sede # Importado desde sede.models
 from mantenimientos.models import Mantenimiento # Importado desde mantenimientos.models
-from .models import Equipo, Periferico, Licencia, Pasisalvo, HistorialEquipo, HistorialMovimientoEquipo
+from .models import Equipo, Periferico, Licencia, Pasisalvo, HistorialEquipo, HistorialMovimientoEquipo, RANGOS_SALUD
 from .models import HistorialPeriferico
 from usuarios.serializers import UserSerializer # Importar UserSerializer
 
 
+class SparseFieldsMixin:
+    """
+    Permite elegir los campos de la respuesta con `?fields=` y `?expand=` (solo lectura).
+
+    - `?fields=id,nombre` devuelve únicamente esos campos.
+    - Los campos de `Meta.expandable_fields` (anidados, calculados o muy pesados) se
+      omiten en cuanto se usa cualquiera de los dos parámetros, salvo que se pidan en
+      `?expand=` o se nombren en `?fields=`.
+    - Sin parámetros la respuesta es la misma de siempre.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.get_requested_fields(self.context.get('request'))
+        if requested is not None:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+    @staticmethod
+    def _parse_param(value):
+        return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+    @classmethod
+    def get_requested_fields(cls, request):
+        """
+        Devuelve el conjunto de campos pedidos, o None si se debe devolver todo.
+        """
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+        params = request.query_params
+        if 'fields' not in params and 'expand' not in params:
+            return None
+
+        available = set(cls.Meta.fields)
+        expandable = set(getattr(cls.Meta, 'expandable_fields', ()))
+        if 'fields' in params:
+            base = cls._parse_param(params.get('fields'))
+        else:
+            base = available - expandable
+        requested = (base | (cls._parse_param(params.get('expand')) & expandable)) & available
+        requested.add('id')
+        return requested
+
+    @classmethod
+    def get_deferred_columns(cls, requested):
+        """
+        Columnas simples del modelo que no hace falta leer para los campos pedidos.
+        Las llaves foráneas nunca se difieren porque las usan los campos derivados.
+        """
+        if requested is None:
+            return []
+        return [
+            field.name for field in cls.Meta.model._meta.concrete_fields
+            if not field.is_relation and not field.primary_key and field.name not in requested
+        ]
+
+
 class SedeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Sede
         fields = '__all__'
 
-class EquipoSerializer(serializers.ModelSerializer):
+class EquipoSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     # Campo para mostrar el nombre de la sede (solo lectura).
     sede_nombre = serializers.CharField(source='sede.nombre', read_only=True)
     # Usar un serializador anidado para mostrar la información completa del usuario (solo lectura).
@@ -41,15 +100,43 @@ class EquipoSerializer(serializers.ModelSerializer):
             'notas'
         ]
         read_only_fields = ['sede_nombre', 'usuario_asignado', 'empleado_asignado_info', 'total_mantenimientos', 'diagnostico_salud']
+        expandable_fields = [
+            'usuario_asignado', 'empleado_asignado_info', 'total_mantenimientos', 'diagnostico_salud',
+            'usuarios_sistema', 'redes_conectadas',
+            'firma_recibido_usuario', 'firma_recibido_jefe', 'firma_compromiso',
+        ]
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, requested=None):
+        """
+        Prepara el queryset con los joins y columnas que usa este serializer,
+        para que listar N equipos cueste un número fijo de consultas. Con `requested`
+        (ver get_requested_fields) solo se hacen los joins y columnas necesarios.
+        """
+        def pedido(*names):
+            return requested is None or any(name in requested for name in names)
+
+        if pedido('usuario_asignado'):
+            queryset = queryset.select_related('empleado_asignado__user__profile__sede')
+        elif pedido('empleado_asignado_info'):
+            queryset = queryset.select_related('empleado_asignado__user')
+        if pedido('sede_nombre'):
+            queryset = queryset.select_related('sede')
+        deferred = cls.get_deferred_columns(requested)
+        if pedido('total_mantenimientos', 'diagnostico_salud'):
+            # Contador mantenido en la tabla (ver mantenimientos.signals).
+            deferred = [name for name in deferred if name != 'mantenimientos_finalizados']
+        # El vector de búsqueda nunca se serializa.
+        return queryset.defer('busqueda', *deferred)
 
     def get_total_mantenimientos(self, obj):
-        return obj.historial_mantenimientos.filter(estado_mantenimiento='Finalizado').count()
+        return obj.mantenimientos_finalizados
 
     def get_diagnostico_salud(self, obj):
-        count = obj.historial_mantenimientos.filter(estado_mantenimiento='Finalizado').count()
-        if count <= 3:
+        count = obj.mantenimientos_finalizados
+        if count <= RANGOS_SALUD[0][2]:
             return {'rango': 'Óptimo', 'color': 'green', 'mensaje': 'Equipo en excelente estado técnico.'}
-        elif count <= 6:
+        elif count <= RANGOS_SALUD[1][2]:
             return {'rango': 'Advertencia', 'color': 'yellow', 'mensaje': 'Uso frecuente detectado. Requiere monitoreo preventivo.'}
         else:
             return {'rango': 'Crítico', 'color': 'red', 'mensaje': '¡Riesgo alto! Alta tasa de fallos. Evaluar reemplazo preventivo.'}
@@ -78,6 +165,34 @@ class EquipoSerializer(serializers.ModelSerializer):
         return representation
 
 
+class EquipoActualizacionMasivaSerializer(serializers.Serializer):
+    """
+    Valida una actualización masiva: los equipos a modificar (`ids` o los filtros
+    de la URL) y un único conjunto de cambios a aplicar a todos.
+    """
+    CAMPOS_EDITABLES = ['sede', 'estado_tecnico', 'estado_disponibilidad', 'empleado_asignado']
+
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    sede = serializers.PrimaryKeyRelatedField(queryset=Sede.objects.all(), required=False, allow_null=True)
+    estado_tecnico = serializers.ChoiceField(choices=Equipo._meta.get_field('estado_tecnico').choices, required=False)
+    estado_disponibilidad = serializers.ChoiceField(choices=Equipo._meta.get_field('estado_disponibilidad').choices, required=False)
+    empleado_asignado = serializers.PrimaryKeyRelatedField(
+        queryset=Equipo._meta.get_field('empleado_asignado').related_model.objects.all(),
+        required=False, allow_null=True
+    )
+
+    def validate(self, data):
+        if not any(campo in data for campo in self.CAMPOS_EDITABLES):
+            raise serializers.ValidationError(
+                f"Debes indicar al menos un cambio: {', '.join(self.CAMPOS_EDITABLES)}."
+            )
+        return data
+
+    @property
+    def cambios(self):
+        return {campo: valor for campo, valor in self.validated_data.items() if campo in self.CAMPOS_EDITABLES}
+
+
 class MantenimientoSerializer(serializers.ModelSerializer):
     equipo_nombre = serializers.CharField(source='equipo.nombre', read_only=True)
     responsable_username = serializers.CharField(source='responsable.username', read_only=True, allow_null=True)
@@ -110,7 +225,7 @@ class MantenimientoSerializer(serializers.ModelSerializer):
         read_only_fields = ['equipo_nombre', 'responsable_username', 'sede_nombre', 'tipo_mantenimiento_nombre']
 
 
-class PerifericoSerializer(serializers.ModelSerializer):
+class PerifericoSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     empleado_asignado_info = serializers.SerializerMethodField()
     equipo_asociado_serial = serializers.CharField(source='equipo_asociado.serial', read_only=True, allow_null=True)
     sede_nombre = serializers.CharField(source='sede.nombre', read_only=True, allow_null=True)
@@ -123,6 +238,23 @@ class PerifericoSerializer(serializers.ModelSerializer):
             'equipo_asociado_serial', 'sede', 'sede_nombre', 'fecha_entrega', 'notas'
         ]
         read_only_fields = ['empleado_asignado_info', 'equipo_asociado_serial', 'sede_nombre']
+        expandable_fields = ['empleado_asignado_info', 'notas']
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, requested=None):
+        """
+        Hace join solo con las relaciones que necesitan los campos pedidos.
+        """
+        relaciones = {
+            'empleado_asignado_info': 'empleado_asignado',
+            'equipo_asociado_serial': 'equipo_asociado',
+            'sede_nombre': 'sede',
+        }
+        related = [rel for campo, rel in relaciones.items() if requested is None or campo in requested]
+        if related:
+            queryset = queryset.select_related(*related)
+        deferred = cls.get_deferred_columns(requested)
+        return queryset.defer(*deferred) if deferred else queryset
 
     def get_empleado_asignado_info(self, obj):
         if obj.empleado_asignado:
@@ -136,7 +268,7 @@ class PerifericoSerializer(serializers.ModelSerializer):
             }
         return None
 
-class LicenciaSerializer(serializers.ModelSerializer):
+class LicenciaSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     equipo_asociado_info = serializers.SerializerMethodField()
 
     class Meta:
@@ -146,6 +278,17 @@ class LicenciaSerializer(serializers.ModelSerializer):
             'tipo_activacion', 'clave', 'fecha_instalacion', 'fecha_vencimiento', 'estado', 'notas'
         ]
         read_only_fields = ['equipo_asociado_info']
+        expandable_fields = ['equipo_asociado_info', 'clave', 'notas']
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, requested=None):
+        """
+        Hace join con el equipo asociado solo si se pidió su información.
+        """
+        if requested is None or 'equipo_asociado_info' in requested:
+            queryset = queryset.select_related('equipo_asociado')
+        deferred = cls.get_deferred_columns(requested)
+        return queryset.defer(*deferred) if deferred else queryset
 
     def get_equipo_asociado_info(self, obj):
         if obj.equipo_asociado:
@@ -192,6 +335,22 @@ class HistorialPerifericoSerializer(serializers.ModelSerializer):
             return f"{obj.empleado_asignado.nombre} {obj.empleado_asignado.apellido}"
         return "Sin asignar"
 
+class HistorialEquipoListSerializer(serializers.ListSerializer):
+    """
+    Presenta siempre una entrada por campo: los registros compactos se expanden con
+    HistorialEquipo.entradas(). Con `campo_modificado` en el contexto solo se muestran
+    las entradas de ese campo.
+    """
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        campo = self.context.get('campo_modificado')
+        return [
+            self.child.to_representation(entrada)
+            for registro in iterable for entrada in registro.entradas()
+            if campo is None or entrada.campo_modificado == campo
+        ]
+
+
 class HistorialEquipoSerializer(serializers.ModelSerializer):
     """
     Serializer para el historial de cambios de un equipo.
@@ -200,6 +359,7 @@ class HistorialEquipoSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = HistorialEquipo
+        list_serializer_class = HistorialEquipoListSerializer
         fields = [
             'id',
             'fecha_cambio',
@@ -210,6 +370,16 @@ class HistorialEquipoSerializer(serializers.ModelSerializer):
             'usuario_nombre',
         ]
 
+class HistorialEquipoAuditoriaSerializer(HistorialEquipoSerializer):
+    """
+    Historial de varios equipos: cada entrada indica además a qué equipo corresponde.
+    """
+    equipo_nombre = serializers.CharField(source='equipo.nombre', read_only=True)
+    equipo_serial = serializers.CharField(source='equipo.serial', read_only=True)
+
+    class Meta(HistorialEquipoSerializer.Meta):
+        fields = HistorialEquipoSerializer.Meta.fields + ['equipo', 'equipo_nombre', 'equipo_serial']
+
 class HistorialMovimientoEquipoSerializer(serializers.ModelSerializer):
     equipo_nombre = serializers.CharField(read_only=True)
     equipo_serial = serializers.CharField(read_only=True)
@@ -1,194 +1,350 @@
 from django.utils import timezone
-from django.db.models.signals import post_save, pre_save, pre_delete
+from django.db.models.signals import post_save, pre_delete, pre_save, post_delete
 from django.dispatch import receiver
-from .models import Equipo, HistorialEquipo, Periferico, HistorialPeriferico, HistorialMovimientoEquipo
+from django.contrib.auth.models import User
+from empleados.models import Empleado
+from mantenimientos.models import EvidenciaMantenimiento, Mantenimiento
+from sede.models import Sede
+from usuarios.models import UserProfile
+from .models import AsignacionAbierta, Equipo, HistorialEquipo, Licencia, Periferico, HistorialPeriferico, HistorialMovimientoEquipo
 from .middleware import get_current_user
+from .history import CAMPOS_EXCLUIDOS_HISTORIAL, filas_historial_equipo
+from .search import CAMPOS_BUSQUEDA, actualizar_busqueda
+from .changes import CapturaCambios
+from .outbox import registrar_historial
+from .dashboard import invalidar_dashboard
+from .conditional import registrar_cambio
 
-@receiver(pre_save, sender=Equipo)
-def cache_old_equipo_instance(sender, instance, **kwargs):
-    """
-    On pre_save, cache the old instance of the Equipo model if it exists.
-    """
-    if instance.pk:
-        try:
-            instance._old_instance = Equipo.objects.get(pk=instance.pk)
-        except Equipo.DoesNotExist:
-            instance._old_instance = None
-    else:
-        instance._old_instance = None
+# Un único cálculo de cambios por save(); cada consumidor recibe el mismo Cambio.
+cambios_equipo = CapturaCambios(Equipo)
+cambios_periferico = CapturaCambios(Periferico)
+cambios_licencia = CapturaCambios(Licencia)
+cambios_perfil = CapturaCambios(UserProfile)
 
 
-@receiver(post_save, sender=Equipo)
-def log_equipo_changes(sender, instance, created, **kwargs):
+def _related_str(field, pk):
+    if pk is None:
+        return ""
+    related = field.related_model._default_manager.filter(pk=pk).first()
+    return str(related) if related else ""
+
+
+@cambios_equipo.consumidor
+def log_equipo_changes(cambio):
     """
-    On post_save, compare the new instance with the cached old one and log changes.
+    Write the field-level history of the save in a single batch (one row per field,
+    or one compact row with HISTORIAL_EQUIPO_COMPACTO).
     """
+    instance = cambio.instance
     user = get_current_user()
+    changes = []
 
-    old_instance = getattr(instance, '_old_instance', None)
-    
-    if created:
+    if cambio.creado:
         # For a created instance, we can log the initial state of all fields.
         for field in instance._meta.fields:
-            if field.name == 'id':
+            if field.name in CAMPOS_EXCLUIDOS_HISTORIAL:
                 continue
             
             new_value = getattr(instance, field.name)
             if new_value not in [None, '']:
-                HistorialEquipo.objects.create(
-                    equipo=instance,
-                    usuario=user,
-                    campo_modificado=field.verbose_name,
-                    valor_anterior="",
-                    valor_nuevo=str(new_value),
-                    tipo_accion='CREADO'
-                )
-    elif old_instance is not None:
-        # For an updated instance, we compare fields and log what changed.
-        for field in instance._meta.fields:
-            old_value = getattr(old_instance, field.name)
-            new_value = getattr(instance, field.name)
-
-            if field.is_relation and old_value != new_value:
-                old_val_str = str(old_value) if old_value else ""
-                new_val_str = str(new_value) if new_value else ""
-
-                if old_val_str != new_val_str:
-                    HistorialEquipo.objects.create(
-                        equipo=instance,
-                        usuario=user,
-                        campo_modificado=field.verbose_name,
-                        valor_anterior=old_val_str,
-                        valor_nuevo=new_val_str,
-                        tipo_accion='ACTUALIZADO'
-                    )
-            elif not field.is_relation and old_value != new_value:
-                HistorialEquipo.objects.create(
-                    equipo=instance,
-                    usuario=user,
-                    campo_modificado=field.verbose_name,
-                    valor_anterior=str(old_value),
-                    valor_nuevo=str(new_value),
-                    tipo_accion='ACTUALIZADO'
-                )
-
-@receiver(pre_save, sender=Periferico)
-def cache_old_periferico_instance(sender, instance, **kwargs):
-    if instance.pk:
-        try:
-            instance._old_instance = Periferico.objects.get(pk=instance.pk)
-        except Periferico.DoesNotExist:
-            instance._old_instance = None
+                changes.append((field, None, getattr(instance, field.attname), "", str(new_value)))
+        tipo_accion = 'CREADO'
     else:
-        instance._old_instance = None
+        # For an updated instance, log only what the diff reports as changed.
+        for name, (old_value, new_value) in cambio.campos.items():
+            if name in CAMPOS_EXCLUIDOS_HISTORIAL:
+                continue
+            field = instance._meta.get_field(name)
+            if field.is_relation:
+                # Only the changed relations are resolved to their text.
+                old_val_str = _related_str(field, old_value)
+                new_val_str = str(getattr(instance, field.name)) if new_value is not None else ""
+                if old_val_str == new_val_str:
+                    continue
+            else:
+                old_val_str, new_val_str = str(old_value), str(new_value)
+            changes.append((field, old_value, new_value, old_val_str, new_val_str))
+        tipo_accion = 'ACTUALIZADO'
+
+    registrar_historial(HistorialEquipo, crear=filas_historial_equipo(
+        instance.pk, getattr(user, 'pk', None), tipo_accion, changes
+    ))
+
+
+def _movimiento_equipo(instance):
+    # Los datos históricos que HistorialMovimientoEquipo.save() copiaría del equipo.
+    return {
+        'equipo_id': instance.pk,
+        'equipo_nombre': instance.nombre,
+        'equipo_serial': instance.serial,
+        'sede_id': instance.sede_id,
+    }
+
+
+def _abrir_movimiento(instance):
+    # La fila abierta del historial y su AsignacionAbierta llevan la misma fecha; la
+    # segunda se escribe siempre en línea (es el estado actual, no historial).
+    ahora = timezone.now()
+    AsignacionAbierta.abrir(instance.empleado_asignado_id, ahora, equipo_id=instance.pk)
+    return {**_movimiento_equipo(instance), 'empleado_asignado_id': instance.empleado_asignado_id, 'fecha_asignacion': ahora}
+
+
+@cambios_equipo.consumidor
+def log_equipo_movement(cambio):
+    instance = cambio.instance
+    
+    # 1. Caso: Nuevo equipo con empleado asignado
+    if cambio.creado:
+        if instance.empleado_asignado_id:
+            registrar_historial(HistorialMovimientoEquipo, crear=[_abrir_movimiento(instance)])
+        return
+
+    # 2. Caso: Actualización de equipo
+    # Cambio de empleado (Asignación o Reasignación)
+    if cambio.cambio('empleado_asignado'):
+        old_empleado_id = cambio.anterior('empleado_asignado')
+        # Si había un empleado anterior, cerrar su registro de movimiento
+        cerrar = None
+        if old_empleado_id:
+            cerrar = (
+                {'equipo_id': instance.pk, 'empleado_asignado_id': old_empleado_id,
+                 'fecha_devolucion__isnull': True, 'es_baja': False},
+                {'fecha_devolucion': timezone.now(), 'observacion_devolucion': "Cambio de asignación o devolución"},
+            )
+        
+        # Si hay un nuevo empleado, crear nuevo registro
+        crear = []
+        if instance.empleado_asignado_id:
+            crear.append(_abrir_movimiento(instance))
+        else:
+            AsignacionAbierta.cerrar(equipo_id=instance.pk)
+        registrar_historial(HistorialMovimientoEquipo, crear=crear, cerrar=cerrar)
+    
+    # Caso: El equipo se da de baja
+    if cambio.cambio('activo') and not instance.activo:
+        # Si estaba asignado, cerrar la asignación
+        cerrar = None
+        if instance.empleado_asignado_id:
+            cerrar = (
+                {'equipo_id': instance.pk, 'empleado_asignado_id': instance.empleado_asignado_id,
+                 'fecha_devolucion__isnull': True, 'es_baja': False},
+                {'fecha_devolucion': timezone.now(), 'observacion_devolucion': "Devolución por baja del equipo"},
+            )
+        
+        AsignacionAbierta.cerrar(equipo_id=instance.pk)
+
+        # Crear registro de baja
+        registrar_historial(HistorialMovimientoEquipo, cerrar=cerrar, crear=[{
+            **_movimiento_equipo(instance),
+            'es_baja': True,
+            'fecha_baja': timezone.now(),
+            'observacion_devolucion': "SISTEMA: EQUIPO DADO DE BAJA",
+        }])
+
+    # Caso: El equipo se reactiva y conserva su empleado: la baja cerró la asignación,
+    # así que se reabre (salvo que ya esté abierta: se asignó mientras estaba de baja)
+    if (cambio.cambio('activo') and instance.activo and instance.empleado_asignado_id
+            and not cambio.cambio('empleado_asignado')
+            and not AsignacionAbierta.objects.filter(equipo_id=instance.pk).exists()):
+        registrar_historial(HistorialMovimientoEquipo, crear=[_abrir_movimiento(instance)])
+
+
+@cambios_equipo.consumidor
+def update_equipo_search_vector(cambio):
+    """
+    Recalcula el vector de búsqueda del equipo si cambió alguno de los campos indexados.
+    """
+    if cambio.creado or cambio.cambio(*CAMPOS_BUSQUEDA):
+        actualizar_busqueda(Equipo.objects.filter(pk=cambio.instance.pk))
+
+
+def _asignacion_periferico(instance):
+    ahora = timezone.now()
+    AsignacionAbierta.abrir(instance.empleado_asignado_id, ahora, periferico_id=instance.pk)
+    return {
+        'periferico_id': instance.pk,
+        'periferico_nombre': instance.nombre,
+        'periferico_tipo': instance.tipo,
+        'empleado_asignado_id': instance.empleado_asignado_id,
+        'equipo_asociado_id': instance.equipo_asociado_id,
+        'fecha_asignacion': ahora,
+    }
 
 
-@receiver(post_save, sender=Periferico)
-def log_periferico_assignment(sender, instance, created, **kwargs):
-    old_instance = getattr(instance, '_old_instance', None)
+@cambios_periferico.consumidor
+def log_periferico_assignment(cambio):
+    instance = cambio.instance
+    old_empleado_id = cambio.anterior('empleado_asignado')
+    new_empleado_id = instance.empleado_asignado_id
     
     # Si se acaba de asignar (antes era None y ahora tiene empleado)
-    if (not old_instance or not old_instance.empleado_asignado) and instance.empleado_asignado:
-        HistorialPeriferico.objects.create(
-            periferico=instance,
-            empleado_asignado=instance.empleado_asignado,
-            equipo_asociado=instance.equipo_asociado
-        )
+    if not old_empleado_id and new_empleado_id:
+        registrar_historial(HistorialPeriferico, crear=[_asignacion_periferico(instance)])
     
     # Si se cambió de un empleado a otro
-    elif old_instance and old_instance.empleado_asignado and instance.empleado_asignado and old_instance.empleado_asignado != instance.empleado_asignado:
+    elif old_empleado_id and new_empleado_id and old_empleado_id != new_empleado_id:
         # Marcar devolución del anterior
-        HistorialPeriferico.objects.filter(
-            periferico=instance, 
-            empleado_asignado=old_instance.empleado_asignado,
-            fecha_devolucion__isnull=True
-        ).update(fecha_devolucion=instance.fecha_entrega or timezone.now(), observacion_devolucion="Reasignación automática")
-        
-        HistorialPeriferico.objects.create(
-            periferico=instance,
-            empleado_asignado=instance.empleado_asignado,
-            equipo_asociado=instance.equipo_asociado
+        registrar_historial(
+            HistorialPeriferico,
+            cerrar=(
+                {'periferico_id': instance.pk, 'empleado_asignado_id': old_empleado_id, 'fecha_devolucion__isnull': True},
+                {'fecha_devolucion': instance.fecha_entrega or timezone.now(), 'observacion_devolucion': "Reasignación automática"},
+            ),
+            crear=[_asignacion_periferico(instance)],
         )
     
     # Si se devolvió (antes tenía empleado y ahora no)
-    elif old_instance and old_instance.empleado_asignado and not instance.empleado_asignado:
-        HistorialPeriferico.objects.filter(
-            periferico=instance, 
-            empleado_asignado=old_instance.empleado_asignado,
-            fecha_devolucion__isnull=True
-        ).update(fecha_devolucion=timezone.now(), observacion_devolucion="Devolución automática")
+    elif old_empleado_id and not new_empleado_id:
+        AsignacionAbierta.cerrar(periferico_id=instance.pk)
+        registrar_historial(HistorialPeriferico, cerrar=(
+            {'periferico_id': instance.pk, 'empleado_asignado_id': old_empleado_id, 'fecha_devolucion__isnull': True},
+            {'fecha_devolucion': timezone.now(), 'observacion_devolucion': "Devolución automática"},
+        ))
 
 @receiver(pre_delete, sender=Periferico)
 def log_periferico_baja(sender, instance, **kwargs):
-    # Si estaba asignado a alguien, marcamos la devolución
-    if instance.empleado_asignado:
+    # Si estaba asignado a alguien, marcamos la devolución. Siempre en línea, aun con
+    # historial diferido: después del DELETE, SET_NULL ya no deja ubicar esas filas.
+    if instance.empleado_asignado_id:
         HistorialPeriferico.objects.filter(
             periferico=instance, 
-            empleado_asignado=instance.empleado_asignado,
+            empleado_asignado_id=instance.empleado_asignado_id,
             fecha_devolucion__isnull=True
         ).update(fecha_devolucion=timezone.now(), observacion_devolucion="Devolución por baja del elemento")
     
     # Creamos un registro final de baja
-    HistorialPeriferico.objects.create(
-        periferico=instance,
-        periferico_nombre=instance.nombre,
-        es_baja=True,
-        fecha_baja=timezone.now(),
-        observacion_devolucion="SISTEMA: PERIFÉRICO DADO DE BAJA"
-    )
-
-@receiver(post_save, sender=Equipo)
-def log_equipo_movement(sender, instance, created, **kwargs):
-    old_instance = getattr(instance, '_old_instance', None)
-    
-    # 1. Caso: Nuevo equipo con empleado asignado
-    if created and instance.empleado_asignado:
-        HistorialMovimientoEquipo.objects.create(
-            equipo=instance,
-            empleado_asignado=instance.empleado_asignado
-        )
-    
-    # 2. Caso: Actualización de equipo
-    elif old_instance:
-        # Cambio de empleado (Asignación o Reasignación)
-        if instance.empleado_asignado != old_instance.empleado_asignado:
-            # Si había un empleado anterior, cerrar su registro de movimiento
-            if old_instance.empleado_asignado:
-                HistorialMovimientoEquipo.objects.filter(
-                    equipo=instance,
-                    empleado_asignado=old_instance.empleado_asignado,
-                    fecha_devolucion__isnull=True,
-                    es_baja=False
-                ).update(
-                    fecha_devolucion=timezone.now(),
-                    observacion_devolucion="Cambio de asignación o devolución"
-                )
-            
-            # Si hay un nuevo empleado, crear nuevo registro
-            if instance.empleado_asignado:
-                HistorialMovimientoEquipo.objects.create(
-                    equipo=instance,
-                    empleado_asignado=instance.empleado_asignado
-                )
-        
-        # Caso: El equipo se da de baja
-        if old_instance.activo and not instance.activo:
-            # Si estaba asignado, cerrar la asignación
-            if instance.empleado_asignado:
-                HistorialMovimientoEquipo.objects.filter(
-                    equipo=instance,
-                    empleado_asignado=instance.empleado_asignado,
-                    fecha_devolucion__isnull=True,
-                    es_baja=False
-                ).update(
-                    fecha_devolucion=timezone.now(),
-                    observacion_devolucion="Devolución por baja del equipo"
-                )
-            
-            # Crear registro de baja
-            HistorialMovimientoEquipo.objects.create(
-                equipo=instance,
-                es_baja=True,
-                fecha_baja=timezone.now(),
-                observacion_devolucion="SISTEMA: EQUIPO DADO DE BAJA"
-            )
\ No newline at end of file
+    registrar_historial(HistorialPeriferico, crear=[{
+        'periferico_id': instance.pk,
+        'periferico_nombre': instance.nombre,
+        'periferico_tipo': instance.tipo,
+        'es_baja': True,
+        'fecha_baja': timezone.now(),
+        'observacion_devolucion': "SISTEMA: PERIFÉRICO DADO DE BAJA",
+    }])
+
+
+@receiver(post_save, sender=Empleado)
+def update_search_vector_on_empleado_change(sender, instance, created, **kwargs):
+    """
+    El nombre del empleado forma parte del vector de sus equipos asignados.
+    """
+    if not created:
+        actualizar_busqueda(Equipo.objects.filter(empleado_asignado=instance))
+
+
+@receiver(pre_delete, sender=Empleado)
+def cache_empleado_equipos(sender, instance, **kwargs):
+    # SET_NULL desasigna los equipos sin pasar por save(): se guardan para recalcularlos.
+    instance._equipos_asignados = list(instance.equipos_asignados.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Empleado)
+def update_search_vector_on_empleado_delete(sender, instance, **kwargs):
+    equipos = getattr(instance, '_equipos_asignados', None)
+    if equipos:
+        actualizar_busqueda(Equipo.objects.filter(pk__in=equipos))
+
+
+# Caché del dashboard (inventory.dashboard): cada cambio invalida las sedes que afecta.
+
+def _sedes_de_equipos(*equipo_ids):
+    ids = [pk for pk in equipo_ids if pk is not None]
+    return list(Equipo.objects.filter(pk__in=ids).values_list('sede_id', flat=True)) if ids else []
+
+
+@cambios_equipo.consumidor
+def invalidate_dashboard_equipo(cambio):
+    # Un cambio de sede altera las estadísticas de ambas (también las de sus periféricos y licencias).
+    invalidar_dashboard([cambio.anterior('sede'), cambio.instance.sede_id])
+
+
+@cambios_periferico.consumidor
+def invalidate_dashboard_periferico(cambio):
+    invalidar_dashboard(_sedes_de_equipos(cambio.anterior('equipo_asociado'), cambio.instance.equipo_asociado_id))
+
+
+@receiver(post_delete, sender=Equipo)
+def invalidate_dashboard_equipo_delete(sender, instance, **kwargs):
+    invalidar_dashboard([instance.sede_id])
+
+
+@receiver(post_delete, sender=Periferico)
+def invalidate_dashboard_periferico_delete(sender, instance, **kwargs):
+    invalidar_dashboard(_sedes_de_equipos(instance.equipo_asociado_id))
+
+
+@cambios_licencia.consumidor
+def invalidate_dashboard_licencia(cambio):
+    invalidar_dashboard(_sedes_de_equipos(cambio.anterior('equipo_asociado'), cambio.instance.equipo_asociado_id))
+
+
+@receiver(post_delete, sender=Licencia)
+def invalidate_dashboard_licencia_delete(sender, instance, **kwargs):
+    invalidar_dashboard(_sedes_de_equipos(instance.equipo_asociado_id))
+
+
+@receiver(post_save, sender=Mantenimiento)
+@receiver(post_delete, sender=Mantenimiento)
+def invalidate_dashboard_mantenimiento(sender, instance, **kwargs):
+    # Un cambio de sede altera las estadísticas y el SLA de ambas.
+    invalidar_dashboard([getattr(instance, '_sede_original', instance.sede_id), instance.sede_id])
+    instance._sede_original = instance.sede_id
+
+
+@receiver(pre_save, sender=User)
+def cache_username(sender, instance, update_fields=None, **kwargs):
+    # El dashboard muestra el username (responsables del SLA, en cualquier sede): se
+    # guarda el anterior para invalidar solo si cambia.
+    if instance.pk is not None and (update_fields is None or 'username' in update_fields):
+        instance._username_anterior = User.objects.filter(pk=instance.pk).values_list('username', flat=True).first()
+
+
+@receiver(post_save, sender=User)
+def invalidate_dashboard_usuario(sender, instance, created, **kwargs):
+    # Los usuarios se cuentan por la sede de su perfil; uno nuevo aún no tiene sede y
+    # solo cuenta en el total. Los demás guardados (el last_login de cada inicio de
+    # sesión, contraseñas, permisos) no alteran el dashboard.
+    if created:
+        invalidar_dashboard([])
+    elif getattr(instance, '_username_anterior', instance.username) != instance.username:
+        invalidar_dashboard()
+    instance.__dict__.pop('_username_anterior', None)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_dashboard_usuario_delete(sender, instance, **kwargs):
+    invalidar_dashboard([])
+
+
+@cambios_perfil.consumidor
+def invalidate_dashboard_perfil(cambio):
+    if cambio.creado or cambio.cambio('sede'):
+        invalidar_dashboard([cambio.anterior('sede'), cambio.instance.sede_id])
+
+
+@receiver(post_delete, sender=UserProfile)
+def invalidate_dashboard_perfil_delete(sender, instance, **kwargs):
+    invalidar_dashboard([instance.sede_id])
+
+
+# GET condicional (inventory.conditional): borrados y cambios en tablas sin
+# actualizado_en cuyos datos van anidados en los listados.
+@receiver(post_delete, sender=Equipo)
+@receiver(post_delete, sender=Periferico)
+@receiver(post_delete, sender=Licencia)
+@receiver(post_delete, sender=Mantenimiento)
+@receiver(post_save, sender=EvidenciaMantenimiento)
+@receiver(post_delete, sender=EvidenciaMantenimiento)
+@receiver(post_save, sender=Sede)
+@receiver(post_delete, sender=Sede)
+@receiver(post_save, sender=Empleado)
+@receiver(post_delete, sender=Empleado)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def mark_conditional_change(sender, update_fields=None, **kwargs):
+    # El last_login de cada inicio de sesión no se serializa en ninguna respuesta.
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    registrar_cambio(sender)
@@ -0,0 +1,274 @@
+from datetime import datetime, time, timezone as dt_timezone
+
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import OuterRef, Q, Subquery
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .history import CAMPOS_EXCLUIDOS_HISTORIAL, EXPRESIONES_STR_RELACION
+from .models import Equipo, HistorialEquipo, SnapshotEquipo
+from .partitions import historial_conservado_desde
+
+# Columnas que el historial no registra: no se pueden reconstruir y se toman del
+# equipo actual (la marca de modificación y las columnas derivadas).
+CAMPOS_NO_RECONSTRUIBLES = CAMPOS_EXCLUIDOS_HISTORIAL - {'id'}
+
+CAMPOS_RECONSTRUIBLES = [
+    field for field in Equipo._meta.concrete_fields if field.name not in CAMPOS_NO_RECONSTRUIBLES
+]
+_POR_NOMBRE = {field.name: field for field in CAMPOS_RECONSTRUIBLES}
+_POR_ETIQUETA = {str(field.verbose_name): field for field in CAMPOS_RECONSTRUIBLES}
+
+TAMANO_LOTE = 1000
+
+
+def parsear_instante(texto, fin_del_dia=True):
+    """
+    Valor de ?as_of= (y de los rangos de fechas del historial): fecha y hora ISO 8601,
+    o solo la fecha, que se toma como el final del día (o el inicio, con
+    fin_del_dia=False). Devuelve None si no es válido.
+    """
+    try:
+        fecha = parse_date(texto)
+        if fecha:
+            instante = datetime.combine(fecha, time.max if fin_del_dia else time.min)
+        else:
+            instante = parse_datetime(texto)
+    except ValueError:
+        return None
+    if instante is None:
+        return None
+    if timezone.is_naive(instante):
+        instante = timezone.make_aware(instante)
+    return instante
+
+
+def historial_disponible_desde():
+    """
+    Instante más antiguo que se puede reconstruir: el inicio del historial de equipos
+    que no se ha archivado, o None si el historial está completo. Antes de él faltan
+    los cambios y cualquier reconstrucción saldría mal, con o sin snapshots.
+    """
+    desde = historial_conservado_desde(HistorialEquipo._meta.db_table)
+    return datetime.combine(desde, time.min, tzinfo=dt_timezone.utc) if desde else None
+
+
+def crear_snapshots(equipo_ids=None):
+    """
+    Guarda un snapshot de cada equipo que cambió desde su último snapshot (o que no
+    tiene ninguno), con un solo INSERT ... SELECT. La fecha del snapshot es la de su
+    último cambio (actualizado_en o la última fila de historial), no la de la
+    ejecución. Devuelve cuántos se crearon.
+
+    Con HISTORIAL_DIFERIDO conviene ejecutarlo después de procesar_historial, para que
+    las filas pendientes ya tengan su fecha en el historial.
+    """
+    qn = connection.ops.quote_name
+    snapshot = qn(SnapshotEquipo._meta.db_table)
+    historial = qn(HistorialEquipo._meta.db_table)
+    vigente = (
+        f"GREATEST(e.{qn('actualizado_en')}, "
+        f"(SELECT MAX(h.{qn('fecha_cambio')}) FROM {historial} h WHERE h.{qn('equipo_id')} = e.{qn('id')}))"
+    )
+    filtro = ''
+    params = [[Equipo._meta.get_field(nombre).column for nombre in CAMPOS_NO_RECONSTRUIBLES]]
+    if equipo_ids is not None:
+        filtro = f"AND e.{qn('id')} = ANY(%s)"
+        params.append(list(equipo_ids))
+    sql = f"""
+        INSERT INTO {snapshot} ({qn('equipo_id')}, {qn('fecha')}, {qn('datos')})
+        SELECT e.{qn('id')}, v.fecha, to_jsonb(e) - %s::text[]
+        FROM {qn(Equipo._meta.db_table)} e
+        CROSS JOIN LATERAL (SELECT {vigente} AS fecha) v
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {snapshot} s WHERE s.{qn('equipo_id')} = e.{qn('id')} AND s.{qn('fecha')} >= v.fecha
+        ) {filtro}
+        ON CONFLICT DO NOTHING
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+class _ResolutorRelaciones:
+    """
+    Convierte en id el texto de una relación, para las filas de historial que solo
+    guardan el texto (formato por campo). Usa el mismo texto que escribe el historial;
+    si dos objetos lo comparten se toma el de menor id.
+    """
+
+    def __init__(self):
+        self.cache = {}
+
+    def __call__(self, field, texto):
+        modelo = field.related_model
+        if (modelo, texto) not in self.cache:
+            qn = connection.ops.quote_name
+            tabla = qn(modelo._meta.db_table)
+            pk = qn(modelo._meta.pk.column)
+            expresion = EXPRESIONES_STR_RELACION.get(modelo, '{t}.' + pk + '::text').format(t=tabla)
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT {tabla}.{pk} FROM {tabla} WHERE {expresion} = %s ORDER BY 1 LIMIT 1', [texto])
+                fila = cursor.fetchone()
+            self.cache[(modelo, texto)] = fila[0] if fila else None
+        return self.cache[(modelo, texto)]
+
+
+def _desde_json(field, valor):
+    if valor is None:
+        return None
+    try:
+        return field.to_python(valor)
+    except ValidationError:
+        return None
+
+
+def _desde_texto(field, texto, resolver):
+    # Inverso de str(): las relaciones vacías se escriben como "" y los nulos como "None".
+    if field.is_relation:
+        return resolver(field, texto) if texto else None
+    if texto is None or texto == 'None':
+        return None
+    try:
+        return field.to_python(texto)
+    except ValidationError:
+        return None
+
+
+def _valores(registro, clave, resolver):
+    """
+    Pares (attname, valor) de un registro de historial: los valores 'anterior' o
+    'nuevo' según `clave`, convertidos al tipo del campo.
+    """
+    if registro.cambios is not None:
+        valores = []
+        for nombre, cambio in registro.cambios.items():
+            field = _POR_NOMBRE.get(nombre)
+            if field is None:
+                continue
+            if clave in cambio:
+                valor = _desde_json(field, cambio[clave])
+            elif f'texto_{clave}' in cambio:
+                valor = _desde_texto(field, cambio[f'texto_{clave}'], resolver)
+            else:
+                valor = None
+            valores.append((field.attname, valor))
+        return valores
+    field = _POR_ETIQUETA.get(registro.campo_modificado)
+    if field is None:
+        return []
+    if clave == 'anterior' and registro.tipo_accion == 'CREADO':
+        return [(field.attname, None)]
+    texto = registro.valor_anterior if clave == 'anterior' else registro.valor_nuevo
+    return [(field.attname, _desde_texto(field, texto, resolver))]
+
+
+def _estado_snapshot(snapshot):
+    return {
+        field.attname: _desde_json(field, snapshot.datos[field.column]) if field.column in snapshot.datos else field.get_default()
+        for field in CAMPOS_RECONSTRUIBLES
+    }
+
+
+def reconstruir_equipos(equipo_ids, instante):
+    """
+    Estado de los equipos en `instante`, como instancias de Equipo sin guardar; los que
+    todavía no existían quedan fuera. Devuelve {id: Equipo}.
+
+    Cada equipo parte de su snapshot más cercano: hacia adelante desde el último snapshot
+    anterior a `instante`, aplicando los valores nuevos del historial posterior; si no
+    hay, hacia atrás desde el siguiente snapshot (o desde el estado actual), deshaciendo
+    los cambios con sus valores anteriores. El costo es una búsqueda por índice más los
+    cambios entre el snapshot y `instante`, no todo el historial del equipo. Las columnas
+    sin historial (CAMPOS_NO_RECONSTRUIBLES) conservan su valor actual.
+    """
+    ids = list(equipo_ids)
+    equipos = {}
+    for inicio in range(0, len(ids), TAMANO_LOTE):
+        equipos.update(_reconstruir_lote(ids[inicio:inicio + TAMANO_LOTE], instante))
+    return equipos
+
+
+def _reconstruir_lote(ids, instante):
+    resolver = _ResolutorRelaciones()
+    actuales = {
+        fila['id']: fila
+        for fila in Equipo.objects.filter(pk__in=ids).values(
+            *[field.attname for field in Equipo._meta.concrete_fields if field.name != 'busqueda']
+        )
+    }
+    anteriores = {
+        snapshot.equipo_id: snapshot
+        for snapshot in SnapshotEquipo.objects.filter(equipo_id__in=actuales, fecha__lte=instante)
+        .order_by('equipo_id', '-fecha').distinct('equipo_id')
+    }
+    hacia_atras = [pk for pk in actuales if pk not in anteriores]
+    siguientes = {
+        snapshot.equipo_id: snapshot
+        for snapshot in SnapshotEquipo.objects.filter(equipo_id__in=hacia_atras, fecha__gt=instante)
+        .order_by('equipo_id', 'fecha').distinct('equipo_id')
+    }
+
+    estados = {pk: _estado_snapshot(snapshot) for pk, snapshot in anteriores.items()}
+    estados.update({pk: _estado_snapshot(snapshot) for pk, snapshot in siguientes.items()})
+    for pk in hacia_atras:
+        if pk not in siguientes:
+            estados[pk] = {field.attname: actuales[pk][field.attname] for field in CAMPOS_RECONSTRUIBLES}
+
+    if anteriores:
+        desde = SnapshotEquipo.objects.filter(
+            equipo_id=OuterRef('equipo_id'), fecha__lte=instante
+        ).order_by('-fecha').values('fecha')[:1]
+        registros = HistorialEquipo.objects.filter(
+            equipo_id__in=anteriores, fecha_cambio__lte=instante, fecha_cambio__gt=Subquery(desde)
+        ).order_by('fecha_cambio', 'id')
+        for registro in registros:
+            estados[registro.equipo_id].update(_valores(registro, 'nuevo', resolver))
+
+    inexistentes = set()
+    if hacia_atras:
+        hasta = SnapshotEquipo.objects.filter(
+            equipo_id=OuterRef('equipo_id'), fecha__gt=instante
+        ).order_by('fecha').values('fecha')[:1]
+        registros = HistorialEquipo.objects.filter(
+            Q(equipo_id__in=[pk for pk in hacia_atras if pk not in siguientes])
+            | Q(equipo_id__in=list(siguientes), fecha_cambio__lte=Subquery(hasta)),
+            fecha_cambio__gt=instante,
+        ).order_by('-fecha_cambio', '-id')
+        for registro in registros:
+            if registro.tipo_accion == 'CREADO':
+                # Creado después de `instante`: todavía no existía.
+                inexistentes.add(registro.equipo_id)
+            elif registro.equipo_id not in inexistentes:
+                estados[registro.equipo_id].update(_valores(registro, 'anterior', resolver))
+
+    equipos = {}
+    for pk, estado in estados.items():
+        if pk in inexistentes:
+            continue
+        sin_historial = {
+            field.attname: actuales[pk][field.attname]
+            for field in Equipo._meta.concrete_fields if field.name in CAMPOS_NO_RECONSTRUIBLES and field.name != 'busqueda'
+        }
+        equipos[pk] = Equipo(**estado, **sin_historial)
+    return equipos
+
+
+def equipos_de_sede(sede_id, instante):
+    """
+    Equipos activos que estaban en la sede en `instante`, ordenados por nombre. Los
+    candidatos son los que están hoy en la sede y los que cambiaron de sede después
+    de `instante`; el resto no pudo estar allí.
+    """
+    sede = Equipo._meta.get_field('sede')
+    movidos = HistorialEquipo.objects.filter(
+        Q(campo_modificado=str(sede.verbose_name)) | Q(cambios__has_key=sede.name),
+        fecha_cambio__gt=instante,
+    ).values_list('equipo_id', flat=True).distinct()
+    candidatos = set(Equipo.objects.filter(sede_id=sede_id).values_list('pk', flat=True)) | set(movidos)
+    equipos = [
+        equipo for equipo in reconstruir_equipos(sorted(candidatos), instante).values()
+        if equipo.sede_id == sede_id and equipo.activo
+    ]
+    return sorted(equipos, key=lambda equipo: (equipo.nombre, equipo.pk))
@@ -1,3 +1,2132 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import multiprocessing
+import os
+import pickle
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+import django
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Count, F, Q
+from django.http import HttpResponse
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from empleados.models import Empleado
+from mantenimientos.models import Mantenimiento
+from mantenimientos.views import MantenimientoViewSet
+from sede.models import Sede
+from .models import (
+    AsignacionAbierta, Equipo, EstadisticaDiaria, EventoHistorial, HistorialEquipo, HistorialMovimientoEquipo, HistorialPeriferico, Licencia,
+    Periferico, RANGOS_SALUD, q_rango_salud,
+)
+from .dashboard import (
+    CLAVE_CALCULO, CLAVE_ESTADISTICAS, _versiones, estadisticas_dashboard, estadisticas_dashboard_cacheadas,
+    analitica_sla, registrar_estadisticas_diarias,
+)
+from .checks import revisar_cache_compartido
+from .history import registrar_creacion_equipos
+from .middleware import (
+    CurrentUserMiddleware, get_current_user, get_request_id, request_context, run_in_process, run_in_thread,
+)
+from .pagination import KeysetPagination
+from .serializers import HistorialEquipoSerializer
+from .partitions import archivar_particiones, asegurar_particiones, historial_conservado_desde, nombre_particion
+from .signals import cambios_equipo
+from .views import (
+    EquipoViewSet, HistorialEquipoListView, HistorialMovimientoEquipoListAPIView, HistorialPerifericoListAPIView,
+)
+
+# Caché en memoria: la mecánica del caché no depende del backend, y así sus lecturas no
+# cuentan en los assertNumQueries (el compartido se prueba en CacheCompartidoTests).
+CACHE_LOCAL = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class EquipoQueryBudgetTests(APITestCase):
+    """
+    El listado y el detalle de equipos deben costar un número fijo de consultas,
+    sin importar cuántos equipos se devuelvan.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sede = Sede.objects.create(nombre='Sede Central')
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        cls.admin.profile.sede = cls.sede
+        cls.admin.profile.save()
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+
+    def crear_equipos(self, cantidad, inicio=0):
+        for i in range(inicio, inicio + cantidad):
+            user = User.objects.create_user(f'colaborador{i}', password='x')
+            user.profile.sede = self.sede
+            user.profile.save()
+            empleado = Empleado.objects.create(
+                nombre=f'Empleado{i}', apellido='Prueba', cedula=f'C{i}', user=user, sede=self.sede
+            )
+            equipo = Equipo.objects.create(
+                nombre=f'Equipo {i:03d}', marca='Dell', modelo='Latitude', serial=f'SN-{i:05d}',
+                sede=self.sede, empleado_asignado=empleado, estado_disponibilidad='Asignado'
+            )
+            Mantenimiento.objects.create(
+                equipo=equipo, sede=self.sede, tipo_mantenimiento='Preventivo',
+                estado_mantenimiento='Finalizado'
+            )
+
+    def contar_consultas(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_listado_con_consultas_constantes(self):
+        self.crear_equipos(2)
+        consultas_pocos, response = self.contar_consultas('/api/equipos/')
+        self.assertEqual(len(response.data), 2)
+
+        self.crear_equipos(8, inicio=2)
+        consultas_muchos, response = self.contar_consultas('/api/equipos/')
+        self.assertEqual(len(response.data), 10)
+
+        self.assertEqual(consultas_pocos, consultas_muchos)
+
+    def test_listado_usa_conteo_anotado(self):
+        self.crear_equipos(3)
+        _, response = self.contar_consultas('/api/equipos/')
+        for item in response.data:
+            self.assertEqual(item['total_mantenimientos'], 1)
+            self.assertEqual(item['diagnostico_salud']['rango'], 'Óptimo')
+            self.assertEqual(item['usuario_asignado']['sede']['id'], self.sede.id)
+            self.assertTrue(item['empleado_asignado_info']['tiene_user'])
+
+    def test_detalle_con_consultas_constantes(self):
+        self.crear_equipos(1)
+        equipo = Equipo.objects.get()
+        consultas_sin_historial, _ = self.contar_consultas(f'/api/equipos/{equipo.pk}/')
+
+        for _ in range(5):
+            Mantenimiento.objects.create(
+                equipo=equipo, sede=self.sede, tipo_mantenimiento='Correctivo',
+                estado_mantenimiento='Finalizado'
+            )
+        consultas_con_historial, response = self.contar_consultas(f'/api/equipos/{equipo.pk}/')
+
+        self.assertEqual(consultas_sin_historial, consultas_con_historial)
+        self.assertEqual(response.data['total_mantenimientos'], 6)
+
+
+class KeysetPaginationTests(APITestCase):
+    """
+    La paginación por cursor es opcional y recorre el ordenamiento de cada vista sin saltos.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sede = Sede.objects.create(nombre='Sede Norte')
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        # Nombres repetidos para forzar el desempate por id.
+        for i in range(7):
+            Equipo.objects.create(
+                nombre=f'Equipo {i % 3}', marca='HP', modelo='ProBook', serial=f'PG-{i:03d}', sede=cls.sede
+            )
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+
+    def test_sin_parametros_conserva_la_lista(self):
+        response = self.client.get('/api/equipos/')
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), 7)
+
+    def test_recorre_todas_las_paginas_en_orden(self):
+        esperado = list(Equipo.objects.order_by('nombre', 'id').values_list('id', flat=True))
+        vistos = []
+        url = '/api/equipos/?page_size=3'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 3)
+            vistos.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(vistos, esperado)
+
+    def test_enlace_anterior_devuelve_la_pagina_previa(self):
+        primera = self.client.get('/api/equipos/?page_size=3')
+        segunda = self.client.get(primera.data['next'])
+        anterior = self.client.get(segunda.data['previous'])
+        self.assertEqual(
+            [item['id'] for item in anterior.data['results']],
+            [item['id'] for item in primera.data['results']],
+        )
+
+    def test_cursor_invalido(self):
+        response = self.client.get('/api/equipos/?cursor=no-es-un-cursor')
+        self.assertEqual(response.status_code, 404)
+
+
+class SparseFieldsTests(APITestCase):
+    """
+    `?fields=` y `?expand=` recortan la respuesta y la consulta SQL.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sede = Sede.objects.create(nombre='Sede Sur')
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        Equipo.objects.create(
+            nombre='Portátil', marca='Lenovo', modelo='T14', serial='SF-001', sede=cls.sede,
+            firma_compromiso='data:image/png;base64,' + 'A' * 5000
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+
+    def test_sin_parametros_devuelve_todo(self):
+        item = self.client.get('/api/equipos/').data[0]
+        self.assertIn('firma_compromiso', item)
+        self.assertIn('diagnostico_salud', item)
+
+    def test_fields_limita_respuesta_y_consulta(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/equipos/?fields=nombre,serial')
+        self.assertEqual(set(response.data[0]), {'id', 'nombre', 'serial'})
+        sql = ctx.captured_queries[-1]['sql']
+        self.assertNotIn('firma_compromiso', sql)
+        self.assertNotIn('mantenimientos_mantenimiento', sql)
+
+    def test_expand_agrega_campos_pesados(self):
+        item = self.client.get('/api/equipos/?expand=diagnostico_salud').data[0]
+        self.assertIn('diagnostico_salud', item)
+        self.assertIn('nombre', item)
+        self.assertNotIn('firma_compromiso', item)
+        self.assertNotIn('usuario_asignado', item)
+
+    def test_fields_en_perifericos_y_licencias(self):
+        response = self.client.get('/api/perifericos/?fields=nombre')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/api/licencias/?expand=equipo_asociado_info')
+        self.assertEqual(response.status_code, 200)
+
+
+class ExportacionEquiposTests(APITestCase):
+    """
+    La exportación respeta el alcance por sede y los filtros del listado.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sede = Sede.objects.create(nombre='Sede Exportación')
+        cls.otra_sede = Sede.objects.create(nombre='Otra Sede')
+        cls.usuario = User.objects.create_user('tecnico', password='x')
+        cls.usuario.profile.sede = cls.sede
+        cls.usuario.profile.save()
+        for i in range(3):
+            Equipo.objects.create(
+                nombre=f'Exportable {i}', marca='Acer', modelo='Aspire', serial=f'EX-{i}',
+                sede=cls.sede, estado_tecnico='Nuevo' if i else 'Reacondicionado'
+            )
+        Equipo.objects.create(nombre='Ajeno', marca='Acer', modelo='Aspire', serial='EX-99', sede=cls.otra_sede)
+
+    def setUp(self):
+        self.client.force_authenticate(self.usuario)
+
+    def leer_csv(self, response):
+        contenido = b''.join(response.streaming_content).decode('utf-8-sig')
+        return list(csv.reader(io.StringIO(contenido)))
+
+    def test_csv_por_sede_del_usuario(self):
+        response = self.client.get('/api/equipos/exportar/')
+        self.assertEqual(response.status_code, 200)
+        filas = self.leer_csv(response)
+        self.assertEqual(filas[0][:2], ['ID', 'Nombre'])
+        self.assertEqual(sorted(fila[4] for fila in filas[1:]), ['EX-0', 'EX-1', 'EX-2'])
+
+    def test_csv_aplica_filtros(self):
+        response = self.client.get('/api/equipos/exportar/?estado_tecnico=Reacondicionado')
+        filas = self.leer_csv(response)
+        self.assertEqual([fila[4] for fila in filas[1:]], ['EX-0'])
+
+    def test_xlsx(self):
+        from openpyxl import load_workbook
+
+        response = self.client.get('/api/equipos/exportar/?formato=xlsx')
+        self.assertEqual(response.status_code, 200)
+        libro = load_workbook(io.BytesIO(b''.join(response.streaming_content)), read_only=True)
+        self.assertEqual(len(list(libro['Equipos'].rows)), 4)
+
+    def test_formato_invalido(self):
+        response = self.client.get('/api/equipos/exportar/?formato=pdf')
+        self.assertEqual(response.status_code, 400)
+
+
+class ImportacionEquiposTests(APITestCase):
+    """
+    La importación valida por lotes, reporta errores por fila y genera el historial en bloque.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sede = Sede.objects.create(nombre='Montevideo')
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        cls.empleado = Empleado.objects.create(nombre='Ana', apellido='Ruiz', cedula='1010')
+        Equipo.objects.create(nombre='Existente', marca='HP', modelo='X', serial='DUP-1', sede=cls.sede)
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+
+    def archivo(self, contenido, nombre='equipos.csv', codificacion='utf-8'):
+        archivo = io.BytesIO(contenido.encode(codificacion))
+        archivo.name = nombre
+        return archivo
+
+    def test_importa_csv_con_historial(self):
+        contenido = (
+            'Nombre del Equipo;Marca;Modelo;Serial;Tipo de Equipo;Sede;Cédula Empleado\n'
+            'Portátil 1;Dell;Latitude;IMP-1;laptop;Montevideo;1010\n'
+            'Portátil 2;Dell;Latitude;IMP-2;Desktop;montevideo;\n'
+        )
+        response = self.client.post(
+            '/api/equipos/importar/', {'archivo': self.archivo(contenido, codificacion='latin-1')}, format='multipart'
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['creados'], 2)
+
+        equipo = Equipo.objects.get(serial='IMP-1')
+        self.assertEqual(equipo.tipo_equipo, 'Laptop')
+        self.assertEqual(equipo.sede, self.sede)
+        self.assertEqual(equipo.empleado_asignado, self.empleado)
+        self.assertEqual(equipo.estado_disponibilidad, 'Asignado')
+        self.assertTrue(HistorialEquipo.objects.filter(equipo=equipo, tipo_accion='CREADO', campo_modificado='Serial').exists())
+        self.assertEqual(HistorialMovimientoEquipo.objects.filter(equipo=equipo, empleado_asignado=self.empleado).count(), 1)
+        self.assertEqual(equipo.asignacion_actual.empleado, self.empleado)
+
+    def test_errores_por_fila_no_importan_nada(self):
+        contenido = (
+            'nombre,marca,modelo,serial,estado_tecnico\n'
+            'A,Dell,X,NEW-1,Nuevo\n'
+            'B,Dell,X,DUP-1,Nuevo\n'
+            'C,Dell,X,NEW-1,Nuevo\n'
+            'D,Dell,X,NEW-2,Roto\n'
+        )
+        response = self.client.post('/api/equipos/importar/', {'archivo': self.archivo(contenido)}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['fila'] for error in response.data['errores']], [3, 4, 5])
+        self.assertIn('estado_tecnico', response.data['errores'][2]['errores'])
+        self.assertFalse(Equipo.objects.filter(serial__startswith='NEW-').exists())
+
+    def test_omitir_errores_importa_las_validas(self):
+        contenido = 'nombre,marca,modelo,serial\nA,Dell,X,OK-1\nB,Dell,X,DUP-1\n'
+        response = self.client.post(
+            '/api/equipos/importar/', {'archivo': self.archivo(contenido), 'omitir_errores': 'true'}, format='multipart'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['creados'], 1)
+        self.assertTrue(Equipo.objects.filter(serial='OK-1').exists())
+
+    def test_comando_simulacion(self):
+        import tempfile
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as archivo:
+            archivo.write('nombre,marca,modelo,serial\nA,Dell,X,CMD-1\n')
+        salida = io.StringIO()
+        call_command('import_equipos', archivo.name, '--dry-run', '--sede', 'Montevideo', stdout=salida)
+        self.assertIn('1 of 1', salida.getvalue())
+        self.assertFalse(Equipo.objects.filter(serial='CMD-1').exists())
+
+
+class ActualizacionMasivaTests(APITestCase):
+    """
+    La actualización masiva aplica un cambio a muchos equipos y deja el mismo historial que las señales.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sede = Sede.objects.create(nombre='Piso 3')
+        cls.destino = Sede.objects.create(nombre='Piso 5')
+        cls.tecnico = User.objects.create_user('tecnico', password='x')
+        cls.tecnico.profile.sede = cls.sede
+        cls.tecnico.profile.save()
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        cls.empleado = Empleado.objects.create(nombre='Luis', apellido='Mora', cedula='2020')
+        cls.equipos = [
+            Equipo.objects.create(nombre=f'Masivo {i}', marca='HP', modelo='X', serial=f'MA-{i}', sede=cls.sede)
+            for i in range(4)
+        ]
+        cls.ajeno = Equipo.objects.create(nombre='Ajeno', marca='HP', modelo='X', serial='MA-99', sede=cls.destino)
+
+    def test_mueve_equipos_de_sede_con_historial(self):
+        self.client.force_authenticate(self.admin)
+        ids = [equipo.pk for equipo in self.equipos]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(
+                '/api/equipos/actualizar-masivo/',
+                {'ids': ids, 'sede': self.destino.pk, 'estado_tecnico': 'Reacondicionado'}, format='json'
+            )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['actualizados'], 4)
+        self.assertEqual(Equipo.objects.filter(pk__in=ids, sede=self.destino, estado_tecnico='Reacondicionado').count(), 4)
+        cambio = HistorialEquipo.objects.get(equipo=self.equipos[0], campo_modificado='Sede', tipo_accion='ACTUALIZADO')
+        self.assertEqual((cambio.valor_anterior, cambio.valor_nuevo), ('Piso 3', 'Piso 5'))
+        self.assertEqual(HistorialEquipo.objects.filter(tipo_accion='ACTUALIZADO').count(), 8)
+        self.assertLess(len(ctx.captured_queries), 15)
+
+    def test_asignacion_masiva_registra_movimientos(self):
+        self.client.force_authenticate(self.tecnico)
+        response = self.client.post(
+            '/api/equipos/actualizar-masivo/?estado_tecnico=Nuevo',
+            {'empleado_asignado': self.empleado.pk}, format='json'
+        )
+        self.assertEqual(response.data['actualizados'], 4)
+        self.assertEqual(HistorialMovimientoEquipo.objects.filter(empleado_asignado=self.empleado).count(), 4)
+        self.assertFalse(Equipo.objects.filter(pk=self.ajeno.pk, empleado_asignado=self.empleado).exists())
+
+    def test_respeta_alcance_de_sede(self):
+        self.client.force_authenticate(self.tecnico)
+        response = self.client.post(
+            '/api/equipos/actualizar-masivo/', {'ids': [self.ajeno.pk], 'estado_tecnico': 'Reacondicionado'}, format='json'
+        )
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(
+            '/api/equipos/actualizar-masivo/', {'ids': [self.equipos[0].pk], 'sede': self.destino.pk}, format='json'
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_requiere_ids_o_filtros(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.post('/api/equipos/actualizar-masivo/', {'estado_tecnico': 'Nuevo'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ConditionalGetTests(APITestCase):
+    """
+    Listado y detalle responden 304 sin serializar cuando nada cambió.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sede = Sede.objects.create(nombre='Sede Caché')
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        cls.equipo = Equipo.objects.create(nombre='Cacheable', marca='HP', modelo='X', serial='CG-1', sede=cls.sede)
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+
+    def test_listado_304_con_etag(self):
+        response = self.client.get('/api/equipos/')
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        response = self.client.get('/api/equipos/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.equipo.nombre = 'Cambiado'
+        self.equipo.save()
+        response = self.client.get('/api/equipos/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_detalle_cambia_con_mantenimientos(self):
+        url = f'/api/equipos/{self.equipo.pk}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Mantenimiento.objects.create(equipo=self.equipo, sede=self.sede, tipo_mantenimiento='Preventivo')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_depende_de_los_parametros(self):
+        completo = self.client.get('/api/equipos/')['ETag']
+        parcial = self.client.get('/api/equipos/?fields=nombre')['ETag']
+        self.assertNotEqual(completo, parcial)
+
+    def _listado_de_hace_una_hora(self):
+        # Todo lo anterior a la petición (y la petición misma) ocurre una hora antes,
+        # para que el Last-Modified no coincida en el segundo con el cambio del test.
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() - timedelta(hours=1)):
+            Equipo.objects.update(actualizado_en=timezone.now())
+            response = self.client.get('/api/equipos/')
+        self.assertEqual(self.client.get('/api/equipos/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        return response
+
+    def test_borrado_invalida_if_modified_since(self):
+        otro = Equipo.objects.create(nombre='Borrable', marca='HP', modelo='X', serial='CG-2', sede=self.sede)
+        response = self._listado_de_hace_una_hora()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            otro.delete()
+        # Sin ETag: solo el Last-Modified refleja el borrado.
+        response = self.client.get('/api/equipos/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([equipo['id'] for equipo in response.data], [self.equipo.pk])
+
+    def test_renombrar_sede_invalida_el_listado(self):
+        response = self._listado_de_hace_una_hora()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sede.nombre = 'Sede Renombrada'
+            self.sede.save()
+        for cabecera, valor in (('HTTP_IF_NONE_MATCH', response['ETag']), ('HTTP_IF_MODIFIED_SINCE', response['Last-Modified'])):
+            respuesta = self.client.get('/api/equipos/', **{cabecera: valor})
+            self.assertEqual(respuesta.status_code, 200)
+            self.assertEqual(respuesta.data[0]['sede_nombre'], 'Sede Renombrada')
+
+    def test_inicio_de_sesion_no_invalida(self):
+        etag = self.client.get('/api/equipos/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin.last_login = timezone.now()
+            self.admin.save(update_fields=['last_login'])
+        self.assertEqual(self.client.get('/api/equipos/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_mantenimiento_304(self):
+        mantenimiento = Mantenimiento.objects.create(equipo=self.equipo, sede=self.sede, tipo_mantenimiento='Preventivo')
+        url = f'/api/mantenimientos/{mantenimiento.pk}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.client.post(f'/api/mantenimientos/{mantenimiento.pk}/iniciar_proceso/')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class BusquedaEquiposTests(APITestCase):
+    """
+    ?q= busca por texto completo (prefijos) y por similitud del serial, ordenado por relevancia.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sede = Sede.objects.create(nombre='Sede Búsqueda')
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        cls.empleado = Empleado.objects.create(nombre='Marta', apellido='Quintero', cedula='3030')
+        cls.lenovo = Equipo.objects.create(
+            nombre='Portátil Gerencia', marca='Lenovo', modelo='ThinkPad T14', serial='PF3XK9ZQ',
+            procesador='Intel Core i7', sede=cls.sede, empleado_asignado=cls.empleado
+        )
+        cls.dell = Equipo.objects.create(
+            nombre='Escritorio Recepción', marca='Dell', modelo='OptiPlex 7090', serial='CN0HJ42T',
+            sistema_operativo='Windows 11', sede=cls.sede
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+
+    def buscar(self, texto, **params):
+        response = self.client.get('/api/equipos/', {'q': texto, **params})
+        self.assertEqual(response.status_code, 200)
+        return [equipo['id'] for equipo in response.data]
+
+    def test_busca_por_prefijos_en_varios_campos(self):
+        self.assertEqual(self.buscar('thinkp'), [self.lenovo.pk])
+        self.assertEqual(self.buscar('windows optiplex'), [self.dell.pk])
+        self.assertEqual(self.buscar('quintero'), [self.lenovo.pk])
+        self.assertEqual(self.buscar('inexistente'), [])
+
+    def test_serial_mal_escrito(self):
+        self.assertEqual(self.buscar('PF3XK9ZO'), [self.lenovo.pk])
+
+    def test_vector_sigue_los_cambios(self):
+        self.dell.empleado_asignado = self.empleado
+        self.dell.save()
+        self.assertEqual(set(self.buscar('marta')), {self.lenovo.pk, self.dell.pk})
+
+        self.empleado.apellido = 'Salcedo'
+        self.empleado.save()
+        self.assertEqual(self.buscar('quintero'), [])
+        self.assertEqual(set(self.buscar('salcedo')), {self.lenovo.pk, self.dell.pk})
+
+        self.empleado.delete()
+        self.assertEqual(self.buscar('salcedo'), [])
+
+    def test_ordena_por_relevancia_y_pagina(self):
+        Equipo.objects.create(nombre='Repuesto CN0HJ42T', marca='HP', modelo='X', serial='OTRO-1', sede=self.sede)
+        ids = self.buscar('CN0HJ42T')
+        self.assertEqual(ids[0], self.dell.pk)
+        self.assertEqual(len(ids), 2)
+
+        response = self.client.get('/api/equipos/', {'q': 'CN0HJ42T', 'page_size': 1})
+        siguiente = self.client.get(response.data['next'])
+        self.assertEqual([e['id'] for e in siguiente.data['results']], ids[1:])
+
+
+class PlanesConsultaTests(APITestCase):
+    """
+    Regresión de planes: con un volumen de datos realista, las consultas principales de
+    las vistas deben resolverse con índices y nunca con un Seq Scan sobre las tablas grandes.
+    """
+    TABLAS_GRANDES = {
+        'inventory_equipo', 'inventory_licencia', 'inventory_historialequipo',
+        'inventory_historialmovimientoequipo', 'inventory_historialperiferico',
+        'mantenimientos_mantenimiento',
+    }
+    SEDES = 25
+    EQUIPOS = 10000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sedes = Sede.objects.bulk_create([Sede(nombre=f'Sede {i}') for i in range(cls.SEDES)])
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        cls.tecnico = User.objects.create_user('tecnico', password='x')
+        cls.tecnico.profile.sede = cls.sedes[3]
+        cls.tecnico.profile.save()
+
+        hoy = timezone.now().date()
+        equipos = Equipo.objects.bulk_create([
+            Equipo(
+                nombre=f'Equipo {i:05d}', marca='Dell', modelo='Latitude', serial=f'PL-{i:05d}',
+                sede=cls.sedes[i % cls.SEDES], activo=i % 50 != 0,
+                fecha_proximo_mantenimiento=hoy + timedelta(days=i % 730 - 365),
+            )
+            for i in range(cls.EQUIPOS)
+        ], batch_size=2000)
+        cls.equipo = equipos[1]
+        Mantenimiento.objects.bulk_create([
+            Mantenimiento(
+                equipo=equipo, sede=equipo.sede, tipo_mantenimiento='Preventivo',
+                estado_mantenimiento='Pendiente' if i % 10 == 0 else 'Finalizado',
+                fecha_inicio=hoy - timedelta(days=i % 1000),
+            )
+            for i, equipo in enumerate(equipos)
+        ], batch_size=2000)
+        Licencia.objects.bulk_create([
+            Licencia(
+                equipo_asociado=equipo, tipo_licencia='Office', tipo_activacion='Volumen',
+                fecha_instalacion=hoy, fecha_vencimiento=hoy + timedelta(days=i % 1500),
+            )
+            for i, equipo in enumerate(equipos)
+        ], batch_size=2000)
+        HistorialEquipo.objects.bulk_create([
+            HistorialEquipo(equipo=equipo, campo_modificado=campo, valor_nuevo='x', tipo_accion='CREADO')
+            for equipo in equipos for campo in ('Nombre', 'Serial', 'Sede')
+        ], batch_size=5000)
+        HistorialMovimientoEquipo.objects.bulk_create([
+            HistorialMovimientoEquipo(equipo=equipo, sede=equipo.sede) for equipo in equipos
+        ], batch_size=5000)
+        HistorialPeriferico.objects.bulk_create([
+            HistorialPeriferico(periferico_nombre=f'Mouse {i}') for i in range(cls.EQUIPOS)
+        ], batch_size=5000)
+        with connection.cursor() as cursor:
+            for tabla in cls.TABLAS_GRANDES:
+                cursor.execute(f'ANALYZE {tabla}')
+
+    def queryset_de_vista(self, clase, url, usuario, action=None, **kwargs):
+        request = Request(APIRequestFactory().get(url))
+        request.user = usuario
+        vista = clase(request=request, args=(), kwargs=kwargs, format_kwarg=None, action=action)
+        return vista.filter_queryset(vista.get_queryset())
+
+    def primera_pagina(self, queryset):
+        # Lo que ejecuta KeysetPagination: el orden de la vista más id, con LIMIT.
+        return queryset.order_by(*KeysetPagination().get_ordering(queryset))[:51]
+
+    def assertSinSeqScan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        pendientes = [plan[0]['Plan']]
+        while pendientes:
+            nodo = pendientes.pop()
+            if nodo['Node Type'] == 'Seq Scan' and nodo['Relation Name'] in self.TABLAS_GRANDES:
+                self.fail(f"Seq Scan sobre {nodo['Relation Name']}:\n{sql}")
+            pendientes.extend(nodo.get('Plans', []))
+
+    def test_equipos(self):
+        self.assertSinSeqScan(self.queryset_de_vista(EquipoViewSet, '/api/equipos/', self.tecnico, 'list'))
+        self.assertSinSeqScan(self.primera_pagina(
+            self.queryset_de_vista(EquipoViewSet, '/api/equipos/', self.admin, 'list')
+        ))
+        self.assertSinSeqScan(self.queryset_de_vista(
+            EquipoViewSet, f'/api/equipos/?sede={self.sedes[5].pk}', self.admin, 'list'
+        ))
+        self.assertSinSeqScan(self.queryset_de_vista(
+            EquipoViewSet, '/api/equipos/?status=upcoming', self.admin, 'list'
+        ))
+
+    def test_mantenimientos(self):
+        self.assertSinSeqScan(self.queryset_de_vista(
+            MantenimientoViewSet, f'/api/mantenimientos/?sede={self.sedes[5].pk}&estado_mantenimiento=Pendiente',
+            self.admin, 'list'
+        ))
+        self.assertSinSeqScan(self.primera_pagina(
+            self.queryset_de_vista(MantenimientoViewSet, '/api/mantenimientos/', self.admin, 'list')
+        ))
+
+    def test_licencias_por_vencer(self):
+        hoy = timezone.now().date()
+        self.assertSinSeqScan(
+            Licencia.objects.filter(fecha_vencimiento__gte=hoy, fecha_vencimiento__lte=hoy + timedelta(days=30))
+        )
+
+    def test_historiales(self):
+        self.assertSinSeqScan(self.queryset_de_vista(
+            HistorialEquipoListView, '/', self.admin, equipo_pk=self.equipo.pk
+        ))
+        self.assertSinSeqScan(self.primera_pagina(
+            self.queryset_de_vista(HistorialMovimientoEquipoListAPIView, '/', self.admin)
+        ))
+        self.assertSinSeqScan(self.primera_pagina(
+            self.queryset_de_vista(HistorialPerifericoListAPIView, '/', self.admin)
+        ))
+
+
+class HistorialEnBloqueTests(APITestCase):
+    """
+    El historial de un guardado se escribe con un solo INSERT y se compara contra el
+    snapshot tomado al leer el equipo, sin releer la fila en pre_save.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sede = Sede.objects.create(nombre='Norte')
+        cls.destino = Sede.objects.create(nombre='Sur')
+
+    def test_crear_equipo_en_tres_consultas(self):
+        with CaptureQueriesContext(connection) as ctx:
+            equipo = Equipo.objects.create(
+                nombre='Auditado', marca='HP', modelo='X', serial='AU-1', ram='16GB', sede=self.sede
+            )
+        # INSERT del equipo, INSERT del historial y UPDATE del vector de búsqueda.
+        self.assertEqual(len(ctx.captured_queries), 3)
+        creados = dict(HistorialEquipo.objects.filter(equipo=equipo).values_list('campo_modificado', 'valor_nuevo'))
+        self.assertEqual(creados['Sede'], 'Norte')
+        self.assertEqual(creados['Memoria RAM'], '16GB')
+
+    def test_actualizar_sin_releer_la_fila(self):
+        equipo = Equipo.objects.create(nombre='Auditado', marca='HP', modelo='X', serial='AU-2', sede=self.sede)
+        equipo = Equipo.objects.get(pk=equipo.pk)
+        equipo.nombre = 'Renombrado'
+        equipo.ram = '32GB'
+        equipo.sede = self.destino
+        with CaptureQueriesContext(connection) as ctx:
+            equipo.save()
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('SELECT') and 'inventory_equipo' in q['sql']])
+        cambios = {
+            h.campo_modificado: (h.valor_anterior, h.valor_nuevo)
+            for h in HistorialEquipo.objects.filter(equipo=equipo, tipo_accion='ACTUALIZADO')
+        }
+        self.assertEqual(cambios, {
+            'Nombre del Equipo': ('Auditado', 'Renombrado'),
+            'Memoria RAM': ('None', '32GB'),
+            'Sede': ('Norte', 'Sur'),
+        })
+
+        # El snapshot se renueva tras guardar: un segundo save() sin cambios no registra nada.
+        equipo.save()
+        self.assertEqual(HistorialEquipo.objects.filter(equipo=equipo, tipo_accion='ACTUALIZADO').count(), 3)
+
+    def test_instancia_no_leida_consulta_la_fila(self):
+        equipo = Equipo.objects.create(nombre='Auditado', marca='HP', modelo='X', serial='AU-3', sede=self.sede)
+        copia = Equipo(pk=equipo.pk, nombre='Otro', marca='HP', modelo='X', serial='AU-3', sede=self.sede)
+        copia.save()
+        cambio = HistorialEquipo.objects.get(equipo=equipo, tipo_accion='ACTUALIZADO')
+        self.assertEqual((cambio.valor_anterior, cambio.valor_nuevo), ('Auditado', 'Otro'))
+
+
+class CapturaCambiosTests(APITestCase):
+    """
+    Un solo cálculo de cambios por save(), compartido por historial, movimientos,
+    búsqueda y asignaciones de periféricos, dentro de la transacción del guardado.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sede = Sede.objects.create(nombre='Norte')
+        cls.ana = Empleado.objects.create(nombre='Ana', apellido='Ruiz', cedula='301', sede=cls.sede)
+        cls.luis = Empleado.objects.create(nombre='Luis', apellido='Mora', cedula='302', sede=cls.sede)
+
+    def test_guardado_sin_campos_indexados_no_recalcula_busqueda(self):
+        equipo = Equipo.objects.get(pk=Equipo.objects.create(
+            nombre='Captura', marca='HP', modelo='X', serial='CC-1', sede=self.sede
+        ).pk)
+        equipo.notas = 'Revisado'
+        with CaptureQueriesContext(connection) as ctx:
+            equipo.save()
+        # UPDATE del equipo e INSERT del historial; sin SELECT previo ni UPDATE del vector.
+        self.assertEqual(len(ctx.captured_queries), 2)
+
+    def test_reasignacion_de_equipo_compara_ids(self):
+        equipo = Equipo.objects.create(
+            nombre='Captura', marca='HP', modelo='X', serial='CC-2', sede=self.sede, empleado_asignado=self.ana
+        )
+        equipo = Equipo.objects.get(pk=equipo.pk)
+        equipo.empleado_asignado_id = self.luis.pk
+        equipo.save()
+        movimientos = HistorialMovimientoEquipo.objects.filter(equipo=equipo).order_by('id')
+        self.assertEqual(
+            [(m.empleado_asignado_id, m.fecha_devolucion is not None) for m in movimientos],
+            [(self.ana.pk, True), (self.luis.pk, False)]
+        )
+        self.assertEqual(
+            HistorialEquipo.objects.get(equipo=equipo, tipo_accion='ACTUALIZADO').valor_nuevo, 'Luis Mora'
+        )
+
+    def test_asignacion_de_periferico_sin_releer_la_fila(self):
+        periferico = Periferico.objects.create(nombre='Mouse', tipo='Mouse', sede=self.sede)
+        periferico = Periferico.objects.get(pk=periferico.pk)
+        periferico.empleado_asignado = self.ana
+        with CaptureQueriesContext(connection) as ctx:
+            periferico.save()
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('SELECT')])
+
+        periferico.empleado_asignado = self.luis
+        periferico.save()
+        periferico.empleado_asignado = None
+        periferico.save()
+        historial = HistorialPeriferico.objects.filter(periferico=periferico).order_by('id')
+        self.assertEqual(
+            [(h.empleado_asignado_id, h.observacion_devolucion) for h in historial],
+            [(self.ana.pk, 'Reasignación automática'), (self.luis.pk, 'Devolución automática')]
+        )
+
+    def test_error_de_un_consumidor_revierte_el_guardado(self):
+        equipo = Equipo.objects.create(nombre='Captura', marca='HP', modelo='X', serial='CC-3', sede=self.sede)
+        equipo = Equipo.objects.get(pk=equipo.pk)
+
+        def fallar(cambio):
+            raise RuntimeError('consumidor')
+
+        cambios_equipo.consumidores.append(fallar)
+        try:
+            equipo.nombre = 'No guardado'
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                equipo.save()
+        finally:
+            cambios_equipo.consumidores.remove(fallar)
+        self.assertEqual(Equipo.objects.get(pk=equipo.pk).nombre, 'Captura')
+        self.assertFalse(HistorialEquipo.objects.filter(equipo=equipo, tipo_accion='ACTUALIZADO').exists())
+
+
+@override_settings(HISTORIAL_DIFERIDO=True)
+class HistorialDiferidoTests(APITestCase):
+    """
+    Con HISTORIAL_DIFERIDO el guardado solo encola eventos; procesar_historial escribe
+    las filas por lotes, en orden y con la fecha del cambio.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sede = Sede.objects.create(nombre='Norte')
+        cls.ana = Empleado.objects.create(nombre='Ana', apellido='Ruiz', cedula='401', sede=cls.sede)
+        cls.luis = Empleado.objects.create(nombre='Luis', apellido='Mora', cedula='402', sede=cls.sede)
+
+    def procesar(self):
+        salida = io.StringIO()
+        call_command('procesar_historial', stdout=salida)
+        return salida.getvalue()
+
+    def test_guardado_encola_y_el_comando_escribe_el_historial(self):
+        equipo = Equipo.objects.create(
+            nombre='Diferido', marca='HP', modelo='X', serial='HD-1', sede=self.sede, empleado_asignado=self.ana
+        )
+        equipo.empleado_asignado = self.luis
+        equipo.save()
+        self.assertFalse(HistorialEquipo.objects.filter(equipo=equipo).exists())
+        self.assertFalse(HistorialMovimientoEquipo.objects.filter(equipo=equipo).exists())
+        fecha_evento = EventoHistorial.objects.order_by('id').first().creado_en
+
+        salida = self.procesar()
+        self.assertIn('4 events processed.', salida)
+        self.assertIn('pending=0', salida)
+        self.assertFalse(EventoHistorial.objects.exists())
+
+        creado = HistorialEquipo.objects.filter(equipo=equipo, tipo_accion='CREADO').first()
+        self.assertEqual(creado.fecha_cambio, fecha_evento)
+        self.assertEqual(
+            HistorialEquipo.objects.get(equipo=equipo, tipo_accion='ACTUALIZADO').valor_nuevo, 'Luis Mora'
+        )
+        movimientos = HistorialMovimientoEquipo.objects.filter(equipo=equipo).order_by('id')
+        self.assertEqual(
+            [(m.empleado_asignado_id, m.fecha_devolucion is not None, m.equipo_serial) for m in movimientos],
+            [(self.ana.pk, True, 'HD-1'), (self.luis.pk, False, 'HD-1')]
+        )
+
+    def test_eventos_de_un_equipo_borrado_no_bloquean_la_cola(self):
+        borrado = Equipo.objects.create(nombre='Borrado', marca='HP', modelo='X', serial='HD-2', empleado_asignado=self.ana)
+        periferico = Periferico.objects.create(nombre='Mouse', tipo='Mouse', empleado_asignado=self.ana, equipo_asociado=borrado)
+        borrado.delete()
+
+        self.procesar()
+        self.assertFalse(EventoHistorial.objects.exists())
+        # HistorialEquipo es CASCADE: se descarta; las demás referencias quedan en NULL.
+        self.assertFalse(HistorialEquipo.objects.filter(equipo_id=borrado.pk).exists())
+        asignacion = HistorialPeriferico.objects.get(periferico=periferico)
+        self.assertIsNone(asignacion.equipo_asociado_id)
+        self.assertTrue(HistorialMovimientoEquipo.objects.filter(equipo_nombre='Borrado', equipo__isnull=True).exists())
+
+    def test_estado_reporta_el_retraso(self):
+        Equipo.objects.create(nombre='Pendiente', marca='HP', modelo='X', serial='HD-3')
+        EventoHistorial.objects.update(creado_en=timezone.now() - timedelta(minutes=2))
+        salida = io.StringIO()
+        call_command('procesar_historial', '--status', stdout=salida)
+        self.assertRegex(salida.getvalue(), r'pending=1 lag_seconds=1[2-9]\d\.\d')
+
+
+class HistorialCompactoTests(APITestCase):
+    """
+    HISTORIAL_EQUIPO_COMPACTO escribe una fila por guardado con el diff en JSONB; la API
+    sigue mostrando una entrada por campo, con los mismos textos que el formato por campo.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        cls.norte = Sede.objects.create(nombre='Norte')
+        cls.sur = Sede.objects.create(nombre='Sur')
+        cls.recibido = timezone.now().replace(microsecond=123456)
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+
+    def guardar_equipo(self, serial):
+        equipo = Equipo.objects.create(
+            nombre='Compacto', marca='HP', modelo='X', serial=serial, sede=self.norte,
+            fecha_ultimo_mantenimiento=date(2026, 1, 15), fecha_recibido_satisfaccion=self.recibido,
+        )
+        equipo.sede = self.sur
+        equipo.ram = '16GB'
+        equipo.activo = False
+        equipo.fecha_ultimo_mantenimiento = date(2026, 3, 1)
+        equipo.save()
+        return equipo
+
+    def historial(self, equipo):
+        response = self.client.get(f'/api/equipos/{equipo.pk}/historial/')
+        self.assertEqual(response.status_code, 200)
+        return sorted(
+            (e['tipo_accion'], e['campo_modificado'], e['valor_anterior'], e['valor_nuevo']) for e in response.data
+        )
+
+    def test_una_fila_por_guardado_con_la_misma_vista_por_campo(self):
+        por_campo = self.guardar_equipo('HC-1')
+        with override_settings(HISTORIAL_EQUIPO_COMPACTO=True):
+            compacto = self.guardar_equipo('HC-2')
+
+        self.assertEqual(HistorialEquipo.objects.filter(equipo=compacto).count(), 2)
+        actualizado = HistorialEquipo.objects.get(equipo=compacto, tipo_accion='ACTUALIZADO')
+        self.assertEqual(actualizado.cambios['sede'], {
+            'anterior': self.norte.pk, 'nuevo': self.sur.pk, 'texto_anterior': 'Norte', 'texto_nuevo': 'Sur',
+        })
+        self.assertEqual(actualizado.cambios['activo'], {'anterior': True, 'nuevo': False})
+        self.assertEqual(actualizado.cambios['fecha_ultimo_mantenimiento']['nuevo'], '2026-03-01')
+
+        esperado = [fila for fila in self.historial(por_campo) if fila[1] != 'Serial']
+        self.assertEqual([fila for fila in self.historial(compacto) if fila[1] != 'Serial'], esperado)
+
+    def test_creacion_en_bloque_compacta(self):
+        por_campo = Equipo.objects.create(nombre='Bloque', marca='HP', modelo='X', serial='HC-3', sede=self.norte)
+        compacto = Equipo.objects.create(nombre='Bloque', marca='HP', modelo='X', serial='HC-4', sede=self.norte)
+        HistorialEquipo.objects.all().delete()
+        registrar_creacion_equipos([por_campo.pk])
+        with override_settings(HISTORIAL_EQUIPO_COMPACTO=True):
+            registrar_creacion_equipos([compacto.pk])
+
+        self.assertEqual(HistorialEquipo.objects.filter(equipo=compacto).count(), 1)
+        esperado = [fila for fila in self.historial(por_campo) if fila[1] != 'Serial']
+        self.assertEqual([fila for fila in self.historial(compacto) if fila[1] != 'Serial'], esperado)
+
+    def test_comando_compacta_las_filas_existentes(self):
+        equipo = self.guardar_equipo('HC-5')
+        antes = self.historial(equipo)
+        filas = HistorialEquipo.objects.filter(equipo=equipo).count()
+
+        salida = io.StringIO()
+        call_command('compactar_historial_equipos', stdout=salida)
+        self.assertIn(f'{filas} rows compacted into 2.', salida.getvalue())
+        self.assertFalse(HistorialEquipo.objects.filter(equipo=equipo, cambios__isnull=True).exists())
+        self.assertEqual(self.historial(equipo), antes)
+
+
+class ParticionesHistorialTests(APITestCase):
+    """
+    Las tablas de historial están particionadas por mes; las particiones nuevas absorben
+    lo que había caído en la de defecto y las viejas se exportan y se borran.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.equipo = Equipo.objects.create(nombre='Particionado', marca='HP', modelo='X', serial='PH-1')
+
+    def particion_de(self, registro):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT tableoid::regclass::text FROM {HistorialEquipo._meta.db_table} WHERE id = %s', [registro.pk]
+            )
+            return cursor.fetchone()[0]
+
+    def test_historial_nuevo_en_la_particion_del_mes(self):
+        registro = HistorialEquipo.objects.filter(equipo=self.equipo).first()
+        self.assertEqual(
+            self.particion_de(registro), nombre_particion(HistorialEquipo._meta.db_table, registro.fecha_cambio)
+        )
+
+    def test_particion_nueva_absorbe_filas_de_la_particion_por_defecto(self):
+        futuro = HistorialEquipo.objects.create(
+            equipo=self.equipo, campo_modificado='Notas', tipo_accion='ACTUALIZADO',
+            fecha_cambio=datetime(2031, 6, 10, tzinfo=dt_timezone.utc),
+        )
+        self.assertEqual(self.particion_de(futuro), 'inventory_historialequipo_default')
+
+        creadas = asegurar_particiones(meses_adelante=1, hoy=date(2031, 6, 1))
+        self.assertIn('inventory_historialequipo_p203106', creadas)
+        self.assertIn('mantenimientos_historialaccionmantenimiento_p203107', creadas)
+        self.assertEqual(self.particion_de(futuro), 'inventory_historialequipo_p203106')
+        self.assertEqual(asegurar_particiones(meses_adelante=1, hoy=date(2031, 6, 1)), [])
+
+    def test_archivar_exporta_y_borra_las_particiones_vencidas(self):
+        viejo = HistorialEquipo.objects.create(
+            equipo=self.equipo, campo_modificado='Notas', valor_nuevo='archivado', tipo_accion='ACTUALIZADO',
+            fecha_cambio=datetime(2020, 3, 5, tzinfo=dt_timezone.utc),
+        )
+        asegurar_particiones(meses_adelante=0, hoy=date(2020, 3, 1))
+
+        with tempfile.TemporaryDirectory() as destino:
+            salida = io.StringIO()
+            call_command('archivar_historial', '--retention-months', '24', '--output-dir', destino, stdout=salida)
+            self.assertIn('inventory_historialequipo_p202003: 1 rows', salida.getvalue())
+            with gzip.open(os.path.join(destino, 'inventory_historialequipo_p202003.csv.gz'), 'rt') as archivo:
+                filas = list(csv.DictReader(archivo))
+        self.assertEqual([(int(f['id']), f['valor_nuevo']) for f in filas], [(viejo.pk, 'archivado')])
+        self.assertFalse(HistorialEquipo.objects.filter(pk=viejo.pk).exists())
+        self.assertEqual(historial_conservado_desde(HistorialEquipo._meta.db_table), date(2020, 4, 1))
+        # Las particiones del mes actual se conservan.
+        self.assertTrue(HistorialEquipo.objects.filter(equipo=self.equipo, tipo_accion='CREADO').exists())
+
+    def test_archivar_conserva_las_asignaciones_abiertas(self):
+        empleado = Empleado.objects.create(nombre='Ana', apellido='Ruiz', cedula='8080')
+        asegurar_particiones(meses_adelante=0, hoy=date(2020, 3, 1))
+        equipos = [
+            Equipo.objects.create(nombre='Asignado', marca='HP', modelo='X', serial=f'PH-A{i}', empleado_asignado=empleado)
+            for i in range(2)
+        ]
+        movimientos = HistorialMovimientoEquipo.objects.filter(equipo__in=equipos)
+        movimientos.update(fecha_asignacion=datetime(2020, 3, 5, tzinfo=dt_timezone.utc))
+        equipos[1].empleado_asignado = None
+        equipos[1].save()
+        abierto, cerrado = [movimientos.get(equipo=equipo).pk for equipo in equipos]
+        # Comprueba ya las llaves foráneas diferidas: con eventos pendientes no se puede
+        # borrar la partición (fuera de los tests, esto ocurrió en otra transacción).
+        with connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+        with tempfile.TemporaryDirectory() as destino:
+            archivar_particiones(destino, 24)
+            with gzip.open(os.path.join(destino, 'inventory_historialmovimientoequipo_p202003.csv.gz'), 'rt') as archivo:
+                self.assertEqual([int(f['id']) for f in csv.DictReader(archivo)], [cerrado])
+        self.assertFalse(HistorialMovimientoEquipo.objects.filter(pk=cerrado).exists())
+        # La abierta sigue en la tabla (partición por defecto) y se cierra como siempre.
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT tableoid::regclass::text FROM {HistorialMovimientoEquipo._meta.db_table} WHERE id = %s', [abierto])
+            self.assertEqual(cursor.fetchone()[0], 'inventory_historialmovimientoequipo_default')
+        equipos[0].empleado_asignado = None
+        equipos[0].save()
+        self.assertIsNotNone(HistorialMovimientoEquipo.objects.get(pk=abierto).fecha_devolucion)
+
+        # Ya cerrada, la siguiente ejecución la archiva desde la partición por defecto.
+        with tempfile.TemporaryDirectory() as destino:
+            archivadas = dict(archivar_particiones(destino, 24))
+            self.assertEqual(archivadas['inventory_historialmovimientoequipo_default'], 1)
+            [ruta] = [nombre for nombre in os.listdir(destino) if nombre.startswith('inventory_historialmovimientoequipo_default_')]
+            with gzip.open(os.path.join(destino, ruta), 'rt') as archivo:
+                self.assertEqual([int(f['id']) for f in csv.DictReader(archivo)], [abierto])
+        self.assertFalse(HistorialMovimientoEquipo.objects.filter(pk=abierto).exists())
+
+
+def _usuario_y_solicitud():
+    return getattr(get_current_user(), 'username', None), get_request_id()
+
+
+class ContextoSolicitudTests(APITestCase):
+    """
+    CurrentUserMiddleware guarda usuario e id de solicitud en un ContextVar: llegan a las
+    señales, a los hilos y procesos lanzados con run_in_thread/run_in_process y a
+    middleware async.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        cls.equipo = Equipo.objects.create(nombre='Contexto', marca='HP', modelo='X', serial='CS-1')
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+
+    def test_historial_registra_al_usuario_autenticado_por_drf(self):
+        response = self.client.patch(
+            f'/api/equipos/{self.equipo.pk}/', {'notas': 'Con usuario'}, format='json', HTTP_X_REQUEST_ID='req-123'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Request-ID'], 'req-123')
+        self.assertRegex(response['Server-Timing'], r'total;dur=\d+\.\d')
+        cambio = HistorialEquipo.objects.get(equipo=self.equipo, tipo_accion='ACTUALIZADO')
+        self.assertEqual(cambio.usuario, self.admin)
+        self.assertIsNone(get_current_user())
+
+    def test_id_de_solicitud_invalido_se_reemplaza(self):
+        response = self.client.get(f'/api/equipos/{self.equipo.pk}/', HTTP_X_REQUEST_ID='no válido; x')
+        self.assertRegex(response['X-Request-ID'], r'^[0-9a-f]{32}$')
+
+    def test_el_contexto_llega_a_hilos_y_procesos(self):
+        with request_context(user=self.admin, request_id='lote-1'):
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                self.assertEqual(executor.submit(_usuario_y_solicitud).result(), (None, None))
+                self.assertEqual(run_in_thread(executor, _usuario_y_solicitud).result(), ('admin', 'lote-1'))
+
+            enviados = []
+
+            class EjecutorDiferido:
+                def submit(self, fn, *args):
+                    enviados.append((fn, pickle.loads(pickle.dumps(args))))
+
+            run_in_process(EjecutorDiferido(), _usuario_y_solicitud)
+        self.assertIsNone(get_request_id())
+        # Fuera del contexto original, como en el proceso hijo: se restaura desde los datos enviados.
+        fn, args = enviados[0]
+        self.assertEqual(fn(*args), ('admin', 'lote-1'))
+
+    def test_middleware_async(self):
+        vistos = []
+
+        async def vista(request):
+            await asyncio.sleep(0)
+            vistos.append((get_current_user(), get_request_id()))
+            return HttpResponse('ok')
+
+        middleware = CurrentUserMiddleware(vista)
+        request = RequestFactory().get('/', HTTP_X_REQUEST_ID='async-1')
+        request.user = self.admin
+        response = asyncio.run(middleware(request))
+        self.assertEqual(vistos, [(self.admin, 'async-1')])
+        self.assertEqual(response['X-Request-ID'], 'async-1')
+        self.assertIsNone(get_current_user())
+
+
+class EquipoAsOfTests(APITestCase):
+    """
+    ?as_of= reconstruye un equipo desde el snapshot más cercano y su historial, con
+    filas por campo o compactas, y /api/equipos/historico/ lo hace para toda una sede.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        cls.norte = Sede.objects.create(nombre='Norte')
+        cls.sur = Sede.objects.create(nombre='Sur')
+        cls.ana = Empleado.objects.create(nombre='Ana', apellido='Ruiz', cedula='3030')
+        cls.tecnico = User.objects.create_user('tecnico', password='x')
+        cls.tecnico.profile.sede = cls.sur
+        cls.tecnico.profile.save()
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+
+    def linea_de_tiempo(self, serial):
+        """
+        Crea, asigna y mueve un equipo; devuelve el equipo y un instante antes de la
+        creación y después de cada guardado.
+        """
+        instantes = [timezone.now()]
+        equipo = Equipo.objects.create(nombre='Viejo', marca='HP', modelo='X', serial=serial, sede=self.norte)
+        instantes.append(timezone.now())
+        equipo.empleado_asignado = self.ana
+        equipo.fecha_ultimo_mantenimiento = date(2026, 2, 1)
+        equipo.save()
+        instantes.append(timezone.now())
+        equipo.nombre = 'Nuevo'
+        equipo.sede = self.sur
+        equipo.empleado_asignado = None
+        equipo.save()
+        instantes.append(timezone.now())
+        return equipo, instantes
+
+    def como_estaba(self, equipo, instante):
+        return self.client.get(f'/api/equipos/{equipo.pk}/', {'as_of': instante.isoformat()})
+
+    def comprobar(self, equipo, instantes):
+        self.assertEqual(self.como_estaba(equipo, instantes[0]).status_code, 404)
+        esperado = [
+            ('Viejo', self.norte.pk, None, None),
+            ('Viejo', self.norte.pk, self.ana.pk, '2026-02-01'),
+            ('Nuevo', self.sur.pk, None, '2026-02-01'),
+        ]
+        for instante, valores in zip(instantes[1:], esperado):
+            data = self.como_estaba(equipo, instante).data
+            self.assertEqual(
+                (data['nombre'], data['sede'], data['empleado_asignado'], data['fecha_ultimo_mantenimiento']), valores
+            )
+
+    def test_reconstruye_con_filas_por_campo_y_compactas(self):
+        por_campo, instantes = self.linea_de_tiempo('AO-1')
+        self.comprobar(por_campo, instantes)
+        with override_settings(HISTORIAL_EQUIPO_COMPACTO=True):
+            compacto, instantes = self.linea_de_tiempo('AO-2')
+        self.comprobar(compacto, instantes)
+
+    def test_parte_de_los_snapshots(self):
+        equipo = Equipo.objects.create(nombre='Viejo', marca='HP', modelo='X', serial='AO-3', sede=self.norte)
+        salida = io.StringIO()
+        call_command('crear_snapshots_equipos', stdout=salida)
+        self.assertIn('1 snapshots created.', salida.getvalue())
+        antes = timezone.now()
+        equipo.nombre = 'Nuevo'
+        equipo.save()
+        call_command('crear_snapshots_equipos', stdout=salida)
+        call_command('crear_snapshots_equipos', stdout=salida)
+        self.assertEqual(equipo.snapshots.count(), 2)
+
+        # Un historial borrado no afecta lo que ya cubren los snapshots.
+        HistorialEquipo.objects.filter(equipo=equipo).delete()
+        self.assertEqual(self.como_estaba(equipo, antes).data['nombre'], 'Viejo')
+        self.assertEqual(self.como_estaba(equipo, timezone.now()).data['nombre'], 'Nuevo')
+
+        # Entre snapshots solo se aplican los cambios posteriores al más cercano.
+        medio = timezone.now()
+        equipo.nombre = 'Último'
+        equipo.save()
+        self.assertEqual(self.como_estaba(equipo, medio).data['nombre'], 'Nuevo')
+
+    def test_as_of_anterior_al_historial_archivado(self):
+        equipo, instantes = self.linea_de_tiempo('AO-9')
+        self.assertIsNone(historial_conservado_desde(HistorialEquipo._meta.db_table))
+        asegurar_particiones(meses_adelante=0, hoy=date(2020, 3, 1))
+        with tempfile.TemporaryDirectory() as destino:
+            archivar_particiones(destino, 24)
+
+        response = self.client.get(f'/api/equipos/{equipo.pk}/', {'as_of': '2020-03-15'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('2020-04-01', response.data['detail'])
+        response = self.client.get('/api/equipos/historico/', {'sede': self.norte.pk, 'as_of': '2020-03-15'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.como_estaba(equipo, instantes[2]).data['nombre'], 'Viejo')
+
+    def test_equipo_dado_de_baja_y_fecha_invalida(self):
+        equipo, instantes = self.linea_de_tiempo('AO-4')
+        self.client.delete(f'/api/equipos/{equipo.pk}/')
+        self.assertEqual(self.client.get(f'/api/equipos/{equipo.pk}/').status_code, 404)
+        self.assertEqual(self.como_estaba(equipo, instantes[2]).data['nombre'], 'Viejo')
+        response = self.client.get(f'/api/equipos/{equipo.pk}/', {'as_of': 'ayer'})
+        self.assertEqual(response.status_code, 400)
+        # Solo la fecha: el estado al final de ese día.
+        response = self.client.get(f'/api/equipos/{equipo.pk}/', {'as_of': timezone.localdate().isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['nombre'], 'Nuevo')
+
+    def test_inventario_de_una_sede(self):
+        movido, instantes = self.linea_de_tiempo('AO-5')
+        fijo = Equipo.objects.create(nombre='Fijo', marca='HP', modelo='X', serial='AO-6', sede=self.norte)
+
+        response = self.client.get('/api/equipos/historico/', {'sede': self.norte.pk, 'as_of': instantes[2].isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([e['id'] for e in response.data['results']], [movido.pk])
+        self.assertEqual(response.data['results'][0]['sede_nombre'], 'Norte')
+
+        response = self.client.get('/api/equipos/historico/', {'sede': self.norte.pk, 'as_of': timezone.now().isoformat()})
+        self.assertEqual([e['id'] for e in response.data['results']], [fijo.pk])
+        response = self.client.get('/api/equipos/historico/', {'sede': self.sur.pk, 'as_of': timezone.now().isoformat()})
+        self.assertEqual([e['id'] for e in response.data['results']], [movido.pk])
+
+        # Fuera de su sede, un usuario sin rol de administrador no puede consultar.
+        self.client.force_authenticate(self.tecnico)
+        response = self.client.get('/api/equipos/historico/', {'sede': self.norte.pk, 'as_of': instantes[2].isoformat()})
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get('/api/equipos/historico/', {'as_of': timezone.now().isoformat()})
+        self.assertEqual(response.data['total'], 1)
+
+
+class HistorialAuditoriaTests(APITestCase):
+    """
+    El historial de un equipo y el de todos los equipos admiten filtros y paginación
+    por cursor; el permiso de sede se resuelve con el equipo y su sede en una consulta.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        cls.otro = User.objects.create_user('otro', password='x', is_staff=True)
+        cls.norte = Sede.objects.create(nombre='Norte')
+        cls.sur = Sede.objects.create(nombre='Sur')
+        cls.tecnico = User.objects.create_user('tecnico', password='x')
+        cls.tecnico.profile.sede = cls.sur
+        cls.tecnico.profile.save()
+        with request_context(user=cls.admin):
+            cls.equipo = Equipo.objects.create(nombre='Auditado', marca='HP', modelo='X', serial='HA-1', sede=cls.norte)
+            for ram in ('8GB', '16GB', '32GB'):
+                cls.equipo.ram = ram
+                cls.equipo.save()
+        with request_context(user=cls.otro), override_settings(HISTORIAL_EQUIPO_COMPACTO=True):
+            cls.equipo.ram = '64GB'
+            cls.equipo.sede = cls.sur
+            cls.equipo.save()
+            cls.ajeno = Equipo.objects.create(nombre='Ajeno', marca='HP', modelo='X', serial='HA-2', sede=cls.norte)
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+
+    def historial(self, **params):
+        response = self.client.get(f'/api/equipos/{self.equipo.pk}/historial/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_filtros(self):
+        ram = [(e['valor_anterior'], e['valor_nuevo']) for e in self.historial(campo_modificado='ram')]
+        self.assertEqual(ram, [('32GB', '64GB'), ('16GB', '32GB'), ('8GB', '16GB'), ('None', '8GB')])
+        self.assertEqual(len(self.historial(campo_modificado='Memoria RAM')), 4)
+        self.assertEqual({e['usuario_nombre'] for e in self.historial(usuario=self.otro.pk)}, {'otro'})
+        self.assertEqual(
+            [e['campo_modificado'] for e in self.historial(usuario=self.otro.pk, campo_modificado='sede')], ['Sede']
+        )
+        self.assertTrue(all(e['tipo_accion'] == 'CREADO' for e in self.historial(tipo_accion='CREADO')))
+        self.assertEqual(self.historial(fecha_hasta='2000-01-01'), [])
+        self.assertEqual(len(self.historial(fecha_desde=timezone.localdate().isoformat(), campo_modificado='ram')), 4)
+        response = self.client.get(f'/api/equipos/{self.equipo.pk}/historial/', {'fecha_desde': 'ayer'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_paginacion_por_cursor(self):
+        completo = self.historial()
+        vistos = []
+        url = f'/api/equipos/{self.equipo.pk}/historial/?page_size=2'
+        while url:
+            data = self.client.get(url).data
+            vistos.extend(data['results'])
+            url = data['next']
+        self.assertEqual(vistos, completo)
+
+    def test_permiso_con_una_consulta_para_equipo_y_sede(self):
+        self.client.force_authenticate(self.tecnico)
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(self.client.get(f'/api/equipos/{self.ajeno.pk}/historial/').status_code, 403)
+        tabla_sede = Sede._meta.db_table
+        equipo = [c['sql'] for c in consultas if Equipo._meta.db_table in c['sql'].split('FROM')[1].split('WHERE')[0]]
+        self.assertEqual(len(equipo), 1)
+        self.assertIn(tabla_sede, equipo[0])
+        self.assertEqual(self.client.get(f'/api/equipos/{self.equipo.pk}/historial/').status_code, 200)
+        self.assertEqual(self.client.get('/api/equipos/999999/historial/').status_code, 404)
+
+    def test_auditoria_de_todos_los_equipos(self):
+        response = self.client.get('/api/equipos/historial-cambios/', {'usuario': self.otro.pk, 'tipo_accion': 'CREADO'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('next', response.data)
+        self.assertEqual({e['equipo_serial'] for e in response.data['results']}, {'HA-2'})
+
+        response = self.client.get('/api/equipos/historial-cambios/', {'sede': self.norte.pk})
+        self.assertEqual({e['equipo'] for e in response.data['results']}, {self.ajeno.pk})
+
+        # Sin rol de administrador, solo los equipos de su sede.
+        self.client.force_authenticate(self.tecnico)
+        response = self.client.get('/api/equipos/historial-cambios/', {'page_size': 500})
+        self.assertEqual({e['equipo'] for e in response.data['results']}, {self.equipo.pk})
+        self.assertIsNone(response.data['next'])
+
+
+class ActualizacionConHistorialTests(APITestCase):
+    """
+    actualizar_con_historial() hace el UPDATE en una sola sentencia y deja el mismo
+    historial que guardar cada objeto con save().
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        cls.norte = Sede.objects.create(nombre='Norte')
+        cls.sur = Sede.objects.create(nombre='Sur')
+        cls.ana = Empleado.objects.create(nombre='Ana', apellido='Ruiz', cedula='4040')
+        cls.luis = Empleado.objects.create(nombre='Luis', apellido='Mora', cedula='5050')
+
+    def pareja(self, prefijo, **valores):
+        return [
+            Equipo.objects.create(nombre='Par', marca='HP', modelo='X', serial=f'{prefijo}-{i}', sede=self.norte, **valores)
+            for i in (1, 2)
+        ]
+
+    def historial(self, equipo):
+        entradas = HistorialEquipoSerializer(
+            HistorialEquipo.objects.filter(equipo=equipo, tipo_accion='ACTUALIZADO').order_by('id'), many=True
+        ).data
+        # En bloque, los movimientos de una misma sentencia comparten fecha y el orden de
+        # los ids entre CTE no está definido: la apertura va antes que la baja.
+        movimientos = HistorialMovimientoEquipo.objects.filter(equipo=equipo).order_by('fecha_asignacion', 'es_baja', 'id')
+        return (
+            sorted((e['campo_modificado'], e['valor_anterior'], e['valor_nuevo'], e['usuario_nombre']) for e in entradas),
+            [
+                (m.empleado_asignado_id, m.sede_id, m.es_baja, m.fecha_devolucion is None, m.observacion_devolucion)
+                for m in movimientos
+            ],
+        )
+
+    def comparar(self, equipos, **cambios):
+        por_save, en_bloque = equipos
+        with request_context(user=self.admin):
+            por_save = Equipo.objects.get(pk=por_save.pk)
+            for nombre, valor in cambios.items():
+                setattr(por_save, nombre, valor)
+            por_save.save()
+            ids = Equipo.objects.filter(pk=en_bloque.pk).actualizar_con_historial(**cambios)
+        self.assertEqual(ids, [en_bloque.pk])
+        self.assertEqual(self.historial(en_bloque), self.historial(por_save))
+        en_bloque.refresh_from_db()
+        for nombre, valor in cambios.items():
+            self.assertEqual(getattr(en_bloque, nombre), valor)
+
+    def test_mismo_historial_que_save(self):
+        equipos = self.pareja('AC', empleado_asignado=self.ana)
+        self.comparar(
+            equipos, sede=self.sur, ram='16GB', fecha_ultimo_mantenimiento=date(2026, 3, 1),
+            fecha_recibido_satisfaccion=datetime(2026, 3, 1, 8, 30, tzinfo=dt_timezone.utc),
+        )
+        self.comparar(equipos, empleado_asignado=self.luis, nombre='Renombrado')
+        self.comparar(equipos, empleado_asignado=None)
+        self.comparar(equipos, empleado_asignado=self.ana)
+        self.comparar(equipos, activo=False)
+
+    def test_fechas_con_microsegundos(self):
+        recibido = datetime(2026, 3, 1, 8, 30, 15, 123456, tzinfo=dt_timezone.utc)
+        equipos = self.pareja('AF', fecha_recibido_satisfaccion=recibido)
+        self.comparar(equipos, fecha_recibido_satisfaccion=recibido.replace(microsecond=0))
+        self.comparar(equipos, fecha_recibido_satisfaccion=recibido.replace(microsecond=500))
+        anteriores = HistorialEquipo.objects.filter(equipo=equipos[1], tipo_accion='ACTUALIZADO').order_by('id')
+        self.assertEqual(
+            list(anteriores.values_list('valor_anterior', flat=True)),
+            ['2026-03-01 08:30:15.123456+00:00', '2026-03-01 08:30:15+00:00'],
+        )
+
+    def test_asignar_y_dar_de_baja_a_la_vez(self):
+        equipos = self.pareja('AD', empleado_asignado=self.ana)
+        self.comparar(equipos, empleado_asignado=self.luis, activo=False)
+        self.assertFalse(AsignacionAbierta.objects.filter(equipo__in=equipos).exists())
+
+    def test_mismo_historial_compacto(self):
+        with override_settings(HISTORIAL_EQUIPO_COMPACTO=True):
+            equipos = self.pareja('ACC')
+            self.comparar(equipos, sede=self.sur, ram='16GB', activo=False, fecha_ultimo_mantenimiento=date(2026, 3, 1))
+        por_save, en_bloque = equipos
+        self.assertEqual(
+            HistorialEquipo.objects.get(equipo=en_bloque, tipo_accion='ACTUALIZADO').cambios,
+            HistorialEquipo.objects.get(equipo=por_save, tipo_accion='ACTUALIZADO').cambios,
+        )
+
+    def test_una_sentencia_y_solo_filas_que_cambian(self):
+        equipos = [
+            Equipo.objects.create(nombre=f'Lote {i}', marca='HP', modelo='X', serial=f'AL-{i}', sede=self.norte)
+            for i in range(20)
+        ]
+        Equipo.objects.filter(pk=equipos[0].pk).update(sede=self.sur)
+        with CaptureQueriesContext(connection) as ctx:
+            ids = Equipo.objects.filter(serial__startswith='AL-').actualizar_con_historial(sede=self.sur.pk)
+        # La sentencia con el UPDATE y el historial, más SAVEPOINT/RELEASE y la lectura de la sede.
+        self.assertEqual(len([q for q in ctx.captured_queries if 'UPDATE' in q['sql']]), 1)
+        self.assertEqual(ids, sorted(equipo.pk for equipo in equipos[1:]))
+        self.assertEqual(
+            HistorialEquipo.objects.filter(tipo_accion='ACTUALIZADO', campo_modificado='Sede', valor_nuevo='Sur').count(), 19
+        )
+        self.assertEqual(Equipo.objects.filter(serial__startswith='AL-').actualizar_con_historial(sede=self.sur), [])
+        with self.assertRaises(ValueError):
+            Equipo.objects.all().actualizar_con_historial(mantenimientos_finalizados=3)
+        with self.assertRaises(ValidationError):
+            Equipo.objects.all().actualizar_con_historial(estado_tecnico='Chatarra')
+        self.assertFalse(Equipo.objects.filter(estado_tecnico='Chatarra').exists())
+
+    def test_perifericos(self):
+        def historial(periferico):
+            return [
+                (h.empleado_asignado_id, h.fecha_devolucion is None, h.observacion_devolucion, h.periferico_nombre)
+                for h in HistorialPeriferico.objects.filter(periferico=periferico).order_by('id')
+            ]
+
+        por_save, en_bloque = [Periferico.objects.create(nombre='Mouse', tipo='Mouse') for _ in (1, 2)]
+        for cambios in ({'empleado_asignado': self.ana}, {'empleado_asignado': self.luis, 'nombre': 'Mouse X'},
+                        {'empleado_asignado': None}):
+            por_save = Periferico.objects.get(pk=por_save.pk)
+            for nombre, valor in cambios.items():
+                setattr(por_save, nombre, valor)
+            por_save.save()
+            Periferico.objects.filter(pk=en_bloque.pk).actualizar_con_historial(**cambios)
+        self.assertEqual(len(historial(en_bloque)), 2)
+        self.assertEqual(historial(en_bloque), historial(por_save))
+
+
+class AsignacionAbiertaTests(APITestCase):
+    """
+    AsignacionAbierta acompaña a la fila abierta del historial de asignaciones, por
+    save() y por actualizar_con_historial(), y alimenta el paz y salvo.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        cls.sede = Sede.objects.create(nombre='Norte')
+        cls.ana = Empleado.objects.create(nombre='Ana', apellido='Ruiz', cedula='6060')
+        cls.luis = Empleado.objects.create(nombre='Luis', apellido='Mora', cedula='7070')
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+
+    def titular(self, objeto):
+        objeto = type(objeto).objects.select_related('asignacion_abierta').get(pk=objeto.pk)
+        asignacion = objeto.asignacion_actual
+        return asignacion.empleado_id if asignacion else None
+
+    def test_sigue_las_asignaciones_del_equipo(self):
+        equipo = Equipo.objects.create(nombre='PC', marca='HP', modelo='X', serial='AA-1', sede=self.sede, empleado_asignado=self.ana)
+        abierta = HistorialMovimientoEquipo.objects.get(equipo=equipo, fecha_devolucion__isnull=True)
+        self.assertEqual(self.titular(equipo), self.ana.pk)
+        self.assertEqual(equipo.asignacion_abierta.fecha_asignacion, abierta.fecha_asignacion)
+
+        equipo.empleado_asignado = self.luis
+        equipo.save()
+        self.assertEqual(self.titular(equipo), self.luis.pk)
+        self.assertEqual(AsignacionAbierta.objects.filter(equipo=equipo).count(), 1)
+        equipo.empleado_asignado = None
+        equipo.save()
+        self.assertIsNone(self.titular(equipo))
+
+        equipo.empleado_asignado = self.ana
+        equipo.save()
+        equipo.activo = False
+        equipo.save()
+        self.assertIsNone(self.titular(equipo))
+
+    def test_en_bloque(self):
+        equipos = [
+            Equipo.objects.create(nombre='PC', marca='HP', modelo='X', serial=f'AB-{i}', sede=self.sede, empleado_asignado=self.ana)
+            for i in range(3)
+        ]
+        Equipo.objects.filter(serial__startswith='AB-').actualizar_con_historial(empleado_asignado=self.luis)
+        self.assertEqual([self.titular(equipo) for equipo in equipos], [self.luis.pk] * 3)
+        self.assertEqual(
+            set(AsignacionAbierta.objects.values_list('fecha_asignacion', flat=True)),
+            set(HistorialMovimientoEquipo.objects.filter(empleado_asignado=self.luis).values_list('fecha_asignacion', flat=True)),
+        )
+        Equipo.objects.filter(pk=equipos[0].pk).actualizar_con_historial(empleado_asignado=None)
+        Equipo.objects.filter(pk=equipos[1].pk).actualizar_con_historial(activo=False)
+        self.assertEqual([self.titular(equipo) for equipo in equipos], [None, None, self.luis.pk])
+
+        periferico = Periferico.objects.create(nombre='Mouse', tipo='Mouse')
+        Periferico.objects.filter(pk=periferico.pk).actualizar_con_historial(empleado_asignado=self.ana)
+        self.assertEqual(self.titular(periferico), self.ana.pk)
+        Periferico.objects.filter(pk=periferico.pk).actualizar_con_historial(empleado_asignado=None)
+        self.assertIsNone(self.titular(periferico))
+
+    def test_perifericos(self):
+        periferico = Periferico.objects.create(nombre='Mouse', tipo='Mouse', empleado_asignado=self.ana)
+        self.assertEqual(self.titular(periferico), self.ana.pk)
+        periferico.empleado_asignado = self.luis
+        periferico.save()
+        self.assertEqual(self.titular(periferico), self.luis.pk)
+        periferico.delete()
+        self.assertFalse(AsignacionAbierta.objects.exists())
+
+    def test_paz_y_salvo(self):
+        url = f'/api/pasisalvos/empleado/{self.ana.pk}/info/'
+        equipo = Equipo.objects.create(nombre='PC', marca='HP', modelo='X', serial='AC-1', sede=self.sede, empleado_asignado=self.ana)
+        Periferico.objects.create(nombre='Mouse', tipo='Mouse', empleado_asignado=self.ana)
+        Periferico.objects.create(nombre='Teclado', tipo='Teclado', empleado_asignado=self.luis)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([e['id'] for e in response.data['pendientes']['equipos']], [equipo.pk])
+        self.assertEqual([p['nombre'] for p in response.data['pendientes']['perifericos']], ['Mouse'])
+        self.assertFalse(response.data['esta_a_paz_y_salvo'])
+
+        equipo.activo = False
+        equipo.save()
+        Periferico.objects.filter(empleado_asignado=self.ana).actualizar_con_historial(empleado_asignado=None)
+        response = self.client.get(url)
+        self.assertEqual(response.data['pendientes'], {'equipos': [], 'perifericos': []})
+        self.assertTrue(response.data['esta_a_paz_y_salvo'])
+
+    def test_paz_y_salvo_ignora_equipos_de_baja(self):
+        url = f'/api/pasisalvos/empleado/{self.ana.pk}/info/'
+        equipo = Equipo.objects.create(nombre='PC', marca='HP', modelo='X', serial='AE-1', sede=self.sede, activo=False)
+        equipo.empleado_asignado = self.ana
+        equipo.save()
+        self.assertEqual(self.titular(equipo), self.ana.pk)
+        response = self.client.get(url)
+        self.assertEqual(response.data['pendientes']['equipos'], [])
+        self.assertTrue(response.data['esta_a_paz_y_salvo'])
+
+        equipo.activo = True
+        equipo.save()
+        response = self.client.get(url)
+        self.assertEqual([e['id'] for e in response.data['pendientes']['equipos']], [equipo.pk])
+        self.assertFalse(response.data['esta_a_paz_y_salvo'])
+        self.assertEqual(HistorialMovimientoEquipo.objects.filter(equipo=equipo, fecha_devolucion__isnull=True, es_baja=False).count(), 1)
+
+    def test_reactivar_reabre_la_asignacion(self):
+        url = f'/api/pasisalvos/empleado/{self.ana.pk}/info/'
+        equipo = Equipo.objects.create(nombre='PC', marca='HP', modelo='X', serial='AD-1', sede=self.sede, empleado_asignado=self.ana)
+        equipo.activo = False
+        equipo.save()
+        self.assertTrue(self.client.get(url).data['esta_a_paz_y_salvo'])
+
+        equipo.activo = True
+        equipo.save()
+        self.assertEqual(self.titular(equipo), self.ana.pk)
+        abiertas = HistorialMovimientoEquipo.objects.filter(equipo=equipo, fecha_devolucion__isnull=True, es_baja=False)
+        self.assertEqual(list(abiertas.values_list('fecha_asignacion', flat=True)), [equipo.asignacion_abierta.fecha_asignacion])
+        response = self.client.get(url)
+        self.assertEqual([e['id'] for e in response.data['pendientes']['equipos']], [equipo.pk])
+        self.assertFalse(response.data['esta_a_paz_y_salvo'])
+
+        # En bloque, igual; si ya estaba abierta (asignado durante la baja) no se duplica.
+        otro = Equipo.objects.create(nombre='PC', marca='HP', modelo='X', serial='AD-2', sede=self.sede, empleado_asignado=self.ana)
+        Equipo.objects.filter(pk__in=[equipo.pk, otro.pk]).actualizar_con_historial(activo=False)
+        Equipo.objects.filter(pk=otro.pk).actualizar_con_historial(empleado_asignado=self.luis)
+        Equipo.objects.filter(pk__in=[equipo.pk, otro.pk]).actualizar_con_historial(activo=True)
+        self.assertEqual([self.titular(equipo), self.titular(otro)], [self.ana.pk, self.luis.pk])
+        self.assertEqual(abiertas.count(), 1)
+        self.assertEqual(HistorialMovimientoEquipo.objects.filter(equipo=otro, fecha_devolucion__isnull=True, es_baja=False).count(), 1)
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class DashboardStatsTests(APITestCase):
+    """
+    El dashboard se calcula con una consulta agrupada por tabla y responde lo mismo
+    que los conteos individuales.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        cls.norte = Sede.objects.create(nombre='Norte')
+        cls.sur = Sede.objects.create(nombre='Sur')
+        cls.tecnico = User.objects.create_user('tecnico', password='x')
+        cls.tecnico.profile.sede = cls.norte
+        cls.tecnico.profile.save()
+        hoy = timezone.now().date()
+        for i, (sede, tipo, estado, disponibilidad, activo) in enumerate([
+            (cls.norte, 'Desktop', 'Nuevo', 'Disponible', True),
+            (cls.norte, 'Laptop', 'Reacondicionado', 'Asignado', True),
+            (cls.norte, 'Laptop', 'Nuevo', 'Disponible', False),
+            (cls.sur, 'Desktop', 'Nuevo', 'Reservado', True),
+        ]):
+            equipo = Equipo.objects.create(
+                nombre=f'PC {i}', marca='HP', modelo='X', serial=f'DS-{i}', sede=sede, tipo_equipo=tipo,
+                estado_tecnico=estado, estado_disponibilidad=disponibilidad, activo=activo,
+            )
+            Equipo.objects.filter(pk=equipo.pk).update(mantenimientos_finalizados=i * 3)
+            Periferico.objects.create(nombre=f'Mouse {i}', tipo='Mouse' if i % 2 else 'Teclado', equipo_asociado=equipo)
+            Licencia.objects.create(
+                equipo_asociado=equipo, tipo_licencia='Office', tipo_activacion='OEM', fecha_instalacion=hoy,
+                fecha_vencimiento=hoy + timedelta(days=(-5, 10, 60, 20)[i]), estado=('Activa', 'Vencida', 'Activa', 'Inactiva')[i],
+            )
+            # Un solo mantenimiento abierto por equipo.
+            abierto = [('Pendiente', -10, None, None), ('Pendiente', -10, 5, None), ('Pendiente', 3, None, None),
+                       ('En proceso', -2, -1, None)][i]
+            for estado_mantenimiento, inicio, limite, real in [
+                abierto, ('Finalizado', -9, -5, -1), ('Finalizado', -9, -5, -6), ('Cancelado', 0, None, None),
+            ]:
+                Mantenimiento.objects.create(
+                    equipo=equipo, sede=sede, tipo_mantenimiento='Preventivo' if i % 2 else 'Correctivo',
+                    estado_mantenimiento=estado_mantenimiento, fecha_inicio=hoy + timedelta(days=inicio),
+                    fecha_finalizacion=limite is not None and hoy + timedelta(days=limite) or None,
+                    fecha_real_finalizacion=real is not None and hoy + timedelta(days=real) or None,
+                )
+
+    def setUp(self):
+        cache.clear()
+
+    def esperado(self, sede):
+        # Los conteos por separado que hacía la vista antes de agruparlos.
+        equipos = Equipo.objects.all()
+        mantenimientos = Mantenimiento.objects.all()
+        perifericos = Periferico.objects.all()
+        licencias = Licencia.objects.all()
+        usuarios = User.objects.all()
+        if sede is not None:
+            equipos = equipos.filter(sede=sede)
+            mantenimientos = mantenimientos.filter(sede=sede)
+            perifericos = perifericos.filter(equipo_asociado__sede=sede)
+            licencias = licencias.filter(equipo_asociado__sede=sede)
+            usuarios = usuarios.filter(profile__sede=sede)
+        activos = equipos.filter(activo=True)
+        hoy = timezone.now().date()
+        limite = hoy + timedelta(days=30)
+        pendientes = mantenimientos.filter(estado_mantenimiento='Pendiente')
+        return {
+            'total_equipos': activos.count(),
+            'equipos_dados_de_baja': equipos.filter(activo=False).count(),
+            'total_mantenimientos': mantenimientos.count(),
+            'total_perifericos': perifericos.count(),
+            'total_licencias': licencias.count(),
+            'total_usuarios': usuarios.count(),
+            'proximos_mantenimientos': pendientes.filter(fecha_inicio__gte=hoy, fecha_inicio__lte=limite).count(),
+            'mantenimientos_activos': mantenimientos.filter(estado_mantenimiento__in=['Pendiente', 'En proceso']).count(),
+            'mantenimientos_vencidos': pendientes.filter(
+                Q(fecha_finalizacion__isnull=False, fecha_finalizacion__lt=hoy) | Q(fecha_finalizacion__isnull=True, fecha_inicio__lt=hoy)
+            ).count(),
+            'mantenimientos_finalizados_tarde': mantenimientos.filter(
+                estado_mantenimiento='Finalizado', fecha_real_finalizacion__gt=F('fecha_finalizacion')
+            ).count(),
+            'licencias_vencidas': licencias.filter(Q(estado='Vencida') | Q(fecha_vencimiento__lt=hoy)).distinct().count(),
+            'licencias_por_vencer': licencias.filter(fecha_vencimiento__gte=hoy, fecha_vencimiento__lte=limite).count(),
+            'equipos_por_estado': list(activos.values('estado_tecnico').annotate(count=Count('estado_tecnico'))),
+            'equipos_por_disponibilidad': list(activos.values('estado_disponibilidad').annotate(count=Count('estado_disponibilidad'))),
+            'equipos_por_tipo': list(activos.values('tipo_equipo').annotate(count=Count('tipo_equipo'))),
+            'equipos_por_salud': [
+                {'salud': clave, 'rango': etiqueta, 'count': activos.filter(q_rango_salud(clave)).count()}
+                for clave, etiqueta, _ in RANGOS_SALUD
+            ],
+            'mantenimientos_por_estado': list(mantenimientos.values('estado_mantenimiento').annotate(count=Count('estado_mantenimiento'))),
+            'mantenimientos_por_tipo': list(mantenimientos.values('tipo_mantenimiento').annotate(count=Count('tipo_mantenimiento'))),
+            'perifericos_por_tipo': list(perifericos.values('tipo').annotate(count=Count('tipo'))),
+            'licencias_por_estado': list(licencias.values('estado').annotate(count=Count('estado'))),
+        }
+
+    def normalizar(self, stats):
+        return {
+            clave: sorted(valor, key=lambda fila: sorted(map(str, fila.values()))) if isinstance(valor, list) else valor
+            for clave, valor in stats.items()
+        }
+
+    def test_mismos_valores_que_los_conteos_individuales(self):
+        for sede in (None, self.norte, self.sur):
+            with self.subTest(sede=sede):
+                self.assertEqual(self.normalizar(estadisticas_dashboard(sede)), self.normalizar(self.esperado(sede)))
+
+    def test_vista(self):
+        self.client.force_authenticate(self.admin)
+        # Una consulta por tabla (equipos, mantenimientos, periféricos, licencias, usuarios),
+        # más la sede pedida.
+        with self.assertNumQueries(6):
+            response = self.client.get(f'/api/dashboard/stats/?sede={self.sur.pk}')
+        self.assertEqual(self.normalizar(response.data), self.normalizar(self.esperado(self.sur)))
+
+        self.client.force_authenticate(self.tecnico)
+        response = self.client.get(f'/api/dashboard/stats/?sede={self.sur.pk}')
+        self.assertEqual(self.normalizar(response.data), self.normalizar(self.esperado(self.norte)))
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class DashboardCacheTests(APITestCase):
+    """
+    Caché del dashboard por sede: invalidación por señales y un solo cálculo a la vez.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        cls.norte = Sede.objects.create(nombre='Norte')
+        cls.sur = Sede.objects.create(nombre='Sur')
+        cls.equipo = Equipo.objects.create(nombre='PC', marca='HP', modelo='X', serial='DC-1', sede=cls.norte)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.admin)
+
+    def total(self, sede=None):
+        return estadisticas_dashboard_cacheadas(sede)['total_equipos']
+
+    def test_cachea_por_sede(self):
+        self.assertEqual(self.client.get('/api/dashboard/stats/').data['total_equipos'], 1)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/dashboard/stats/')
+        self.assertEqual(response.data['total_equipos'], 1)
+        self.assertEqual(self.total(self.sur), 0)
+        with self.assertNumQueries(0):
+            self.total(self.sur)
+
+    def test_invalida_las_sedes_afectadas(self):
+        self.total(), self.total(self.norte), self.total(self.sur)
+        with self.captureOnCommitCallbacks(execute=True):
+            Equipo.objects.create(nombre='PC', marca='HP', modelo='X', serial='DC-2', sede=self.norte)
+        self.assertEqual((self.total(), self.total(self.norte)), (2, 2))
+        with self.assertNumQueries(0):
+            self.total(self.sur)
+
+        # Un cambio de sede invalida la de origen y la de destino.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.equipo.sede = self.sur
+            self.equipo.save()
+        self.assertEqual((self.total(self.norte), self.total(self.sur)), (1, 1))
+
+        # Las actualizaciones en bloque invalidan todo.
+        with self.captureOnCommitCallbacks(execute=True):
+            Equipo.objects.filter(pk=self.equipo.pk).actualizar_con_historial(activo=False)
+        self.assertEqual(self.total(self.sur), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Mantenimiento.objects.create(equipo=self.equipo, sede=self.sur, tipo_mantenimiento='Preventivo')
+        self.assertEqual(estadisticas_dashboard_cacheadas(self.sur)['total_mantenimientos'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create_user('otro', password='x')
+        self.assertEqual(estadisticas_dashboard_cacheadas()['total_usuarios'], 2)
+
+    def test_mantenimiento_movido_invalida_ambas_sedes(self):
+        mantenimiento = Mantenimiento.objects.create(equipo=self.equipo, sede=self.norte, tipo_mantenimiento='Preventivo')
+
+        def totales():
+            return tuple(estadisticas_dashboard_cacheadas(sede)['total_mantenimientos'] for sede in (self.norte, self.sur))
+
+        self.assertEqual(totales(), (1, 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/mantenimientos/{mantenimiento.pk}/', {'sede': self.sur.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(totales(), (0, 1))
+
+    def test_usuarios_solo_invalidan_lo_que_cuentan(self):
+        usuario = User.objects.create_user('ana', password='x')
+        self.total(), self.total(self.norte), self.total(self.sur)
+        # Un inicio de sesión (last_login) o un cambio de contraseña no invalida nada.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(self.client.login(username='ana', password='x'))
+            usuario.set_password('y')
+            usuario.save()
+        with self.assertNumQueries(0):
+            self.total(), self.total(self.norte), self.total(self.sur)
+
+        # La sede del perfil invalida la de origen y la de destino, no las demás.
+        with self.captureOnCommitCallbacks(execute=True):
+            usuario.profile.sede = self.norte
+            usuario.profile.save()
+        self.assertEqual(estadisticas_dashboard_cacheadas(self.norte)['total_usuarios'], 1)
+        with self.assertNumQueries(0):
+            self.total(self.sur)
+        with self.captureOnCommitCallbacks(execute=True):
+            usuario.profile.sede = self.sur
+            usuario.profile.save()
+        self.assertEqual(
+            (estadisticas_dashboard_cacheadas(self.norte)['total_usuarios'], estadisticas_dashboard_cacheadas(self.sur)['total_usuarios']),
+            (0, 1),
+        )
+
+    def test_licencia_invalida_solo_su_sede(self):
+        otro = Equipo.objects.create(nombre='PC', marca='HP', modelo='X', serial='DC-5', sede=self.sur)
+        licencia = Licencia.objects.create(
+            equipo_asociado=self.equipo, tipo_licencia='Office', tipo_activacion='OEM', fecha_instalacion=timezone.now().date(),
+        )
+
+        def vencidas(sede):
+            return estadisticas_dashboard_cacheadas(sede)['licencias_vencidas']
+
+        self.assertEqual((vencidas(self.norte), vencidas(self.sur)), (0, 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            licencia.fecha_vencimiento = timezone.now().date() - timedelta(days=1)
+            licencia.save()
+        self.assertEqual(vencidas(self.norte), 1)
+        with self.assertNumQueries(0):
+            vencidas(self.sur)
+
+        # Al cambiar de equipo se invalidan la sede de origen y la de destino.
+        with self.captureOnCommitCallbacks(execute=True):
+            licencia.equipo_asociado = otro
+            licencia.save()
+        self.assertEqual((vencidas(self.norte), vencidas(self.sur)), (0, 1))
+
+    def test_sin_confirmar_no_invalida(self):
+        self.total(self.norte)
+        Equipo.objects.create(nombre='PC', marca='HP', modelo='X', serial='DC-3', sede=self.norte)
+        self.assertEqual(self.total(self.norte), 1)
+
+    def test_un_solo_calculo_a_la_vez(self):
+        candado = f'{CLAVE_CALCULO}:{self.norte.pk}'
+        self.assertTrue(cache.add(candado, 'otra solicitud'))
+        self.addCleanup(cache.delete, candado)
+        # Sin entrada, espera la que escribe la solicitud que tiene el candado.
+        vencida = {'total_equipos': 7}
+
+        def calcular():
+            cache.set(f'{CLAVE_ESTADISTICAS}:{self.norte.pk}', {
+                'versiones': _versiones(str(self.norte.pk)), 'vence': 0, 'datos': vencida,
+            })
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            executor.submit(lambda: (time.sleep(0.2), calcular()))
+            with self.assertNumQueries(0):
+                self.assertEqual(self.total(self.norte), 7)
+        # Vencida y con el candado tomado, se sirve la entrada anterior.
+        with self.assertNumQueries(0):
+            self.assertEqual(self.total(self.norte), 7)
+        cache.delete(candado)
+        self.assertEqual(self.total(self.norte), 1)
+
+    def test_cache_en_archivos(self):
+        with tempfile.TemporaryDirectory() as directorio, override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directorio},
+        }):
+            self.assertEqual(self.total(self.norte), 1)
+            with self.assertNumQueries(0):
+                self.total(self.norte)
+            with self.captureOnCommitCallbacks(execute=True):
+                Equipo.objects.create(nombre='PC', marca='HP', modelo='X', serial='DC-4', sede=self.norte)
+            self.assertEqual(self.total(self.norte), 2)
+
+
+
+def _total_en_otro_worker(base_de_datos, sede_id):
+    # Corre en un proceso aparte (spawn, iniciado con django.setup), como otro worker
+    # de la aplicación, contra la base de datos de prueba.
+    connection.settings_dict['NAME'] = base_de_datos
+    return estadisticas_dashboard_cacheadas(sede_id)['total_equipos']
+
+
+class CacheCompartidoTests(TransactionTestCase):
+    """
+    Con el caché configurado (DatabaseCache), lo que invalida un proceso lo ven los demás.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_la_invalidacion_llega_a_otro_proceso(self):
+        sede = Sede.objects.create(nombre='Norte')
+        Equipo.objects.create(nombre='PC', marca='HP', modelo='X', serial='CC-1', sede=sede)
+        base_de_datos = connection.settings_dict['NAME']
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup,
+        ) as worker:
+            self.assertEqual(worker.submit(_total_en_otro_worker, base_de_datos, sede.pk).result(), 1)
+            # El otro proceso dejó la entrada en el caché compartido.
+            self.assertEqual(estadisticas_dashboard_cacheadas(sede.pk)['total_equipos'], 1)
+            Equipo.objects.create(nombre='PC', marca='HP', modelo='X', serial='CC-2', sede=sede)
+            self.assertEqual(worker.submit(_total_en_otro_worker, base_de_datos, sede.pk).result(), 2)
+
+    def test_advierte_un_cache_por_proceso(self):
+        self.assertEqual(revisar_cache_compartido(None), [])
+        with override_settings(CACHES=CACHE_LOCAL):
+            self.assertEqual([aviso.id for aviso in revisar_cache_compartido(None)], ['inventory.W001'])
+
+class EstadisticasDiariasTests(APITestCase):
+    """
+    registrar_estadisticas_diarias guarda una fila por sede y día; las tendencias las leen
+    con una consulta.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        cls.norte = Sede.objects.create(nombre='Norte')
+        cls.sur = Sede.objects.create(nombre='Sur')
+        cls.tecnico = User.objects.create_user('tecnico', password='x')
+        cls.tecnico.profile.sede = cls.sur
+        cls.tecnico.profile.save()
+        hoy = timezone.now().date()
+        for i, (sede, tipo, activo) in enumerate([
+            (cls.norte, 'Desktop', True), (cls.norte, 'Laptop', True), (cls.norte, 'Laptop', False), (cls.sur, 'Laptop', True),
+        ]):
+            equipo = Equipo.objects.create(
+                nombre=f'PC {i}', marca='HP', modelo='X', serial=f'ED-{i}', sede=sede, tipo_equipo=tipo, activo=activo,
+            )
+            Licencia.objects.create(
+                equipo_asociado=equipo, tipo_licencia='Office', tipo_activacion='OEM', fecha_instalacion=hoy,
+                fecha_vencimiento=hoy + timedelta(days=(-1, 5, 90, 10)[i]),
+            )
+            Mantenimiento.objects.create(
+                equipo=equipo, sede=sede, tipo_mantenimiento='Preventivo', fecha_inicio=hoy - timedelta(days=3),
+            )
+        Equipo.objects.create(nombre='Sin sede', marca='HP', modelo='X', serial='ED-X')
+
+    def test_registra_una_fila_por_sede(self):
+        with self.assertNumQueries(5):
+            self.assertEqual(registrar_estadisticas_diarias(), 2)
+        norte = EstadisticaDiaria.objects.get(sede=self.norte)
+        self.assertEqual(norte.fecha, timezone.now().date())
+        self.assertEqual((norte.total_equipos, norte.equipos_dados_de_baja), (2, 1))
+        self.assertEqual(norte.equipos_por_tipo, {'Desktop': 1, 'Laptop': 1})
+        self.assertEqual(norte.equipos_por_estado, {'Nuevo': 2})
+        self.assertEqual((norte.mantenimientos_activos, norte.mantenimientos_vencidos), (3, 3))
+        self.assertEqual((norte.licencias_vencidas, norte.licencias_por_vencer), (1, 1))
+
+        # Volver a ejecutarlo el mismo día reemplaza las filas.
+        Equipo.objects.filter(serial='ED-3').update(activo=False)
+        call_command('registrar_estadisticas_diarias', stdout=io.StringIO())
+        self.assertEqual(EstadisticaDiaria.objects.count(), 2)
+        self.assertEqual(EstadisticaDiaria.objects.get(sede=self.sur).total_equipos, 0)
+
+    def test_tendencias(self):
+        hoy = timezone.now().date()
+        for dias, (norte, sur) in enumerate([(5, 1), (4, 2), (3, 3)]):
+            for sede, total in ((self.norte, norte), (self.sur, sur)):
+                EstadisticaDiaria.objects.create(
+                    sede=sede, fecha=hoy - timedelta(days=dias), total_equipos=total, equipos_por_tipo={'Laptop': total},
+                )
+        self.client.force_authenticate(self.admin)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/dashboard/tendencias/', {'desde': str(hoy - timedelta(days=1))})
+        self.assertEqual(response.data['desde'], hoy - timedelta(days=1))
+        self.assertEqual(
+            [(dia['fecha'], dia['total_equipos'], dia['equipos_por_tipo']) for dia in response.data['results']],
+            [(hoy - timedelta(days=1), 6, {'Laptop': 6}), (hoy, 6, {'Laptop': 6})],
+        )
+        response = self.client.get('/api/dashboard/tendencias/', {'sede': self.norte.pk})
+        self.assertEqual([dia['total_equipos'] for dia in response.data['results']], [3, 4, 5])
+        self.assertEqual(self.client.get('/api/dashboard/tendencias/', {'hasta': 'ayer'}).status_code, 400)
+        self.assertEqual(
+            self.client.get('/api/dashboard/tendencias/', {'desde': str(hoy), 'hasta': str(hoy - timedelta(days=1))}).status_code,
+            400,
+        )
+
+        # Los demás usuarios solo ven su sede.
+        self.client.force_authenticate(self.tecnico)
+        response = self.client.get('/api/dashboard/tendencias/', {'sede': self.norte.pk})
+        self.assertEqual(response.data['sede'], self.sur.pk)
+        self.assertEqual([dia['total_equipos'] for dia in response.data['results']], [3, 2, 1])
+
+
+class SeriesTemporalesTests(APITestCase):
+    """
+    /api/dashboard/series/ agrupa por día, semana o mes en la base de datos, sin huecos.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        cls.norte = Sede.objects.create(nombre='Norte')
+        cls.sur = Sede.objects.create(nombre='Sur')
+        cls.ana = Empleado.objects.create(nombre='Ana', apellido='Ruiz', cedula='8080')
+        cls.laptop = Equipo.objects.create(nombre='L', marca='HP', modelo='X', serial='ST-1', sede=cls.norte, tipo_equipo='Laptop', empleado_asignado=cls.ana)
+        cls.desktop = Equipo.objects.create(nombre='D', marca='HP', modelo='X', serial='ST-2', sede=cls.norte, empleado_asignado=cls.ana)
+        cls.desktop.activo = False
+        cls.desktop.save()
+        otro = Equipo.objects.create(nombre='S', marca='HP', modelo='X', serial='ST-3', sede=cls.sur)
+
+        def instante(dia):
+            return datetime(2026, 3, dia, 12, tzinfo=dt_timezone.utc)
+
+        HistorialMovimientoEquipo.objects.filter(equipo=cls.laptop).update(fecha_asignacion=instante(2))
+        HistorialMovimientoEquipo.objects.filter(equipo=cls.desktop, es_baja=False).update(fecha_asignacion=instante(3))
+        HistorialMovimientoEquipo.objects.filter(equipo=cls.desktop, es_baja=True).update(fecha_baja=instante(10))
+        for equipo, sede, tipo, estado, creado, real in [
+            (cls.laptop, cls.norte, 'Preventivo', 'Finalizado', 2, date(2026, 3, 4)),
+            (cls.laptop, cls.norte, 'Correctivo', 'Cancelado', 9, None),
+            (cls.desktop, cls.norte, 'Preventivo', 'Finalizado', 16, date(2026, 4, 1)),
+            (otro, cls.sur, 'Preventivo', 'Pendiente', 2, None),
+        ]:
+            mantenimiento = Mantenimiento.objects.create(
+                equipo=equipo, sede=sede, tipo_mantenimiento=tipo, estado_mantenimiento=estado, fecha_real_finalizacion=real,
+            )
+            Mantenimiento.objects.filter(pk=mantenimiento.pk).update(creado_en=instante(creado))
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+
+    def series(self, **params):
+        response = self.client.get('/api/dashboard/series/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_por_semana(self):
+        # La sede pedida y una consulta agrupada por serie.
+        with self.assertNumQueries(5):
+            data = self.series(intervalo='semana', desde='2026-03-04', hasta='2026-03-17', sede=self.norte.pk)
+        self.assertEqual(data['desde'], date(2026, 3, 2))
+        self.assertEqual([
+            (fila['periodo'], fila['mantenimientos_creados'], fila['mantenimientos_finalizados'], fila['asignaciones'], fila['bajas'])
+            for fila in data['results']
+        ], [
+            (date(2026, 3, 2), 1, 1, 2, 0),
+            (date(2026, 3, 9), 1, 0, 0, 1),
+            (date(2026, 3, 16), 1, 0, 0, 0),
+        ])
+
+    def test_por_mes_y_filtros(self):
+        data = self.series(intervalo='mes', desde='2026-03-15', hasta='2026-04-02')
+        self.assertEqual(
+            [(fila['periodo'], fila['mantenimientos_creados'], fila['mantenimientos_finalizados']) for fila in data['results']],
+            [(date(2026, 3, 1), 4, 1), (date(2026, 4, 1), 0, 1)],
+        )
+        data = self.series(intervalo='mes', desde='2026-03-01', hasta='2026-03-31', tipo_mantenimiento='Correctivo', tipo_equipo='Laptop')
+        fila = data['results'][0]
+        self.assertEqual((fila['mantenimientos_creados'], fila['asignaciones'], fila['bajas']), (1, 1, 0))
+
+        data = self.series(desde='2026-03-01', hasta='2026-03-03')
+        self.assertEqual([fila['mantenimientos_creados'] for fila in data['results']], [0, 2, 0])
+
+    def test_parametros_invalidos(self):
+        for params in ({'intervalo': 'hora'}, {'desde': '2020-01-01', 'hasta': '2026-01-01'}, {'desde': 'x'}):
+            self.assertEqual(self.client.get('/api/dashboard/series/', params).status_code, 400)
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class AnaliticaSlaTests(APITestCase):
+    """
+    /api/dashboard/sla/ calcula MTTR, percentiles, tasa de finalización tarde y backlog
+    en una consulta, en caché hasta que cambian los mantenimientos de la sede.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        cls.norte = Sede.objects.create(nombre='Norte')
+        cls.sur = Sede.objects.create(nombre='Sur')
+        cls.ana = User.objects.create_user('ana', password='x')
+        cls.luis = User.objects.create_user('luis', password='x')
+        hoy = timezone.now().date()
+        for i, (responsable, sede, estado, dias, tarde) in enumerate([
+            (cls.ana, cls.norte, 'Finalizado', 2, False),
+            (cls.ana, cls.norte, 'Finalizado', 4, True),
+            (cls.ana, cls.norte, 'Finalizado', 10, False),
+            (cls.luis, cls.sur, 'Finalizado', 1, False),
+            (None, cls.norte, 'Pendiente', None, False),
+            (cls.luis, cls.sur, 'En proceso', None, False),
+        ]):
+            equipo = Equipo.objects.create(nombre=f'PC {i}', marca='HP', modelo='X', serial=f'SL-{i}', sede=sede)
+            inicio = hoy - timedelta(days=20 + i)
+            Mantenimiento.objects.create(
+                equipo=equipo, sede=sede, responsable=responsable, tipo_mantenimiento='Correctivo',
+                estado_mantenimiento=estado, fecha_inicio=inicio,
+                fecha_finalizacion=inicio + timedelta(days=15),
+                fecha_real_finalizacion=inicio + timedelta(days=dias) if dias is not None else None,
+            )
+            if tarde:
+                Mantenimiento.objects.filter(equipo=equipo).update(fecha_finalizacion=inicio + timedelta(days=1))
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.admin)
+
+    def test_metricas(self):
+        with self.assertNumQueries(1):
+            resultado = analitica_sla()
+        general = resultado['general']
+        self.assertEqual((general['finalizados'], general['mttr_dias'], general['finalizados_tarde']), (4, 4.25, 1))
+        self.assertEqual((general['abiertos'], general['antiguedad_maxima_dias']), (2, 25))
+
+        por_responsable = {fila['responsable_nombre']: fila for fila in resultado['por_responsable']}
+        ana = por_responsable['ana']
+        self.assertEqual((ana['mttr_dias'], ana['p50_dias'], ana['p90_dias']), (5.33, 4.0, 8.8))
+        self.assertEqual(ana['tasa_finalizacion_tarde'], 0.3333)
+        self.assertEqual((ana['posicion_mttr'], por_responsable['luis']['posicion_mttr']), (2, 1))
+        self.assertEqual((por_responsable['luis']['abiertos'], por_responsable['luis']['antiguedad_maxima_dias']), (1, 25))
+        sin_responsable = por_responsable[None]
+        self.assertEqual((sin_responsable['finalizados'], sin_responsable['tasa_finalizacion_tarde'], sin_responsable['abiertos']), (0, None, 1))
+
+        por_sede = {fila['sede_nombre']: fila for fila in resultado['por_sede']}
+        self.assertEqual((por_sede['Norte']['finalizados'], por_sede['Sur']['mttr_dias']), (3, 1.0))
+        self.assertEqual([fila['sede'] for fila in analitica_sla(self.sur)['por_sede']], [self.sur.pk])
+
+    def test_cache_invalidado_al_finalizar_y_cancelar(self):
+        url = f'/api/dashboard/sla/?sede={self.sur.pk}'
+        self.assertEqual(self.client.get(url).data['general']['abiertos'], 1)
+        with self.assertNumQueries(1):  # Solo la sede pedida.
+            self.client.get(url)
+
+        abierto = Mantenimiento.objects.get(sede=self.sur, estado_mantenimiento='En proceso')
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    f'/api/mantenimientos/{abierto.pk}/finalizar/',
+                    {'evidencia_finalizacion': SimpleUploadedFile('acta.pdf', b'%PDF')}, format='multipart',
+                )
+            self.assertEqual(response.status_code, 200)
+        general = self.client.get(url).data['general']
+        self.assertEqual((general['finalizados'], general['abiertos']), (2, 0))
+
+        pendiente = Mantenimiento.objects.get(sede=self.norte, estado_mantenimiento='Pendiente')
+        self.assertEqual(self.client.get('/api/dashboard/sla/').data['general']['abiertos'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(f'/api/mantenimientos/{pendiente.pk}/cancelar/').status_code, 200)
+        self.assertEqual(self.client.get('/api/dashboard/sla/').data['general']['abiertos'], 0)
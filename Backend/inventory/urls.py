@@ -7,7 +7,7 @@ from .views import (
     PerifericoListCreateAPIView, PerifericoRetrieveUpdateDestroyAPIView,
     LicenciaListCreateAPIView, LicenciaRetrieveUpdateDestroyAPIView,
     PasisalvoListCreateAPIView, PasisalvoRetrieveUpdateDestroyAPIView,
-    DashboardStatsView, HistorialPerifericoListAPIView, HistorialEquipoListView, HistorialMovimientoEquipoListAPIView,
+    DashboardStatsView, DashboardTendenciasView, DashboardSeriesView, DashboardSlaView, HistorialPerifericoListAPIView, HistorialEquipoListView, HistorialEquiposAuditoriaListView, HistorialMovimientoEquipoListAPIView,
     clearance_info
 )
 
@@ -19,6 +19,7 @@ router.register(r'equipos', EquipoViewSet, basename='equipo')
 urlpatterns = [
     # URLs para Equipos (rutas adicionales)
     path('equipos/historial/', HistorialMovimientoEquipoListAPIView.as_view(), name='historial-equipo-movimiento-list'),
+    path('equipos/historial-cambios/', HistorialEquiposAuditoriaListView.as_view(), name='historial-equipo-cambios-list'),
     path('equipos/<int:equipo_pk>/historial/', HistorialEquipoListView.as_view(), name='equipo-historial-list'),
 
     # URLs para Sedes
@@ -46,4 +47,7 @@ urlpatterns = [
 
     # URL para las estadísticas del Dashboard
     path('dashboard/stats/', DashboardStatsView.as_view(), name='dashboard-stats'),
+    path('dashboard/tendencias/', DashboardTendenciasView.as_view(), name='dashboard-tendencias'),
+    path('dashboard/series/', DashboardSeriesView.as_view(), name='dashboard-series'),
+    path('dashboard/sla/', DashboardSlaView.as_view(), name='dashboard-sla'),
 ]
\ No newline at end of file
@@ -2,20 +2,33 @@ from django.shortcuts import render
 from rest_framework import generics, status
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from datetime import timedelta
 from rest_framework.permissions import IsAuthenticated
 from django.contrib.auth.models import User
 from sede.models import Sede
+from empleados.models import Empleado
 from mantenimientos.models import Mantenimiento
-from .models import Equipo, Periferico, Licencia, Pasisalvo, HistorialPeriferico, HistorialEquipo, HistorialMovimientoEquipo
+from .models import AsignacionAbierta, Equipo, Periferico, Licencia, Pasisalvo, HistorialPeriferico, HistorialEquipo, HistorialMovimientoEquipo, RANGOS_SALUD, q_rango_salud
 from usuarios.models import UserProfile
 from usuarios.permissions import IsAdminOrOwnerBySede # <-- IMPORTAR
-from django.db.models import Count, Q, F
-from .serializers import SedeSerializer, EquipoSerializer, MantenimientoSerializer, PerifericoSerializer, LicenciaSerializer, PasisalvoSerializer, HistorialPerifericoSerializer, HistorialEquipoSerializer, HistorialMovimientoEquipoSerializer
+from django.db.models import Q, prefetch_related_objects
+from .serializers import SedeSerializer, EquipoSerializer, EquipoActualizacionMasivaSerializer, MantenimientoSerializer, PerifericoSerializer, LicenciaSerializer, PasisalvoSerializer, HistorialPerifericoSerializer, HistorialEquipoSerializer, HistorialEquipoAuditoriaSerializer, HistorialMovimientoEquipoSerializer
 import django_filters.rest_framework
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from .exports import exportar_equipos_csv, exportar_equipos_xlsx
+from .importers import ImportadorEquipos, ErrorArchivo
+from .history import actualizar_equipos_en_bloque, campo_historial_equipo
+from .conditional import ConditionalGetMixin
+from .search import buscar_equipos
+from .pagination import RequiredKeysetPagination
+from .snapshots import equipos_de_sede, historial_disponible_desde, parsear_instante, reconstruir_equipos
+from .dashboard import analitica_sla_cacheada, estadisticas_dashboard_cacheadas, series_temporales, tendencias_diarias
 
 # Vistas para el modelo Sede
 class SedeListCreateAPIView(generics.ListCreateAPIView):
@@ -34,6 +47,12 @@ class EquipoFilter(django_filters.rest_framework.FilterSet):
         method='filter_by_status',
         label='Estado de Mantenimiento'
     )
+    salud = django_filters.ChoiceFilter(
+        choices=[(clave, etiqueta) for clave, etiqueta, _ in RANGOS_SALUD],
+        method='filter_by_salud',
+        label='Diagnóstico de Salud'
+    )
+    q = django_filters.CharFilter(method='filter_by_search', label='Buscar')
 
     class Meta:
         model = Equipo
@@ -50,21 +69,49 @@ class EquipoFilter(django_filters.rest_framework.FilterSet):
             )
         return queryset
 
+    def filter_by_salud(self, queryset, name, value):
+        return queryset.filter(q_rango_salud(value))
+
+    def filter_by_search(self, queryset, name, value):
+        # Resultados ordenados por relevancia (ver inventory.search).
+        return buscar_equipos(queryset, value)
+
 # Vistas para el modelo Equipo
-class EquipoViewSet(viewsets.ModelViewSet):
+class EquipoViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = EquipoSerializer
     permission_classes = [IsAuthenticated, IsAdminOrOwnerBySede] # <-- APLICAR
     filter_backends = [django_filters.rest_framework.DjangoFilterBackend]
     filterset_class = EquipoFilter
+    conditional_related = ['historial_mantenimientos']
+    conditional_related_models = [Sede, Empleado, User, UserProfile]
 
     def get_queryset(self):
+        queryset = self.get_scoped_queryset()
+        # La exportación y la actualización masiva no serializan equipos: no necesitan
+        # los joins ni los conteos precargados.
+        if self.action in ('exportar', 'actualizar_masivo'):
+            return queryset
+        return EquipoSerializer.setup_eager_loading(
+            queryset, EquipoSerializer.get_requested_fields(self.request)
+        )
+
+    def get_conditional_queryset(self):
+        return self.filter_queryset(self.get_scoped_queryset())
+
+    def get_scoped_queryset(self):
+        """
+        Equipos activos visibles para el usuario según su sede. El detalle con ?as_of=
+        también encuentra equipos dados de baja después.
+        """
         user = self.request.user
         
         if not user.is_authenticated:
             return Equipo.objects.none()
 
         # 1. Base queryset
-        queryset = Equipo.objects.filter(activo=True).order_by('nombre')
+        queryset = Equipo.objects.order_by('nombre')
+        if not (self.action == 'retrieve' and 'as_of' in self.request.query_params):
+            queryset = queryset.filter(activo=True)
 
         # 2. Check if user is admin
         is_admin = False
@@ -95,7 +142,7 @@ class EquipoViewSet(viewsets.ModelViewSet):
         Para acciones 'list' y 'create', solo se necesita estar autenticado.
         Para otras acciones (retrieve, update, destroy), se aplica el permiso de sede.
         """
-        if self.action in ['list', 'create']:
+        if self.action in ['list', 'create', 'exportar', 'importar', 'actualizar_masivo', 'historico']:
             self.permission_classes = [IsAuthenticated]
         else:
             self.permission_classes = [IsAuthenticated, IsAdminOrOwnerBySede]
@@ -121,6 +168,192 @@ class EquipoViewSet(viewsets.ModelViewSet):
             serializer.save()
 
 
+    @staticmethod
+    def _instante_as_of(texto):
+        """
+        (instante, None) para un ?as_of= válido y reconstruible, o (None, respuesta 400).
+        """
+        instante = parsear_instante(texto)
+        if instante is None:
+            return None, Response({'detail': 'Fecha "as_of" inválida. Use AAAA-MM-DD o fecha y hora ISO 8601.'}, status=status.HTTP_400_BAD_REQUEST)
+        desde = historial_disponible_desde()
+        if desde is not None and instante < desde:
+            return None, Response(
+                {'detail': f'El historial anterior a {desde.date().isoformat()} está archivado; use una fecha posterior.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return instante, None
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Con `?as_of=` (fecha o fecha y hora ISO 8601) devuelve el equipo como estaba en
+        ese momento, reconstruido desde su historial (ver inventory.snapshots).
+        """
+        if 'as_of' not in request.query_params:
+            return super().retrieve(request, *args, **kwargs)
+        instante, error = self._instante_as_of(request.query_params['as_of'])
+        if error is not None:
+            return error
+        equipo = self.get_object()
+        historico = reconstruir_equipos([equipo.pk], instante).get(equipo.pk)
+        if historico is None:
+            return Response({'detail': 'El equipo no existía en esa fecha.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(self.get_serializer(historico).data)
+
+    @action(detail=False, methods=['get'])
+    def historico(self, request):
+        """
+        Inventario de una sede en un momento dado (`?as_of=` y `?sede=`), para auditorías:
+        los equipos activos que estaban en la sede, reconstruidos desde su historial.
+        """
+        instante, error = self._instante_as_of(request.query_params.get('as_of', ''))
+        if error is not None:
+            return error
+
+        user = request.user
+        is_admin = user.is_staff or user.is_superuser
+        user_profile = None
+        try:
+            user_profile = user.profile
+            if hasattr(user_profile, 'rol') and user_profile.rol == 'ADMIN':
+                is_admin = True
+        except UserProfile.DoesNotExist:
+            pass
+
+        sede_id = request.query_params.get('sede') or request.query_params.get('sede_id')
+        if not is_admin:
+            sede_usuario = getattr(user_profile, 'sede_id', None)
+            if sede_usuario is None:
+                return Response({'detail': 'Usuario sin sede asignada.'}, status=status.HTTP_403_FORBIDDEN)
+            if sede_id and str(sede_id) != str(sede_usuario):
+                return Response({'detail': 'No tienes permiso para consultar esa sede.'}, status=status.HTTP_403_FORBIDDEN)
+            sede_id = sede_usuario
+        if not str(sede_id or '').isdigit():
+            return Response({'detail': 'Indica la sede con "sede".'}, status=status.HTTP_400_BAD_REQUEST)
+
+        equipos = equipos_de_sede(int(sede_id), instante)
+        prefetch_related_objects(equipos, 'sede', 'empleado_asignado__user__profile__sede')
+        serializer = self.get_serializer(equipos, many=True)
+        return Response({
+            'as_of': instante.isoformat(),
+            'sede': int(sede_id),
+            'total': len(equipos),
+            'results': serializer.data,
+        })
+
+    @action(detail=False, methods=['get'])
+    def exportar(self, request):
+        """
+        Descarga el inventario en CSV (por defecto) o XLSX con `?formato=xlsx`.
+        Aplica el mismo alcance por sede y los mismos filtros que el listado.
+        """
+        formato = request.query_params.get('formato', 'csv').lower()
+        if formato not in ('csv', 'xlsx'):
+            return Response({'detail': 'Formato no soportado. Use csv o xlsx.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        sede_id = request.query_params.get('sede') or request.query_params.get('sede_id')
+        nombre_archivo = f"equipos_{f'sede_{sede_id}' if sede_id and sede_id != '0' else 'todas'}_{timezone.now():%Y%m%d}"
+
+        if formato == 'xlsx':
+            try:
+                return exportar_equipos_xlsx(queryset, nombre_archivo)
+            except ImportError:
+                return Response({'detail': 'La exportación a XLSX requiere openpyxl.'}, status=status.HTTP_501_NOT_IMPLEMENTED)
+        return exportar_equipos_csv(queryset, nombre_archivo)
+
+    @action(detail=False, methods=['post'], parser_classes=[MultiPartParser, FormParser])
+    def importar(self, request):
+        """
+        Carga masiva de equipos desde un archivo CSV, XLSX o XLS (campo `archivo`).
+        Con `simulacion=true` solo valida; con `omitir_errores=true` carga las filas válidas.
+        """
+        archivo = request.FILES.get('archivo')
+        if not archivo:
+            return Response({'detail': 'Debes adjuntar un archivo en el campo "archivo".'}, status=status.HTTP_400_BAD_REQUEST)
+
+        user = request.user
+        is_admin = user.is_staff or user.is_superuser
+        user_profile = None
+        try:
+            user_profile = user.profile
+            if hasattr(user_profile, 'rol') and user_profile.rol == 'ADMIN':
+                is_admin = True
+        except UserProfile.DoesNotExist:
+            pass
+
+        sede_forzada = None
+        sede_por_defecto = None
+        if not is_admin:
+            sede_forzada = getattr(user_profile, 'sede', None)
+            if sede_forzada is None:
+                return Response({'detail': 'Usuario sin sede asignada.'}, status=status.HTTP_403_FORBIDDEN)
+        else:
+            sede_id = request.data.get('sede') or request.query_params.get('sede')
+            if sede_id and sede_id != '0':
+                sede_por_defecto = Sede.objects.filter(pk=sede_id).first()
+
+        importador = ImportadorEquipos(
+            usuario=user,
+            sede_forzada=sede_forzada,
+            sede_por_defecto=sede_por_defecto,
+            omitir_errores=str(request.data.get('omitir_errores', '')).lower() in ('1', 'true', 'si'),
+            simulacion=str(request.data.get('simulacion', '')).lower() in ('1', 'true', 'si'),
+        )
+        try:
+            resultado = importador.importar(archivo, archivo.name)
+        except ErrorArchivo as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if resultado['errores'] and not importador.omitir_errores:
+            return Response(resultado, status=status.HTTP_400_BAD_REQUEST)
+        codigo = status.HTTP_200_OK if importador.simulacion else status.HTTP_201_CREATED
+        return Response(resultado, status=codigo)
+
+    @action(detail=False, methods=['post'], url_path='actualizar-masivo')
+    def actualizar_masivo(self, request):
+        """
+        Aplica un mismo cambio (sede, estados o empleado) a muchos equipos en una sola
+        transacción. Los equipos se indican con `ids` o con los filtros del listado en
+        la URL; solo se modifican equipos dentro del alcance de sede del usuario.
+        """
+        serializer = EquipoActualizacionMasivaSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data.get('ids')
+        cambios = serializer.cambios
+
+        queryset = self.filter_queryset(self.get_queryset())
+        if ids:
+            queryset = queryset.filter(pk__in=ids)
+            encontrados = set(queryset.values_list('pk', flat=True))
+            faltantes = sorted(set(ids) - encontrados)
+            if faltantes:
+                return Response(
+                    {'detail': 'Algunos equipos no existen o no pertenecen a tu sede.', 'ids': faltantes},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+        elif not any(nombre in request.query_params for nombre in self.filterset_class.base_filters):
+            return Response(
+                {'detail': 'Indica los equipos con "ids" o con al menos un filtro en la URL.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # IsAdminOrOwnerBySede: un usuario que no es admin no puede mover equipos a otra sede.
+        if 'sede' in cambios:
+            destino = Equipo(sede=cambios['sede'])
+            if not IsAdminOrOwnerBySede().has_object_permission(request, self, destino):
+                return Response(
+                    {'detail': 'No tienes permiso para mover equipos a esa sede.'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+
+        modificados = actualizar_equipos_en_bloque(queryset, cambios, usuario=request.user)
+
+        return Response({
+            'actualizados': len(modificados),
+            'ids': modificados,
+        }, status=status.HTTP_200_OK)
+
     def destroy(self, request, *args, **kwargs):
         try:
             instance = self.get_object()
@@ -205,9 +438,11 @@ class MantenimientoViewSet(viewsets.ModelViewSet):
 
 
 # Vistas para el modelo Periferico
-class PerifericoListCreateAPIView(generics.ListCreateAPIView):
+class PerifericoListCreateAPIView(ConditionalGetMixin, generics.ListCreateAPIView):
     serializer_class = PerifericoSerializer
     permission_classes = [IsAuthenticated]
+    conditional_related_timestamps = ['equipo_asociado__actualizado_en']
+    conditional_related_models = [Sede, Empleado]
 
     def perform_create(self, serializer):
         """Asigna automáticamente la sede del usuario al crear un periférico."""
@@ -251,7 +486,10 @@ class PerifericoListCreateAPIView(generics.ListCreateAPIView):
             if user.is_staff or user.is_superuser:
                 is_admin = True
 
-        queryset = Periferico.objects.all()
+        queryset = PerifericoSerializer.setup_eager_loading(
+            Periferico.objects.all(),
+            PerifericoSerializer.get_requested_fields(self.request)
+        )
 
         if is_admin:
             sede_id = self.request.query_params.get('sede') or self.request.query_params.get('sede_id')
@@ -270,15 +508,18 @@ class PerifericoListCreateAPIView(generics.ListCreateAPIView):
 
         return Periferico.objects.none()
 
-class PerifericoRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
+class PerifericoRetrieveUpdateDestroyAPIView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Periferico.objects.all()
     serializer_class = PerifericoSerializer
     permission_classes = [IsAuthenticated, IsAdminOrOwnerBySede] # <-- APLICAR
+    conditional_related_timestamps = ['equipo_asociado__actualizado_en']
+    conditional_related_models = [Sede, Empleado]
 
 # Vistas para el modelo Licencia
-class LicenciaListCreateAPIView(generics.ListCreateAPIView):
+class LicenciaListCreateAPIView(ConditionalGetMixin, generics.ListCreateAPIView):
     serializer_class = LicenciaSerializer
     permission_classes = [IsAuthenticated]
+    conditional_related_timestamps = ['equipo_asociado__actualizado_en']
 
     def get_queryset(self):
         user = self.request.user
@@ -295,7 +536,10 @@ class LicenciaListCreateAPIView(generics.ListCreateAPIView):
             if user.is_staff or user.is_superuser:
                 is_admin = True
 
-        queryset = Licencia.objects.all()
+        queryset = LicenciaSerializer.setup_eager_loading(
+            Licencia.objects.all(),
+            LicenciaSerializer.get_requested_fields(self.request)
+        )
 
         if is_admin:
             sede_id = self.request.query_params.get('sede') or self.request.query_params.get('sede_id')
@@ -308,10 +552,11 @@ class LicenciaListCreateAPIView(generics.ListCreateAPIView):
 
         return Licencia.objects.none()
 
-class LicenciaRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
+class LicenciaRetrieveUpdateDestroyAPIView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Licencia.objects.all()
     serializer_class = LicenciaSerializer
     permission_classes = [IsAuthenticated, IsAdminOrOwnerBySede] # <-- APLICAR
+    conditional_related_timestamps = ['equipo_asociado__actualizado_en']
 
 # Vistas para el modelo Pasisalvo
 class PasisalvoListCreateAPIView(generics.ListCreateAPIView):
@@ -469,7 +714,56 @@ class HistorialMovimientoEquipoListAPIView(generics.ListAPIView):
 
         return HistorialMovimientoEquipo.objects.none()
 
-from datetime import datetime, timedelta
+def _sede_dashboard(request):
+    """
+    Sede de las estadísticas: la del perfil para usuarios no administradores; los
+    administradores pueden pedir una con ?sede= (o ?sede_id=), o todas (None).
+    """
+    user = request.user
+
+    is_admin = False
+    user_profile = None
+    try:
+        user_profile = user.profile
+        if user.is_staff or user.is_superuser or (hasattr(user_profile, 'rol') and user_profile.rol == 'ADMIN'):
+            is_admin = True
+    except UserProfile.DoesNotExist:
+        if user.is_staff or user.is_superuser:
+            is_admin = True
+
+    if not is_admin:
+        sede = getattr(user_profile, 'sede', None)
+        if not sede:
+            raise PermissionDenied("Usuario sin sede asignada.")
+        return sede
+    sede_id = request.query_params.get('sede') or request.query_params.get('sede_id')
+    if sede_id and sede_id != '0':
+        try:
+            return Sede.objects.get(id=sede_id)
+        except (Sede.DoesNotExist, ValueError):
+            pass
+    return None
+
+
+def _rango_fechas(request, dias):
+    """
+    ?desde= y ?hasta= (YYYY-MM-DD); por defecto, los últimos `dias` días hasta hoy.
+    """
+    fechas = {}
+    for nombre in ('desde', 'hasta'):
+        texto = request.query_params.get(nombre)
+        try:
+            fechas[nombre] = parse_date(texto) if texto else None
+        except ValueError:
+            fechas[nombre] = None
+        if texto and fechas[nombre] is None:
+            raise ValidationError({nombre: "Fecha inválida; use el formato YYYY-MM-DD."})
+    hasta = fechas['hasta'] or timezone.now().date()
+    desde = fechas['desde'] or hasta - timedelta(days=dias)
+    if desde > hasta:
+        raise ValidationError({'desde': "No puede ser posterior a 'hasta'."})
+    return desde, hasta
+
 
 class DashboardStatsView(APIView):
     permission_classes = [IsAuthenticated]
@@ -477,15 +771,150 @@ class DashboardStatsView(APIView):
     def get(self, request, format=None):
         """
         Calcula y devuelve estadísticas clave para el dashboard, filtradas por sede para usuarios no administradores.
+        Se sirven desde el caché por sede de inventory.dashboard.
         """
-        user = request.user
-        
-        # Definir QuerySets base
-        equipos_qs = Equipo.objects.all() # Se incluyen todos para contar los de baja
-        mantenimientos_qs = Mantenimiento.objects.all()
-        perifericos_qs = Periferico.objects.all()
-        licencias_qs = Licencia.objects.all()
-        usuarios_qs = User.objects.all()
+        stats = estadisticas_dashboard_cacheadas(_sede_dashboard(request))
+        return Response(stats, status=status.HTTP_200_OK)
+
+class DashboardTendenciasView(APIView):
+    """
+    GET /api/dashboard/tendencias/?desde=YYYY-MM-DD&hasta=YYYY-MM-DD[&sede=]
+
+    Serie diaria de las estadísticas guardadas por registrar_estadisticas_diarias
+    (últimos 30 días por defecto). Los administradores ven todas las sedes sumadas o
+    la que pidan; los demás usuarios, solo la suya.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, format=None):
+        sede = _sede_dashboard(request)
+        desde, hasta = _rango_fechas(request, dias=30)
+        return Response({
+            'desde': desde,
+            'hasta': hasta,
+            'sede': sede.pk if sede else None,
+            'results': tendencias_diarias(desde, hasta, sede),
+        })
+
+class DashboardSeriesView(APIView):
+    """
+    GET /api/dashboard/series/?intervalo=dia|semana|mes&desde=&hasta=[&sede=&tipo_mantenimiento=&tipo_equipo=]
+
+    Mantenimientos creados y finalizados, asignaciones y bajas de equipos por periodo
+    (últimos 90 días por día, por defecto), agrupados en la base de datos. Mismo
+    alcance por sede que el dashboard.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, format=None):
+        sede = _sede_dashboard(request)
+        desde, hasta = _rango_fechas(request, dias=90)
+        intervalo = request.query_params.get('intervalo', 'dia')
+        try:
+            results = series_temporales(
+                desde, hasta, intervalo, sede=sede,
+                tipo_mantenimiento=request.query_params.get('tipo_mantenimiento'),
+                tipo_equipo=request.query_params.get('tipo_equipo'),
+            )
+        except ValueError as e:
+            raise ValidationError({'intervalo': str(e)})
+        return Response({
+            'intervalo': intervalo,
+            'desde': results[0]['periodo'],
+            'hasta': hasta,
+            'sede': sede.pk if sede else None,
+            'results': results,
+        })
+
+class DashboardSlaView(APIView):
+    """
+    GET /api/dashboard/sla/[?sede=]
+
+    Tiempo de resolución de mantenimientos (media, mediana y p90 en días), tasa de
+    finalización tarde y antigüedad del backlog abierto, en general, por responsable y
+    por sede. En caché; se invalida con cada cambio de mantenimientos de la sede
+    (finalizar, cancelar, crear...).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, format=None):
+        sede = _sede_dashboard(request)
+        return Response({'sede': sede.pk if sede else None, **analitica_sla_cacheada(sede)})
+
+class HistorialEquipoFilter(django_filters.rest_framework.FilterSet):
+    campo_modificado = django_filters.CharFilter(method='filter_by_campo', label='Campo Modificado')
+    usuario = django_filters.NumberFilter(field_name='usuario_id', label='Usuario')
+    equipo = django_filters.NumberFilter(field_name='equipo_id', label='Equipo')
+    tipo_accion = django_filters.ChoiceFilter(choices=HistorialEquipo.TIPO_ACCION_CHOICES, label='Tipo de Acción')
+    fecha_desde = django_filters.CharFilter(method='filter_by_fecha_desde', label='Desde')
+    fecha_hasta = django_filters.CharFilter(method='filter_by_fecha_hasta', label='Hasta')
+
+    class Meta:
+        model = HistorialEquipo
+        fields = ['campo_modificado', 'usuario', 'equipo', 'tipo_accion']
+
+    def filter_by_campo(self, queryset, name, value):
+        # Acepta el nombre del campo o su etiqueta; las filas compactas lo tienen como llave del diff.
+        field = campo_historial_equipo(value)
+        if field is None:
+            return queryset.filter(campo_modificado=value)
+        return queryset.filter(Q(campo_modificado=str(field.verbose_name)) | Q(cambios__has_key=field.name))
+
+    def filter_by_fecha_desde(self, queryset, name, value):
+        return queryset.filter(fecha_cambio__gte=self._instante(name, value, fin_del_dia=False))
+
+    def filter_by_fecha_hasta(self, queryset, name, value):
+        return queryset.filter(fecha_cambio__lte=self._instante(name, value, fin_del_dia=True))
+
+    @staticmethod
+    def _instante(name, value, fin_del_dia):
+        instante = parsear_instante(value, fin_del_dia)
+        if instante is None:
+            raise ValidationError({name: 'Fecha inválida. Use AAAA-MM-DD o fecha y hora ISO 8601.'})
+        return instante
+
+
+class HistorialEquipoListView(generics.ListAPIView):
+    """
+    Historial de cambios de un equipo, del más reciente al más antiguo. Admite los
+    filtros de HistorialEquipoFilter y paginación por cursor (?page_size= / ?cursor=),
+    que recorre el índice (equipo, -fecha_cambio, -id).
+    """
+    serializer_class = HistorialEquipoSerializer
+    permission_classes = [IsAuthenticated, IsAdminOrOwnerBySede]
+    filter_backends = [django_filters.rest_framework.DjangoFilterBackend]
+    filterset_class = HistorialEquipoFilter
+
+    def get_queryset(self):
+        # El permiso se comprueba con el equipo y su sede leídos en una sola consulta.
+        equipo = get_object_or_404(
+            Equipo.objects.select_related('sede').only('id', 'sede'), pk=self.kwargs['equipo_pk']
+        )
+        self.check_object_permissions(self.request, equipo)
+        return HistorialEquipo.objects.filter(equipo_id=equipo.pk).select_related('usuario').order_by('-fecha_cambio', '-id')
+
+    def get_serializer_context(self):
+        # Con ?campo_modificado= los registros compactos solo muestran ese campo.
+        context = super().get_serializer_context()
+        field = campo_historial_equipo(self.request.query_params.get('campo_modificado', ''))
+        if field is not None:
+            context['campo_modificado'] = str(field.verbose_name)
+        return context
+
+
+class HistorialEquiposAuditoriaListView(HistorialEquipoListView):
+    """
+    Historial de cambios de todos los equipos visibles para el usuario, para auditoría:
+    los mismos filtros más ?equipo= y ?sede= (solo administradores). Siempre paginado
+    por cursor sobre el índice (-fecha_cambio, -id).
+    """
+    serializer_class = HistorialEquipoAuditoriaSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = RequiredKeysetPagination
+
+    def get_queryset(self):
+        user = self.request.user
+        queryset = HistorialEquipo.objects.select_related('usuario', 'equipo').defer('equipo__busqueda').order_by('-fecha_cambio', '-id')
 
         is_admin = False
         user_profile = None
@@ -497,148 +926,20 @@ class DashboardStatsView(APIView):
             if user.is_staff or user.is_superuser:
                 is_admin = True
 
-        if not is_admin:
-            user_sede = getattr(user_profile, 'sede', None)
-            if user_sede:
-                equipos_qs = equipos_qs.filter(sede=user_sede)
-                mantenimientos_qs = mantenimientos_qs.filter(sede=user_sede)
-                perifericos_qs = perifericos_qs.filter(equipo_asociado__sede=user_sede)
-                licencias_qs = licencias_qs.filter(equipo_asociado__sede=user_sede)
-                usuarios_qs = usuarios_qs.filter(profile__sede=user_sede)
-            else:
-                return Response({"detail": "Usuario sin sede asignada."}, status=403)
-        else:
-            # Si es admin, puede opcionalmente filtrar por sede_id en la URL
-            sede_id = request.query_params.get('sede') or request.query_params.get('sede_id')
+        if is_admin:
+            sede_id = self.request.query_params.get('sede_id') or self.request.query_params.get('sede')
             if sede_id and sede_id != '0':
-                try:
-                    target_sede = Sede.objects.get(id=sede_id)
-                    equipos_qs = equipos_qs.filter(sede=target_sede)
-                    mantenimientos_qs = mantenimientos_qs.filter(sede=target_sede)
-                    perifericos_qs = perifericos_qs.filter(equipo_asociado__sede=target_sede)
-                    licencias_qs = licencias_qs.filter(equipo_asociado__sede=target_sede)
-                    usuarios_qs = usuarios_qs.filter(profile__sede=target_sede)
-                except Sede.DoesNotExist:
-                    pass
-        
-        # QuerySet de equipos activos para la mayoría de las estadísticas
-        equipos_activos_qs = equipos_qs.filter(activo=True)
-
-        # Contadores basados en los QuerySets filtrados
-        total_equipos = equipos_activos_qs.count()
-        equipos_dados_de_baja = equipos_qs.filter(activo=False).count()
-        total_mantenimientos = mantenimientos_qs.count()
-        total_perifericos = perifericos_qs.count()
-        total_licencias = licencias_qs.count()
-        total_usuarios = usuarios_qs.count()
-
-        # Estadísticas basadas en los QuerySets filtrados
-        equipos_por_estado = equipos_activos_qs.values('estado_tecnico').annotate(count=Count('estado_tecnico'))
-        equipos_por_disponibilidad = equipos_activos_qs.values('estado_disponibilidad').annotate(count=Count('estado_disponibilidad'))
-        equipos_por_tipo = equipos_activos_qs.values('tipo_equipo').annotate(count=Count('tipo_equipo'))
-        
-        mantenimientos_por_estado = mantenimientos_qs.values('estado_mantenimiento').annotate(count=Count('estado_mantenimiento'))
-        mantenimientos_por_tipo = mantenimientos_qs.values('tipo_mantenimiento').annotate(count=Count('tipo_mantenimiento'))
-        
-        perifericos_por_tipo = perifericos_qs.values('tipo').annotate(count=Count('tipo'))
-        licencias_por_estado = licencias_qs.values('estado').annotate(count=Count('estado'))
-        
-        # Conteo de mantenimientos "activos" (Pendientes o En proceso)
-        mantenimientos_activos = mantenimientos_qs.filter(
-            estado_mantenimiento__in=['Pendiente', 'En proceso']
-        ).count()
-
-        # Mantenimientos VENCIDOS: Estado Pendiente
-        # Ajuste: Si tiene fecha de finalización (estimada), se usa esa como límite.
-        today = timezone.now().date()
-        mantenimientos_vencidos = mantenimientos_qs.filter(
-            estado_mantenimiento='Pendiente'
-        ).filter(
-            Q(fecha_finalizacion__isnull=False, fecha_finalizacion__lt=today) |
-            Q(fecha_finalizacion__isnull=True, fecha_inicio__lt=today)
-        ).count()
-
-        # Para los próximos mantenimientos (próximos 30 días)
-        proximos_mantenimientos = mantenimientos_qs.filter(
-            estado_mantenimiento='Pendiente',
-            fecha_inicio__gte=today,
-            fecha_inicio__lte=today + timedelta(days=30)
-        ).count()
-
-        # Licencias vencidas
-        licencias_vencidas = licencias_qs.filter(
-            Q(estado='Vencida') | Q(fecha_vencimiento__lt=today)
-        ).distinct().count()
-
-        # Licencias por vencer (próximos 30 días)
-        licencias_por_vencer = licencias_qs.filter(
-            fecha_vencimiento__gte=today,
-            fecha_vencimiento__lte=today + timedelta(days=30)
-        ).count()
-
-        # Mantenimientos finalizados TARDE
-        mantenimientos_finalizados_tarde = mantenimientos_qs.filter(
-            estado_mantenimiento='Finalizado',
-            fecha_real_finalizacion__gt=F('fecha_finalizacion')
-        ).count()
-
-        stats = {
-            'total_equipos': total_equipos,
-            'equipos_dados_de_baja': equipos_dados_de_baja,
-            'total_mantenimientos': total_mantenimientos,
-            'total_perifericos': total_perifericos,
-            'total_licencias': total_licencias,
-            'total_usuarios': total_usuarios,
-            'proximos_mantenimientos': proximos_mantenimientos,
-            'mantenimientos_activos': mantenimientos_activos,
-            'mantenimientos_vencidos': mantenimientos_vencidos,
-            'mantenimientos_finalizados_tarde': mantenimientos_finalizados_tarde,
-            'licencias_vencidas': licencias_vencidas,
-            'licencias_por_vencer': licencias_por_vencer,
-            'equipos_por_estado': list(equipos_por_estado),
-            'equipos_por_disponibilidad': list(equipos_por_disponibilidad),
-            'equipos_por_tipo': list(equipos_por_tipo),
-            'mantenimientos_por_estado': list(mantenimientos_por_estado),
-            'mantenimientos_por_tipo': list(mantenimientos_por_tipo),
-            'perifericos_por_tipo': list(perifericos_por_tipo),
-            'licencias_por_estado': list(licencias_por_estado),
-        }
-        return Response(stats, status=status.HTTP_200_OK)
+                queryset = queryset.filter(equipo__sede_id=sede_id)
+            return queryset
 
-class HistorialEquipoListView(generics.ListAPIView):
-    """
-    API view to retrieve the history of changes for a specific equipo.
-    """
-    serializer_class = HistorialEquipoSerializer
-    permission_classes = [IsAuthenticated, IsAdminOrOwnerBySede]
+        if user_profile and user_profile.sede_id:
+            return queryset.filter(equipo__sede_id=user_profile.sede_id)
 
-    def get_queryset(self):
-        """
-        This view returns a list of history records for the equipo specified
-        in the URL, but first, it checks if the user has permission to view
-        the parent 'Equipo' object.
-        """
-        equipo_pk = self.kwargs['equipo_pk']
-        
-        # 1. Fetch the parent object.
-        try:
-            equipo = Equipo.objects.get(pk=equipo_pk)
-        except Equipo.DoesNotExist:
-            # This will result in a 404 response, which is appropriate.
-            # The queryset will be empty and DRF will handle it.
-            return HistorialEquipo.objects.none()
-
-        # 2. Manually check permissions on the parent object.
-        # This will trigger IsAdminOrOwnerBySede.has_object_permission(..., equipo)
-        self.check_object_permissions(self.request, equipo)
-        
-        # 3. If permission is granted, return the actual queryset.
-        return HistorialEquipo.objects.filter(equipo__pk=equipo_pk)
+        return HistorialEquipo.objects.none()
 
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from .serializers import PerifericoSerializer
-from empleados.models import Empleado
 from empleados.serializers import EmpleadoSerializer
 
 @api_view(['GET'])
@@ -649,8 +950,18 @@ def clearance_info(request, empleado_id):
     except Empleado.DoesNotExist:
         return Response({"detail": "Empleado no encontrado"}, status=404)
 
-    equipos_activos = Equipo.objects.filter(empleado_asignado=empleado, activo=True)
-    perifericos_activos = Periferico.objects.filter(empleado_asignado=empleado)
+    # Lo que tiene a cargo sale de sus asignaciones abiertas (index-only scan sobre
+    # asignacion_abierta_empleado); solo se cargan los objetos si hay alguno. Como
+    # siempre, los equipos dados de baja no cuentan aunque sigan asignados.
+    abiertas = list(AsignacionAbierta.objects.filter(empleado=empleado).values_list('equipo_id', 'periferico_id'))
+    equipo_ids = [equipo_id for equipo_id, _ in abiertas if equipo_id is not None]
+    periferico_ids = [periferico_id for _, periferico_id in abiertas if periferico_id is not None]
+    equipos_activos = list(EquipoSerializer.setup_eager_loading(
+        Equipo.objects.filter(pk__in=equipo_ids, activo=True)
+    )) if equipo_ids else []
+    perifericos_activos = PerifericoSerializer.setup_eager_loading(
+        Periferico.objects.filter(pk__in=periferico_ids)
+    ) if periferico_ids else Periferico.objects.none()
     historial_entregas = HistorialMovimientoEquipo.objects.filter(
         empleado_asignado=empleado, 
         fecha_devolucion__isnull=False
@@ -663,6 +974,6 @@ def clearance_info(request, empleado_id):
             "perifericos": PerifericoSerializer(perifericos_activos, many=True).data,
         },
         "entregados_historial": HistorialMovimientoEquipoSerializer(historial_entregas, many=True).data,
-        "esta_a_paz_y_salvo": equipos_activos.count() == 0 and perifericos_activos.count() == 0
+        "esta_a_paz_y_salvo": not equipos_activos and not periferico_ids
     }
     return Response(data)
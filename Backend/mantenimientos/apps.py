@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class MantenimientosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mantenimientos'
+
+    def ready(self):
+        import mantenimientos.signals
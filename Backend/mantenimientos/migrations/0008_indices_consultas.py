@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-17 19:44
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # Índices creados sin bloquear escrituras en tablas con datos.
+    atomic = False
+
+    dependencies = [
+        ('inventory', '0015_indices_consultas'),
+        ('mantenimientos', '0007_historialaccionmantenimiento'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='mantenimiento',
+            index=models.Index(fields=['sede', 'estado_mantenimiento', '-fecha_inicio'], name='mant_sede_estado_inicio'),
+        ),
+        AddIndexConcurrently(
+            model_name='mantenimiento',
+            index=models.Index(fields=['-fecha_inicio'], name='mant_fecha_inicio'),
+        ),
+    ]
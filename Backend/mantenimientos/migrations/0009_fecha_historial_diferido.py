@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-17 19:57
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mantenimientos', '0008_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='historialaccionmantenimiento',
+            name='fecha',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations
+
+from inventory.partitions import desparticionar_tabla, particionar_tabla
+
+TABLA = 'mantenimientos_historialaccionmantenimiento'
+
+
+def particionar(apps, schema_editor):
+    particionar_tabla(schema_editor, TABLA)
+
+
+def desparticionar(apps, schema_editor):
+    desparticionar_tabla(schema_editor, TABLA)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0019_particionar_historial'),
+        ('mantenimientos', '0009_fecha_historial_diferido'),
+    ]
+
+    operations = [
+        migrations.RunPython(particionar, desparticionar),
+    ]
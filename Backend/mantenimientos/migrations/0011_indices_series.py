@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-17 21:10
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # Índices creados sin bloquear escrituras en tablas con datos.
+    atomic = False
+
+    dependencies = [
+        ('mantenimientos', '0010_particionar_historial'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='mantenimiento',
+            index=models.Index(fields=['creado_en'], name='mant_creado_en'),
+        ),
+        AddIndexConcurrently(
+            model_name='mantenimiento',
+            index=models.Index(condition=models.Q(('estado_mantenimiento', 'Finalizado')), fields=['fecha_real_finalizacion'], name='mant_fecha_real_finalizado'),
+        ),
+    ]
@@ -1,8 +1,9 @@
-from django.db import models
+from django.db import models, router, transaction
 from django.contrib.auth.models import User
 from inventory.models import Equipo # Asumo que el modelo Equipo está en la app 'inventory'
 from  sede.models import Sede
 from datetime import date
+from django.utils import timezone
 
 class Mantenimiento(models.Model):
     """
@@ -47,6 +48,26 @@ class Mantenimiento(models.Model):
     creado_en = models.DateTimeField(auto_now_add=True)
     actualizado_en = models.DateTimeField(auto_now=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Estado y equipo leídos de la base: post_delete descuenta el contador sin
+        # volver a consultar (save() los relee bloqueados, ver mantenimientos.signals).
+        if 'estado_mantenimiento' in field_names and 'equipo_id' in field_names:
+            instance._estado_original = (instance.estado_mantenimiento, instance.equipo_id)
+        # Sede leída de la base: si cambia, el dashboard invalida también la de origen
+        # (ver inventory.signals).
+        if 'sede_id' in field_names:
+            instance._sede_original = instance.sede_id
+        return instance
+
+    def save(self, *args, **kwargs):
+        # En una transacción (sin savepoint: si ya hay una abierta, se une a ella), para
+        # que la fila que bloquea pre_save siga bloqueada hasta ajustar el contador.
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+
     @property
     def fuera_de_fecha(self):
         """
@@ -73,6 +94,17 @@ class Mantenimiento(models.Model):
                 name='unique_pending_or_in_process_maintenance_per_equipo'
             )
         ]
+        indexes = [
+            # Listados por sede y estado, ordenados por fecha de inicio.
+            models.Index(fields=['sede', 'estado_mantenimiento', '-fecha_inicio'], name='mant_sede_estado_inicio'),
+            models.Index(fields=['-fecha_inicio'], name='mant_fecha_inicio'),
+            # Series temporales de creados y finalizados (inventory.dashboard.series_temporales).
+            models.Index(fields=['creado_en'], name='mant_creado_en'),
+            models.Index(
+                fields=['fecha_real_finalizacion'], condition=models.Q(estado_mantenimiento='Finalizado'),
+                name='mant_fecha_real_finalizado',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.tipo_mantenimiento} en {self.equipo.nombre} - {self.estado_mantenimiento}"
@@ -94,7 +126,7 @@ class HistorialAccionMantenimiento(models.Model):
     usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     accion = models.CharField(max_length=100) # Ej: "Inició proceso", "Finalizó mantenimiento"
     detalle = models.TextField(blank=True)
-    fecha = models.DateTimeField(auto_now_add=True)
+    fecha = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         ordering = ['-fecha']
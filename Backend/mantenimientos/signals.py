@@ -0,0 +1,63 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from inventory.models import Equipo
+from .models import Mantenimiento
+
+
+def _ajustar_contador(equipo_id, delta):
+    if equipo_id is not None:
+        Equipo.objects.filter(pk=equipo_id).update(
+            mantenimientos_finalizados=F('mantenimientos_finalizados') + delta
+        )
+
+
+def _equipo_finalizado(estado):
+    """
+    Equipo al que cuenta el mantenimiento como finalizado, o None.
+    """
+    if estado is None:
+        return None
+    estado_mantenimiento, equipo_id = estado
+    return equipo_id if estado_mantenimiento == 'Finalizado' else None
+
+
+@receiver(pre_save, sender=Mantenimiento)
+def cache_mantenimiento_original_state(sender, instance, using=None, update_fields=None, **kwargs):
+    """
+    Estado y equipo anteriores, leídos con SELECT ... FOR UPDATE dentro de la
+    transacción de save(): no los que traía la instancia al cargarse. Si dos solicitudes
+    finalizan el mismo mantenimiento, la segunda espera a que la primera confirme y ya
+    lo ve 'Finalizado', así que el contador sube una sola vez.
+    """
+    if instance.pk is None:
+        return
+    if update_fields is not None and not {'estado_mantenimiento', 'equipo'}.intersection(update_fields):
+        return
+    instance._estado_original = Mantenimiento.objects.using(using).select_for_update().filter(
+        pk=instance.pk
+    ).values_list('estado_mantenimiento', 'equipo_id').first()
+
+
+@receiver(post_save, sender=Mantenimiento)
+def update_equipo_finalized_counter(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Mantiene Equipo.mantenimientos_finalizados cuando un mantenimiento entra o sale de
+    'Finalizado' (o cambia de equipo estando finalizado), con UPDATE atómicos.
+    """
+    if update_fields is not None and not {'estado_mantenimiento', 'equipo'}.intersection(update_fields):
+        return
+    nuevo = (instance.estado_mantenimiento, instance.equipo_id)
+    anterior = None if created else getattr(instance, '_estado_original', None)
+    antes, despues = _equipo_finalizado(anterior), _equipo_finalizado(nuevo)
+    if antes != despues:
+        _ajustar_contador(antes, -1)
+        _ajustar_contador(despues, 1)
+    instance._estado_original = nuevo
+
+
+@receiver(post_delete, sender=Mantenimiento)
+def decrement_equipo_finalized_counter(sender, instance, **kwargs):
+    estado = getattr(instance, '_estado_original', None) or (instance.estado_mantenimiento, instance.equipo_id)
+    _ajustar_contador(_equipo_finalizado(estado), -1)
@@ -1,3 +1,190 @@
-from django.test import TestCase
+import io
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from rest_framework.test import APITestCase
+
+from inventory.models import Equipo, HistorialEquipo
+from sede.models import Sede
+from .models import HistorialAccionMantenimiento, Mantenimiento
+
+
+class ContadorMantenimientosTests(APITestCase):
+    """
+    Equipo.mantenimientos_finalizados sigue las transiciones de los mantenimientos y
+    permite filtrar y agrupar por diagnóstico de salud sin contar fila por fila.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sede = Sede.objects.create(nombre='Sede Salud')
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        cls.equipo = Equipo.objects.create(nombre='Salud 1', marca='HP', modelo='X', serial='SA-1', sede=cls.sede)
+        cls.otro = Equipo.objects.create(nombre='Salud 2', marca='HP', modelo='X', serial='SA-2', sede=cls.sede)
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+
+    def finalizado(self, equipo, **kwargs):
+        return Mantenimiento.objects.create(
+            equipo=equipo, sede=self.sede, tipo_mantenimiento='Correctivo', estado_mantenimiento='Finalizado', **kwargs
+        )
+
+    def contador(self, equipo):
+        equipo.refresh_from_db(fields=['mantenimientos_finalizados'])
+        return equipo.mantenimientos_finalizados
+
+    def test_sigue_las_transiciones(self):
+        mantenimiento = Mantenimiento.objects.create(equipo=self.equipo, sede=self.sede, tipo_mantenimiento='Preventivo')
+        self.assertEqual(self.contador(self.equipo), 0)
+
+        mantenimiento = Mantenimiento.objects.get(pk=mantenimiento.pk)
+        mantenimiento.estado_mantenimiento = 'Finalizado'
+        mantenimiento.save(update_fields=['estado_mantenimiento'])
+        mantenimiento.save()
+        self.assertEqual(self.contador(self.equipo), 1)
+
+        mantenimiento.equipo = self.otro
+        mantenimiento.save()
+        self.assertEqual((self.contador(self.equipo), self.contador(self.otro)), (0, 1))
+
+        mantenimiento.delete()
+        self.assertEqual(self.contador(self.otro), 0)
+
+    def test_guardar_equipo_no_pisa_el_contador(self):
+        equipo = Equipo.objects.get(pk=self.equipo.pk)
+        self.finalizado(self.equipo)
+        equipo.notas = 'Revisado'
+        equipo.save()
+        self.assertEqual(self.contador(self.equipo), 1)
+        self.assertFalse(HistorialEquipo.objects.filter(campo_modificado='Mantenimientos Finalizados').exists())
+
+    def test_filtro_y_dashboard_por_salud(self):
+        for _ in range(7):
+            self.finalizado(self.equipo)
+        response = self.client.get('/api/equipos/?salud=critico')
+        self.assertEqual([e['id'] for e in response.data], [self.equipo.pk])
+        self.assertEqual(response.data[0]['diagnostico_salud']['rango'], 'Crítico')
+        self.assertEqual(response.data[0]['total_mantenimientos'], 7)
+
+        response = self.client.get('/api/dashboard/stats/')
+        self.assertEqual(
+            {rango['salud']: rango['count'] for rango in response.data['equipos_por_salud']},
+            {'optimo': 1, 'advertencia': 0, 'critico': 1}
+        )
+
+    def test_comando_corrige_desfases(self):
+        self.finalizado(self.equipo)
+        Equipo.objects.filter(pk=self.equipo.pk).update(mantenimientos_finalizados=5)
+        salida = io.StringIO()
+        call_command('recalcular_mantenimientos_finalizados', stdout=salida)
+        self.assertIn('1 counters fixed', salida.getvalue())
+        self.assertEqual(self.contador(self.equipo), 1)
+
+    def test_instancia_desactualizada_no_duplica(self):
+        mantenimiento = Mantenimiento.objects.create(equipo=self.equipo, sede=self.sede, tipo_mantenimiento='Preventivo')
+        primera, segunda = Mantenimiento.objects.get(pk=mantenimiento.pk), Mantenimiento.objects.get(pk=mantenimiento.pk)
+        for instancia in (primera, segunda):
+            instancia.estado_mantenimiento = 'Finalizado'
+            instancia.save()
+        self.assertEqual(self.contador(self.equipo), 1)
+
+
+class ContadorMantenimientosConcurrenciaTests(TransactionTestCase):
+    """
+    Dos finalizaciones simultáneas del mismo mantenimiento: pre_save bloquea la fila, la
+    segunda espera a la primera y el contador sube una vez.
+    """
+
+    def test_finalizaciones_simultaneas(self):
+        sede = Sede.objects.create(nombre='Sede Salud')
+        equipo = Equipo.objects.create(nombre='Salud 1', marca='HP', modelo='X', serial='SA-1', sede=sede)
+        pk = Mantenimiento.objects.create(equipo=equipo, sede=sede, tipo_mantenimiento='Preventivo').pk
+        cargadas = threading.Barrier(2)
+
+        def finalizar():
+            try:
+                instancia = Mantenimiento.objects.get(pk=pk)
+                cargadas.wait()
+                instancia.estado_mantenimiento = 'Finalizado'
+                instancia.save()
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            for futuro in [executor.submit(finalizar) for _ in range(2)]:
+                futuro.result()
+        equipo.refresh_from_db(fields=['mantenimientos_finalizados'])
+        self.assertEqual(equipo.mantenimientos_finalizados, 1)
+
+
+
+
+class TransicionesMantenimientoTests(APITestCase):
+    """
+    iniciar_proceso, finalizar y cancelar: cada acción cambia el estado, ajusta el
+    contador del equipo y registra el historial en una sola transacción.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sede = Sede.objects.create(nombre='Sede Taller')
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        cls.equipo = Equipo.objects.create(nombre='Taller 1', marca='HP', modelo='X', serial='TA-1', sede=cls.sede)
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+        self.mantenimiento = Mantenimiento.objects.create(equipo=self.equipo, sede=self.sede, tipo_mantenimiento='Correctivo')
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        ajustes = override_settings(MEDIA_ROOT=media.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+    def contador(self):
+        self.equipo.refresh_from_db(fields=['mantenimientos_finalizados'])
+        return self.equipo.mantenimientos_finalizados
+
+    def finalizar(self):
+        return self.client.post(
+            f'/api/mantenimientos/{self.mantenimiento.pk}/finalizar/',
+            {'evidencia_finalizacion': SimpleUploadedFile('acta.pdf', b'%PDF')}, format='multipart',
+        )
+
+    def test_finalizar_cuenta_una_vez(self):
+        self.assertEqual(self.client.post(f'/api/mantenimientos/{self.mantenimiento.pk}/iniciar_proceso/').status_code, 200)
+        self.assertEqual(self.finalizar().status_code, 200)
+        self.assertEqual(self.finalizar().status_code, 400)
+        self.assertEqual(self.contador(), 1)
+        self.mantenimiento.refresh_from_db()
+        self.assertIsNotNone(self.mantenimiento.fecha_real_finalizacion)
+        self.assertEqual(
+            list(HistorialAccionMantenimiento.objects.filter(mantenimiento=self.mantenimiento).order_by('id').values_list('accion', flat=True)),
+            ['Inició proceso', 'Finalizó mantenimiento'],
+        )
+
+    def test_finalizado_no_se_cancela(self):
+        self.finalizar()
+        response = self.client.post(f'/api/mantenimientos/{self.mantenimiento.pk}/cancelar/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.contador(), 1)
+
+    def test_cancelado_no_se_finaliza(self):
+        self.assertEqual(self.client.post(f'/api/mantenimientos/{self.mantenimiento.pk}/cancelar/').status_code, 200)
+        self.assertEqual(self.finalizar().status_code, 400)
+        self.assertEqual(self.contador(), 0)
+
+    def test_error_en_el_historial_revierte_la_finalizacion(self):
+        with mock.patch('mantenimientos.views.registrar_historial', side_effect=RuntimeError('historial')):
+            with self.assertRaises(RuntimeError):
+                self.finalizar()
+        self.mantenimiento.refresh_from_db()
+        self.assertEqual(self.mantenimiento.estado_mantenimiento, 'Pendiente')
+        self.assertEqual(self.contador(), 0)
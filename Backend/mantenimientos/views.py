@@ -1,18 +1,25 @@
+from django.contrib.auth.models import User
 from .models import Mantenimiento, EvidenciaMantenimiento, HistorialAccionMantenimiento
 from .serializers import MantenimientoSerializer, HistorialAccionMantenimientoSerializer
 from rest_framework import viewsets, status, generics
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from django.db import transaction
 from django.db.models import Q
 from datetime import date
 from django.utils import timezone
 from rest_framework.permissions import IsAuthenticated
 from usuarios.permissions import IsAdminOrOwnerBySede
 from usuarios.models import UserProfile
+from sede.models import Sede
+from inventory.conditional import ConditionalGetMixin
+from inventory.outbox import registrar_historial
 
-class MantenimientoViewSet(viewsets.ModelViewSet):
+class MantenimientoViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = MantenimientoSerializer
     permission_classes = [IsAuthenticated, IsAdminOrOwnerBySede]
+    conditional_related_timestamps = ['equipo__actualizado_en']
+    conditional_related_models = [Sede, User, EvidenciaMantenimiento]
 
     def get_queryset(self):
         user = self.request.user
@@ -101,6 +108,7 @@ class MantenimientoViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def iniciar_proceso(self, request, pk=None):
         """
         Cambia el estado de un mantenimiento a 'En proceso'.
@@ -114,21 +122,21 @@ class MantenimientoViewSet(viewsets.ModelViewSet):
             )
         
         instance.estado_mantenimiento = 'En proceso'
-        instance.save(update_fields=['estado_mantenimiento'])
+        instance.save(update_fields=['estado_mantenimiento', 'actualizado_en'])
         
         # Registrar en el historial
-        from .models import HistorialAccionMantenimiento
-        HistorialAccionMantenimiento.objects.create(
-            mantenimiento=instance,
-            usuario=request.user,
+        registrar_historial(HistorialAccionMantenimiento, crear=[dict(
+            mantenimiento_id=instance.pk,
+            usuario_id=request.user.pk,
             accion="Inició proceso",
             detalle=f"El técnico {request.user.username} cambió el estado a 'En proceso'."
-        )
+        )])
         
         serializer = self.get_serializer(instance)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def finalizar(self, request, pk=None):
         """
         Finaliza un mantenimiento y guarda la evidencia de finalización
@@ -163,18 +171,18 @@ class MantenimientoViewSet(viewsets.ModelViewSet):
         instance.save()
 
         # Registrar en el historial
-        from .models import HistorialAccionMantenimiento
-        HistorialAccionMantenimiento.objects.create(
-            mantenimiento=instance,
-            usuario=request.user,
+        registrar_historial(HistorialAccionMantenimiento, crear=[dict(
+            mantenimiento_id=instance.pk,
+            usuario_id=request.user.pk,
             accion="Finalizó mantenimiento",
             detalle=f"El técnico {request.user.username} marcó el mantenimiento como finalizado."
-        )
+        )])
 
         serializer = self.get_serializer(instance, context={'request': request})
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def cancelar(self, request, pk=None):
         instance = self.get_object()
 
@@ -187,16 +195,15 @@ class MantenimientoViewSet(viewsets.ModelViewSet):
             return Response({'status': 'El mantenimiento ya estaba cancelado.'}, status=status.HTTP_200_OK)
 
         instance.estado_mantenimiento = 'Cancelado'
-        instance.save(update_fields=['estado_mantenimiento'])
+        instance.save(update_fields=['estado_mantenimiento', 'actualizado_en'])
         
         # Registrar en el historial
-        from .models import HistorialAccionMantenimiento
-        HistorialAccionMantenimiento.objects.create(
-            mantenimiento=instance,
-            usuario=request.user,
+        registrar_historial(HistorialAccionMantenimiento, crear=[dict(
+            mantenimiento_id=instance.pk,
+            usuario_id=request.user.pk,
             accion="Canceló mantenimiento",
             detalle=f"Acción realizada por {request.user.username}."
-        )
+        )])
         
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
@@ -4,8 +4,9 @@ from django.contrib.auth.models import User
 from sede.models import Sede
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from inventory.changes import SnapshotMixin
 
-class UserProfile(models.Model):
+class UserProfile(SnapshotMixin, models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     sede = models.ForeignKey(Sede, on_delete=models.SET_NULL, null=True, blank=True)
     cargo = models.CharField(max_length=100, blank=True, null=True) # Nuevo campo